@@ -0,0 +1,94 @@
+"""Micro-benchmark for ImageSignature.compute_differentials.
+
+Compares the shifted-slice implementation with the previous one, which summed
+np.diagflat matrices over every diagonal, and checks that both give the same
+differences.
+
+Usage:
+    python benchmarks/bench_differentials.py
+"""
+from timeit import repeat
+import os
+import sys
+
+import numpy as np
+
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_match.goldberg import ImageSignature  # noqa: E402
+
+
+def diagflat_differentials(grey_level_matrix, diagonal_neighbors=True):
+    """The previous implementation of compute_differentials, kept for comparison."""
+    right_neighbors = -np.concatenate((np.diff(grey_level_matrix),
+                                       np.zeros(grey_level_matrix.shape[0]).
+                                       reshape((grey_level_matrix.shape[0], 1))),
+                                      axis=1)
+    left_neighbors = -np.concatenate((right_neighbors[:, -1:],
+                                      right_neighbors[:, :-1]),
+                                     axis=1)
+
+    down_neighbors = -np.concatenate((np.diff(grey_level_matrix, axis=0),
+                                      np.zeros(grey_level_matrix.shape[1]).
+                                      reshape((1, grey_level_matrix.shape[1]))))
+
+    up_neighbors = -np.concatenate((down_neighbors[-1:], down_neighbors[:-1]))
+
+    if diagonal_neighbors:
+        diagonals = np.arange(-grey_level_matrix.shape[0] + 1,
+                              grey_level_matrix.shape[0])
+
+        upper_left_neighbors = sum(
+            [np.diagflat(np.insert(np.diff(np.diag(grey_level_matrix, i)), 0, 0), i)
+             for i in diagonals])
+        lower_right_neighbors = -np.pad(upper_left_neighbors[1:, 1:],
+                                        (0, 1), mode='constant')
+
+        flipped = np.fliplr(grey_level_matrix)
+        upper_right_neighbors = sum([np.diagflat(np.insert(
+            np.diff(np.diag(flipped, i)), 0, 0), i) for i in diagonals])
+        lower_left_neighbors = -np.pad(upper_right_neighbors[1:, 1:],
+                                       (0, 1), mode='constant')
+
+        return np.dstack(np.array([
+            upper_left_neighbors,
+            up_neighbors,
+            np.fliplr(upper_right_neighbors),
+            left_neighbors,
+            right_neighbors,
+            np.fliplr(lower_left_neighbors),
+            down_neighbors,
+            lower_right_neighbors]))
+
+    return np.dstack(np.array([
+        up_neighbors,
+        left_neighbors,
+        right_neighbors,
+        down_neighbors]))
+
+
+def best_time(function, number=200, repeats=5):
+    """Best time per call, in microseconds."""
+    return min(repeat(function, number=number, repeat=repeats)) / number * 1e6
+
+
+def main():
+    rng = np.random.RandomState(0)
+    print('{:>4} {:>9} {:>14} {:>14} {:>8}'.format('n', 'diagonal', 'diagflat (us)',
+                                                  'shifted (us)', 'speedup'))
+    for n in (9, 32):
+        grey_levels = rng.rand(n, n)
+        for diagonal_neighbors in (True, False):
+            expected = diagflat_differentials(grey_levels, diagonal_neighbors)
+            actual = ImageSignature.compute_differentials(grey_levels, diagonal_neighbors)
+            assert np.array_equal(actual, expected)
+
+            before = best_time(lambda: diagflat_differentials(grey_levels, diagonal_neighbors))
+            after = best_time(lambda: ImageSignature.compute_differentials(grey_levels,
+                                                                           diagonal_neighbors))
+            print('{:>4} {:>9} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+                n, str(diagonal_neighbors), before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Import-time benchmark for image_match.
+
+Times a cold import of each module in a fresh interpreter and lists the heavy
+dependencies it pulled in. Modules that only compare stored signatures should
+not load skimage, PIL or multiprocessing; the script exits with an error if
+they do.
+
+Usage:
+    python benchmarks/bench_imports.py
+"""
+import os
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import numpy',
+    'from image_match.goldberg import ImageSignature',
+    'from image_match.signature_database_base import SignatureDatabaseBase',
+    'from image_match.elasticsearch_driver import SignatureES',
+]
+
+# the interpreters import the checkout's image_match, from wherever this is run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ['skimage', 'PIL', 'cairosvg', 'multiprocessing']
+
+TIMER = '''
+import sys, time
+start = time.time()
+{statement}
+elapsed = time.time() - start
+print(elapsed * 1000)
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def cold_import(statement, repeats=5):
+    """Best wall time of the statement in a new interpreter, in ms, and the heavy modules loaded."""
+    times = []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          TIMER.format(statement=statement, heavy=HEAVY)],
+                                         cwd=ROOT)
+        elapsed, loaded = output.decode('utf8').split('\n')[:2]
+        times.append(float(elapsed))
+    return min(times), loaded.split()
+
+
+def main():
+    print('{:<70} {:>9}  {}'.format('statement', 'time (ms)', 'heavy modules loaded'))
+    failed = False
+    for statement in STATEMENTS:
+        elapsed, loaded = cold_import(statement)
+        print('{:<70} {:>9.1f}  {}'.format(statement, elapsed, ', '.join(loaded) or '-'))
+        failed = failed or bool(loaded)
+    if failed:
+        sys.exit('heavy dependencies were imported eagerly')
+
+
+if __name__ == '__main__':
+    main()
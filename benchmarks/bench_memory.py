@@ -0,0 +1,74 @@
+"""Benchmark of the in-memory SignatureMemory backend.
+
+Adds random signatures, which are the worst case for the posting lists since almost every
+word is distinct, and times adding them, merging them into the posting lists, searching,
+saving, and searching again from a fresh instance that maps the saved files.
+
+Usage:
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --images 1000000 --path /tmp/signatures
+"""
+from timeit import default_timer
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_match.memory_driver import SignatureMemory  # noqa: E402
+from image_match.signature_database_base import _record_from_signature  # noqa: E402
+
+
+def search_time(db, queries):
+    """Mean seconds per search."""
+    start = default_timer()
+    for query in queries:
+        db.search_single_record(query)
+    return (default_timer() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=500000, help='number of images (default %(default)s)')
+    parser.add_argument('--path', help='directory to save to (default a temporary one)')
+    args = parser.parse_args()
+
+    path = args.path or tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(0)
+        db = SignatureMemory(path)
+        signatures = rng.randint(-2, 3, (args.images, db.gis.sig_length)).astype('int8')
+
+        start = default_timer()
+        for first in range(0, args.images, 10000):
+            db.insert_many_records([{'path': 'image_%d' % i, 'signature': signatures[i]}
+                                    for i in range(first, min(first + 10000, args.images))])
+        print('{} images added in {:.1f} s'.format(args.images, default_timer() - start))
+
+        start = default_timer()
+        db.refresh()
+        print('posting lists built in {:.1f} s'.format(default_timer() - start))
+
+        queries = [_record_from_signature('query', signatures[i], db.k, db.N)
+                   for i in rng.randint(0, args.images, 200)]
+        print('search: {:.2f} ms'.format(search_time(db, queries) * 1e3))
+
+        start = default_timer()
+        db.save()
+        print('saved in {:.1f} s'.format(default_timer() - start))
+
+        start = default_timer()
+        mapped = SignatureMemory(path)
+        print('mapped in {:.1f} ms'.format((default_timer() - start) * 1e3))
+        print('search, mapped: {:.2f} ms'.format(search_time(mapped, queries) * 1e3))
+    finally:
+        if args.path is None:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
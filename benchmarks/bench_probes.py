@@ -0,0 +1,87 @@
+"""Benchmark of word recall with multi-probe searches.
+
+Signs synthetic images and edited copies of them (rescaled, recompressed, brightened and
+cropped), then reports, for several word settings, how often a copy would be found as a
+candidate -- that is, shares at least one simple word or probe code with its original in the
+same position -- and how often an unrelated image would be. Fewer words (N) mean a smaller
+index and smaller queries; probes (n_probes) win back the recall they lose, at the cost of
+more codes per query.
+
+Usage:
+    python benchmarks/bench_probes.py
+    python benchmarks/bench_probes.py --images 100
+"""
+from io import BytesIO
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_signatures import synthetic_image  # noqa: E402
+
+from image_match.goldberg import ImageSignature  # noqa: E402
+from image_match.signature_database_base import simple_words, probe_words  # noqa: E402
+
+SETTINGS = [(16, 63), (16, 16), (16, 4), (24, 16), (24, 4), (32, 8)]
+PROBES = [0, 1, 2, 4, 8]
+
+
+def edits(image):
+    """Edited copies of a PIL image, as heavily compressed JPEG bytes."""
+    width, height = image.size
+    copies = []
+    for edit in [lambda im: im.resize((width // 4, height // 4), Image.BILINEAR),
+                 lambda im: ImageEnhance.Contrast(ImageEnhance.Brightness(im).enhance(1.3)).enhance(0.7),
+                 lambda im: im.crop((width // 20, height // 20, width - width // 20, height - height // 20)),
+                 lambda im: im.rotate(2, resample=Image.BILINEAR, expand=False)]:
+        buffer = BytesIO()
+        edit(image).save(buffer, 'JPEG', quality=15)
+        copies.append(buffer.getvalue())
+    return copies
+
+
+def matching_words(queries, stored, k, N, n_probes):
+    """For each query signature, the number of the stored signature's words that one of its
+    probe codes matches."""
+    stored_words = simple_words(stored, k, N)
+    return np.array([(probe_words(query, k, N, n_probes) == words[:, np.newaxis]).any(axis=1).sum()
+                     for query, words in zip(queries, stored_words)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=40, help='number of images (default %(default)s)')
+    args = parser.parse_args()
+
+    gis = ImageSignature()
+    originals, copies = [], []
+    for seed in range(args.images):
+        image = Image.fromarray(synthetic_image(384, 512, seed=seed))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG')
+        signature = gis.generate_signature(buffer.getvalue(), bytestream=True)
+        for data in edits(image):
+            originals.append(signature)
+            copies.append(gis.generate_signature(data, bytestream=True))
+    originals, copies = np.array(originals), np.array(copies)
+    # unrelated pairs: each copy against the original of another image
+    unrelated = np.roll(originals, len(copies) // args.images, axis=0)
+
+    print('{} edited copies of {} images'.format(len(copies), args.images))
+    print('{:>4} {:>4} {:>9} {:>14} {:>8} {:>14} {:>14}'.format('k', 'N', 'n_probes', 'codes / query', 'recall',
+                                                                'words matched', 'unrelated hit'))
+    for k, N in SETTINGS:
+        for n_probes in PROBES:
+            matched = matching_words(copies, originals, k, N, n_probes)
+            false_hits = (matching_words(copies, unrelated, k, N, n_probes) > 0).mean()
+            print('{:>4} {:>4} {:>9} {:>14} {:>7.1%} {:>14.1f} {:>13.1%}'.format(
+                k, N, n_probes, N * (1 + n_probes), (matched > 0).mean(), matched.mean(), false_hits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Benchmark suite for the signature pipeline.
+
+Signs synthetic images, generated locally so no network is needed, of several
+sizes and formats (JPEG, PNG, MPO, and SVG when cairosvg is installed). It
+times every stage of ImageSignature.generate_signature and the end-to-end
+generate_signature, make_record, get_words, simple_words and normalized_distance.
+
+Results are compared with the baseline stored in baseline.json next to this
+script. Ratios to the baseline are divided by their median, so that a
+baseline recorded on a faster or slower machine still gives ratios near 1,
+and only benchmarks that slowed down more than the rest stand out. Those
+slower by more than the tolerance are marked as regressions, except for
+timings under a millisecond, which vary too much from run to run. The median
+only makes up for the machine's overall speed, not for its cache sizes or
+numpy build, so record your own baseline before starting performance work.
+
+Usage:
+    python benchmarks/bench_signatures.py            # compare with the baseline
+    python benchmarks/bench_signatures.py --save     # record a new baseline
+    python benchmarks/bench_signatures.py --check    # exit with an error on regressions
+    python benchmarks/bench_signatures.py --quick    # small images only
+"""
+from io import BytesIO
+from timeit import default_timer
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_match.goldberg import ImageSignature, SignatureProfiler  # noqa: E402
+from image_match.signature_database_base import make_record, get_words, simple_words, normalized_distance  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SIZES = [(256, 256), (768, 1024), (3000, 4000)]
+QUICK_SIZES = [(256, 256), (768, 1024)]
+
+STAGES = ['preprocess_image', 'crop_image', 'compute_grid_points', 'compute_mean_level',
+          'compute_differentials', 'normalize_and_threshold']
+
+
+def synthetic_image(height, width, seed=0):
+    """An RGB image with smooth gradients, flat shapes and noise, like a busy photograph."""
+    rng = np.random.RandomState(seed)
+    rows, columns = np.mgrid[0:height, 0:width] / float(max(height, width))
+    image = np.zeros((height, width, 3))
+    for channel in range(3):
+        for _ in range(4):
+            fx, fy, phase = rng.uniform(1, 12), rng.uniform(1, 12), rng.uniform(0, 2 * np.pi)
+            image[..., channel] += np.sin(fx * rows + fy * columns + phase)
+    image = (image - image.min()) / (image.max() - image.min()) * 200
+    for _ in range(12):
+        top, left = rng.randint(0, height), rng.randint(0, width)
+        image[top:top + rng.randint(height // 10, height // 3),
+              left:left + rng.randint(width // 10, width // 3)] = rng.uniform(0, 255, 3)
+    image += rng.normal(0, 6, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_svg(height, width, seed=0):
+    """An SVG drawing of random rectangles and circles."""
+    rng = np.random.RandomState(seed)
+    shapes = []
+    for _ in range(40):
+        color = 'rgb(%d,%d,%d)' % tuple(rng.randint(0, 256, 3))
+        if rng.rand() < 0.5:
+            shapes.append('<rect x="%d" y="%d" width="%d" height="%d" fill="%s"/>'
+                          % (rng.randint(0, width), rng.randint(0, height),
+                             rng.randint(10, width // 2), rng.randint(10, height // 2), color))
+        else:
+            shapes.append('<circle cx="%d" cy="%d" r="%d" fill="%s"/>'
+                          % (rng.randint(0, width), rng.randint(0, height),
+                             rng.randint(5, min(height, width) // 4), color))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">'
+            '<rect width="100%%" height="100%%" fill="white"/>%s</svg>'
+            % (width, height, ''.join(shapes))).encode('utf8')
+
+
+def encode(image, image_format):
+    """Encodes an image array as bytes in the given format."""
+    buffer = BytesIO()
+    pil_image = Image.fromarray(image)
+    if image_format == 'MPO':
+        # a stereo pair: the image and a slightly shifted copy
+        pil_image.save(buffer, 'MPO', save_all=True,
+                       append_images=[Image.fromarray(np.roll(image, 8, axis=1))])
+    else:
+        pil_image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_images(sizes):
+    """(name, bytes) pairs of every benchmark image."""
+    images = []
+    for height, width in sizes:
+        image = synthetic_image(height, width)
+        for image_format in ['JPEG', 'PNG', 'MPO']:
+            images.append(('%s/%dx%d' % (image_format.lower(), height, width), encode(image, image_format)))
+    try:
+        import cairosvg  # noqa: F401
+    except (ImportError, OSError):
+        print('cairosvg is not available, skipping SVG')
+    else:
+        height, width = sizes[-1]
+        images.append(('svg/%dx%d' % (height, width), synthetic_svg(height, width)))
+    return images
+
+
+def best_time(function, min_seconds=0.5, repeats=5):
+    """Best time of one call, in seconds, from repeats of enough calls to run min_seconds."""
+    start = default_timer()
+    function()
+    once = default_timer() - start
+    number = max(1, int(min_seconds / repeats / max(once, 1e-9)))
+    best = once
+    for _ in range(repeats):
+        start = default_timer()
+        for _ in range(number):
+            function()
+        best = min(best, (default_timer() - start) / number)
+    return best
+
+
+def run(sizes):
+    """Runs every benchmark, returning {name: seconds}."""
+    results = {}
+
+    gis = ImageSignature()
+    for name, data in test_images(sizes):
+        results['generate_signature/' + name] = best_time(
+            lambda: gis.generate_signature(data, bytestream=True))
+
+        # per-stage times, the best of the profiled runs that fit in half a second (at least 5),
+        # since a single stage can take well under a millisecond
+        fastest = {}
+
+        def keep_fastest(stage, seconds, peak_bytes, shape):
+            fastest[stage] = min(seconds, fastest.get(stage, seconds))
+
+        profiled = ImageSignature(profiler=SignatureProfiler(callback=keep_fastest))
+        start = default_timer()
+        runs = 0
+        while runs < 5 or default_timer() - start < 0.5:
+            profiled.generate_signature(data, bytestream=True)
+            runs += 1
+        for stage in STAGES:
+            results['%s/%s' % (stage, name)] = fastest[stage]
+
+    data = encode(synthetic_image(*sizes[-1]), 'JPEG')
+    results['make_record/jpeg/%dx%d' % sizes[-1]] = best_time(
+        lambda: make_record('image.jpg', gis, 16, 63, img=data, bytestream=True))
+
+    rng = np.random.RandomState(0)
+    signature = rng.randint(-2, 3, gis.sig_length).astype('int8')
+    results['get_words/k=16,N=63'] = best_time(lambda: get_words(signature, 16, 63))
+
+    signatures = rng.randint(-2, 3, (10000, gis.sig_length)).astype('int8')
+    results['simple_words/k=16,N=63/10000'] = best_time(lambda: simple_words(signatures, 16, 63))
+    results['normalized_distance/10000'] = best_time(lambda: normalized_distance(signatures, signature))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--check', action='store_true', help='exit with an error if anything regressed')
+    parser.add_argument('--quick', action='store_true', help='skip the largest images')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='slowdown over the baseline counted as a regression (default 0.5)')
+    parser.add_argument('--min-ms', type=float, default=1.,
+                        help='timings shorter than this are never counted as regressions (default 1)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (default %(default)s)')
+    args = parser.parse_args()
+
+    results = run(QUICK_SIZES if args.quick else SIZES)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # how much slower this machine is than the baseline's, judging by the typical benchmark
+    shared = [name for name in results if name in baseline]
+    speed = np.median([results[name] / baseline[name] for name in shared]) if shared else 1.
+    print('median ratio to the baseline: %.2fx, which the ratios below are divided by' % speed)
+
+    regressions = []
+    print('{:<52} {:>12} {:>12} {:>8}'.format('benchmark', 'time (ms)', 'baseline', 'ratio'))
+    for name in sorted(results):
+        seconds = results[name]
+        if name in baseline:
+            ratio = seconds / baseline[name] / speed
+            flag = '  REGRESSION' if ratio > 1 + args.tolerance and seconds * 1e3 >= args.min_ms else ''
+            if flag:
+                regressions.append(name)
+            print('{:<52} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(name, seconds * 1e3, baseline[name] * 1e3,
+                                                                 ratio, flag))
+        else:
+            print('{:<52} {:>12.3f} {:>12} {:>8}'.format(name, seconds * 1e3, '-', '-'))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('saved baseline to %s' % args.baseline)
+
+    if args.check and regressions:
+        sys.exit('%d benchmarks regressed: %s' % (len(regressions), ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
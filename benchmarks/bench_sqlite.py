@@ -0,0 +1,68 @@
+"""Benchmark of the SQLite SignatureSQLite backend.
+
+Adds random signatures, which are the worst case for the word index since almost every word
+is distinct, and times adding them, searching, and searching again after reopening the file.
+
+Usage:
+    python benchmarks/bench_sqlite.py
+    python benchmarks/bench_sqlite.py --images 1000000 --path /tmp/signatures.sqlite
+"""
+from timeit import default_timer
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_match.sqlite_driver import SignatureSQLite  # noqa: E402
+from image_match.signature_database_base import _record_from_signature  # noqa: E402
+
+
+def search_time(db, queries):
+    """Mean seconds per search."""
+    start = default_timer()
+    for query in queries:
+        db.search_single_record(query)
+    return (default_timer() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=100000, help='number of images (default %(default)s)')
+    parser.add_argument('--path', help='database file (default one in a temporary directory)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = args.path or os.path.join(directory, 'signatures.sqlite')
+    try:
+        rng = np.random.RandomState(0)
+        db = SignatureSQLite(path)
+        signatures = rng.randint(-2, 3, (args.images, db.gis.sig_length)).astype('int8')
+
+        start = default_timer()
+        for first in range(0, args.images, 10000):
+            db.insert_many_records([{'path': 'image_%d' % i, 'signature': signatures[i]}
+                                    for i in range(first, min(first + 10000, args.images))])
+        print('{} images added in {:.1f} s'.format(args.images, default_timer() - start))
+        print('database size: {:.0f} MB'.format(os.path.getsize(path) / 2. ** 20))
+
+        queries = [_record_from_signature('query', signatures[i], db.k, db.N)
+                   for i in rng.randint(0, args.images, 200)]
+        print('search: {:.2f} ms'.format(search_time(db, queries) * 1e3))
+        db.close()
+
+        start = default_timer()
+        reopened = SignatureSQLite(path)
+        print('opened in {:.1f} ms'.format((default_timer() - start) * 1e3))
+        print('search, reopened: {:.2f} ms'.format(search_time(reopened, queries) * 1e3))
+        reopened.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark of signing with and without a SignatureWorkspace.
+
+Signs a stream of synthetic JPEGs of slightly varying sizes, the way a long-running worker
+would, once with fresh arrays for every image and once with buffers reused from a
+SignatureWorkspace. For each it reports the throughput and the memory allocated and freed
+again while signing each image (the peak traced by tracemalloc, above what was allocated
+before the image), which is what churns the allocator. For the workspace, it also reports
+how often its buffers had to grow.
+
+Usage:
+    python benchmarks/bench_workspace.py
+    python benchmarks/bench_workspace.py --size 3000x4000 --images 20
+"""
+from io import BytesIO
+from timeit import default_timer
+import argparse
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+# the checkout's image_match, without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_match.goldberg import ImageSignature, SignatureWorkspace  # noqa: E402
+
+
+def jpeg_stream(height, width, count, seed=0):
+    """JPEG bytes of count smooth, noisy images, each up to 5% smaller than height x width."""
+    rng = np.random.RandomState(seed)
+    images = []
+    for _ in range(count):
+        h = int(height * rng.uniform(0.95, 1))
+        w = int(width * rng.uniform(0.95, 1))
+        rows, columns = np.mgrid[0:h, 0:w]
+        image = (np.sin(rows / rng.uniform(20, 80)) * 60 + np.cos(columns / rng.uniform(20, 80)) * 60)
+        image = image[..., np.newaxis] + rng.normal(128, 10, (h, w, 3))
+        buffer = BytesIO()
+        Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(buffer, 'JPEG')
+        images.append(buffer.getvalue())
+    return images
+
+
+def throughput(gis, images, repeats=3):
+    """Best images per second over repeats passes through images."""
+    best = 0.
+    for _ in range(repeats):
+        start = default_timer()
+        for data in images:
+            gis.generate_signature(data, bytestream=True)
+        best = max(best, len(images) / (default_timer() - start))
+    return best
+
+
+def transient_memory(gis, images):
+    """Mean bytes allocated and freed again while signing each image."""
+    total = 0
+    tracemalloc.start()
+    try:
+        for data in images:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            gis.generate_signature(data, bytestream=True)
+            after, peak = tracemalloc.get_traced_memory()
+            total += peak - max(before, after)
+    finally:
+        tracemalloc.stop()
+    return total / float(len(images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', default='1536x2048', help='largest image size, HxW (default %(default)s)')
+    parser.add_argument('--images', type=int, default=20, help='number of images (default %(default)s)')
+    parser.add_argument('--integral-image', action='store_true', help='sign with integral_image=True')
+    args = parser.parse_args()
+
+    height, width = (int(length) for length in args.size.split('x'))
+    images = jpeg_stream(height, width, args.images)
+
+    workspace = SignatureWorkspace()
+    fresh = ImageSignature(integral_image=args.integral_image)
+    reused = ImageSignature(integral_image=args.integral_image, workspace=workspace)
+
+    # the signatures are the same either way
+    for data in images:
+        assert np.array_equal(fresh.generate_signature(data, bytestream=True),
+                              reused.generate_signature(data, bytestream=True))
+    allocations = workspace.allocations
+
+    print('{} images of up to {}x{}'.format(len(images), height, width))
+    print('{:<16} {:>12} {:>22}'.format('', 'images/s', 'transient MB / image'))
+    for name, gis in [('fresh arrays', fresh), ('workspace', reused)]:
+        print('{:<16} {:>12.2f} {:>22.1f}'.format(name, throughput(gis, images),
+                                                  transient_memory(gis, images) / 2 ** 20))
+    print('workspace: {:.1f} MB in buffers, grown {} times over {} images'.format(
+        workspace.nbytes / 2. ** 20, allocations, len(images)))
+
+
+if __name__ == '__main__':
+    main()
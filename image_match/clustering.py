@@ -0,0 +1,173 @@
+from image_match.goldberg import ImageSignature
+from image_match.signature_database_base import signature_norms, _encode_words, _word_positions
+import numpy as np
+
+
+def cluster_images(paths_or_images, gis=None, k=16, N=63, distance_cutoff=0.45, bytestream=False,
+                   workers=None, window=32):
+    """Groups the near-duplicates in a batch of images, without a database
+
+    Signs the images (see ImageSignature.generate_signatures) and clusters the signatures with
+    cluster_signatures.
+
+    Args:
+        paths_or_images (iterable): images in any form accepted by generate_signature
+        gis (Optional[ImageSignature]): signature generator. If None, one with the default
+            settings is used (default None)
+        k (Optional[int]): the width of a word (default 16)
+        N (Optional[int]): the number of words (default 63)
+        distance_cutoff (Optional[float]): images closer than this are near-duplicates
+            (default 0.45)
+        bytestream (Optional[boolean]): are the images passed as raw bytes? (default False)
+        workers (Optional[int]): number of worker processes signing the images. If None, one per
+            CPU is used (default None)
+        window (Optional[int]): see cluster_signatures (default 32)
+
+    Returns:
+        a tuple (clusters, errors). clusters is as returned by cluster_signatures, with indices
+            into paths_or_images. errors is a list holding, for each image, None if it was
+            signed or else the exception raised for it. Images that couldn't be signed are in
+            no cluster
+
+    Examples:
+        >>> from image_match.clustering import cluster_images
+        >>> clusters, errors = cluster_images(['a.jpg', 'b.jpg', 'a_copy.jpg', 'a_small.jpg'])
+        >>> clusters
+        [[0, 2, 3]]
+
+    """
+    if gis is None:
+        gis = ImageSignature()
+    signatures, errors = gis.generate_signatures(paths_or_images, bytestream=bytestream, workers=workers)
+    # rows of images that failed are zeros, so featureless, and left out of clusters
+    return cluster_signatures(signatures, k=k, N=N, distance_cutoff=distance_cutoff, window=window), errors
+
+
+def cluster_signatures(signatures, k=16, N=63, distance_cutoff=0.45, window=32):
+    """Groups near-duplicate signatures into clusters
+
+    Two signatures are linked if their normalized distance is below distance_cutoff, and a
+    cluster is a connected group of linked signatures -- so a cluster can hold two images
+    further apart than distance_cutoff, if there are images between them.
+
+    Not every pair is compared. As in the database search, the signatures are split into N
+    words of length k, and only signatures sharing a word in the same position are candidates.
+    The words are put in an in-memory inverted index, one position at a time: within each
+    group of signatures sharing a word, each signature is compared with up to window
+    signatures before it, skipping those it is already clustered with. This bounds the work
+    at about N x window comparisons per signature even for very common words, while copies
+    of an image, which share most of their words, still end up together.
+
+    Args:
+        signatures (numpy.ndarray): N x m array of signatures, e.g. from generate_signatures
+        k (Optional[int]): the width of a word (default 16)
+        N (Optional[int]): the number of words (default 63)
+        distance_cutoff (Optional[float]): signatures closer than this are near-duplicates
+            (default 0.45)
+        window (Optional[int]): number of earlier signatures sharing a word that each
+            signature is compared with (default 32)
+
+    Returns:
+        a list of clusters of two or more signatures, each a sorted list of row indices,
+            ordered by their first index. Signatures in no cluster have no near-duplicate.
+            Featureless (all zero) signatures are never clustered
+
+    Examples:
+        >>> cluster_signatures(signatures)
+        [[0, 2, 3], [5, 9]]
+
+    """
+    if type(distance_cutoff) is not float:
+        raise TypeError('distance_cutoff should be a float')
+    if distance_cutoff < 0.:
+        raise ValueError('distance_cutoff should be > 0 (got %r)' % distance_cutoff)
+    if type(window) is not int:
+        raise TypeError('window should be an integer')
+    if window < 1:
+        raise ValueError('window should be > 0 (got %r)' % window)
+
+    signatures = np.asarray(signatures)
+    norms = signature_norms(signatures)
+    # featureless signatures are at distance nan (taken as 1.0) from everything
+    rows = np.flatnonzero(norms > 0)
+    if rows.size < 2:
+        return []
+
+    # each signature's label is the smallest row in its cluster so far
+    labels = np.arange(signatures.shape[0])
+    for position in _word_positions(signatures.shape[1], k, N):
+        # the inverted index for this word position: rows sorted by word, then by row
+        words = _encode_words(signatures, [position], k)[rows, 0]
+        order = np.argsort(words, kind='stable')
+        sorted_words = words[order]
+        members = rows[order]
+
+        # drop the words that only one signature has, and those whose signatures are all in
+        # one cluster already
+        starts = np.flatnonzero(np.concatenate(([True], sorted_words[1:] != sorted_words[:-1])))
+        member_labels = labels[members]
+        unfinished = np.minimum.reduceat(member_labels, starts) != np.maximum.reduceat(member_labels, starts)
+        keep = np.repeat(unfinished, np.diff(np.append(starts, members.size)))
+        sorted_words, members = sorted_words[keep], members[keep]
+
+        for offset in range(1, window + 1):
+            same_word = sorted_words[offset:] == sorted_words[:-offset]
+            if not same_word.any():
+                break
+            a = members[offset:][same_word]
+            b = members[:-offset][same_word]
+            # skip pairs that are already clustered
+            unlinked = labels[a] != labels[b]
+            a, b = a[unlinked], b[unlinked]
+            close = _pair_distances(signatures, norms, a, b) < distance_cutoff
+            _link(labels, a[close], b[close])
+
+    clustered = np.flatnonzero(np.bincount(labels, minlength=labels.size)[labels] > 1)
+    clusters = {}
+    for row in clustered:
+        clusters.setdefault(labels[row], []).append(int(row))
+    return [clusters[label] for label in sorted(clusters)]
+
+
+def _pair_distances(signatures, norms, a, b, chunk_size=16384):
+    """Normalized distances between signatures[a[i]] and signatures[b[i]], for every i.
+
+    The same values as normalized_distance, with nan taken as 1.0.
+
+    """
+    distances = np.empty(a.size)
+    for start in range(0, a.size, chunk_size):
+        stop = start + chunk_size
+        # signature values are within +-n_levels, so their differences fit the signatures' type
+        differences = signatures[a[start:stop]] - signatures[b[start:stop]]
+        squares = np.einsum('ij,ij->i', differences, differences, dtype='int32')
+        with np.errstate(invalid='ignore'):
+            distances[start:stop] = np.sqrt(squares) / (norms[a[start:stop]] + norms[b[start:stop]])
+    distances[np.isnan(distances)] = 1.0
+    return distances
+
+
+def _link(labels, a, b):
+    """Merges the clusters of each pair of rows (a[i], b[i]) in place.
+
+    Every row's label is the smallest row of its cluster; merged clusters take the smaller
+    of their two labels.
+
+    """
+    while a.size:
+        label_a, label_b = labels[a], labels[b]
+        unlinked = label_a != label_b
+        a, b = a[unlinked], b[unlinked]
+        if not a.size:
+            break
+        low = np.minimum(label_a[unlinked], label_b[unlinked])
+        high = np.maximum(label_a[unlinked], label_b[unlinked])
+        # point each merged cluster's label at the smaller one; a label merged with several
+        # others only takes one of them here, and the pairs left unlinked go round again
+        np.minimum.at(labels, high, low)
+        # then follow the chains until every row points at its cluster's smallest row
+        while True:
+            followed = labels[labels]
+            if np.array_equal(followed, labels):
+                break
+            labels[:] = followed
@@ -47,13 +47,57 @@ class SignatureES(SignatureDatabaseBase):
         super(SignatureES, self).__init__(*args, **kwargs)
 
     def search_single_record(self, rec, pre_filter=None):
-        path = rec.pop('path')
-        signature = rec.pop('signature')
-        if 'metadata' in rec:
-            rec.pop('metadata')
+        signature = rec['signature']
+        body = self._search_body(rec, pre_filter)
 
-        # build the 'should' list
-        should = [{'term': {'{}.{}'.format(self.doc_type, word): rec[word]}} for word in rec]
+        res = self.es.search(index=self.index,
+                              body=body,
+                              size=self.size,
+                              timeout=self.timeout)['hits']['hits']
+
+        return self._format_hits(res, signature)
+
+    def search_many_records(self, recs, pre_filter=None):
+        """Search for the matches of a batch of image records with one multi-search request.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            pre_filter (Optional[dict]): a filter to be applied to every search, as for
+                search_single_record (default None)
+
+        Returns:
+            a list holding, for each record, its matches as returned by search_single_record, or
+                else a RuntimeError with Elasticsearch's reason. If the request itself fails,
+                every record gets its error
+
+        """
+        body = []
+        for rec in recs:
+            search = self._search_body(rec, pre_filter)
+            search['size'] = self.size
+            search['timeout'] = self.timeout
+            body.append({'index': self.index})
+            body.append(search)
+
+        try:
+            responses = self.es.msearch(body=body)['responses']
+        except Exception as e:
+            return [e] * len(recs)
+
+        results = []
+        for rec, response in zip(recs, responses):
+            if 'error' in response:
+                results.append(RuntimeError(response['error']))
+            else:
+                results.append(list(self._format_hits(response['hits']['hits'], rec['signature'])))
+        return results
+
+    def _search_body(self, rec, pre_filter=None):
+        """The search request for a record's simple words (see search_single_record)."""
+        # build the 'should' list; with probes, a word is a list of codes, any of which matches
+        should = [{'terms' if isinstance(rec[word], list) else 'term':
+                   {'{}.{}'.format(self.doc_type, word): rec[word]}}
+                  for word in rec if word.startswith('simple_word_')]
         body = {
             'query': {
                    'bool': {'should': should}
@@ -64,11 +108,10 @@ class SignatureES(SignatureDatabaseBase):
         if pre_filter is not None:
             body['query']['bool']['filter'] = pre_filter
 
-        res = self.es.search(index=self.index,
-                              body=body,
-                              size=self.size,
-                              timeout=self.timeout)['hits']['hits']
+        return body
 
+    def _format_hits(self, res, signature):
+        """The matches among search hits, closer than distance_cutoff to signature."""
         sigs = np.array([x['_source'][self.doc_type]['signature'] for x in res])
 
         if sigs.size == 0:
@@ -92,6 +135,36 @@ class SignatureES(SignatureDatabaseBase):
         rec['timestamp'] = datetime.now()
         self.es.index(index=self.index, body={ self.doc_type: rec }, refresh=refresh_after)
 
+    def insert_many_records(self, recs, refresh_after=False):
+        """Insert a batch of image records with one bulk request.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            refresh_after (Optional[boolean]): refresh the index once the batch is in (default False)
+
+        Returns:
+            a list holding, for each record, None if it was indexed or else a RuntimeError with
+                Elasticsearch's reason. If the request itself fails, every record gets its error
+
+        """
+        now = datetime.now()
+        body = []
+        for rec in recs:
+            rec['timestamp'] = now
+            body.append({'index': {'_index': self.index}})
+            body.append({self.doc_type: rec})
+
+        try:
+            res = self.es.bulk(body=body, refresh=refresh_after)
+        except Exception as e:
+            return [e] * len(recs)
+
+        errors = []
+        for item in res['items']:
+            error = item['index'].get('error')
+            errors.append(None if error is None else RuntimeError(error))
+        return errors
+
     def delete_duplicates(self, path):
         """Delete all but one entries in elasticsearch whose `path` value is equivalent to that of path.
         Args:
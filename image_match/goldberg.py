@@ -1,22 +1,164 @@
-from skimage.color import rgb2gray
-from skimage.io import imread
-from PIL import Image
-from PIL.MpoImagePlugin import MpoImageFile
-try:
-    from cairosvg import svg2png
-except ImportError:
-    pass
 from six import string_types, text_type
-from io import BytesIO
+from io import BytesIO, RawIOBase
+from itertools import product
+from timeit import default_timer
 import numpy as np
-import xml.etree
-import xml.etree.ElementTree
+import os
+
+# skimage, PIL, cairosvg and multiprocessing are imported where they are used, so that
+# importing this module (and the database drivers, which only need to compare
+# signatures) stays cheap
+
+
+# ImageSignature used by generate_signatures worker processes
+_worker_signature = None
+
+# (row, column) offsets of the neighbors of a grid point, in the order used by
+# compute_differentials
+_NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+_NON_DIAGONAL_NEIGHBORS = [offset for offset in _NEIGHBORS if 0 in offset]
+
+# weights of the red, green and blue channels in the grey level, as used by skimage's rgb2gray
+# and by PIL's 'L' mode
+_RGB2GRAY_WEIGHTS = (0.2125, 0.7154, 0.0721)
+_PIL_LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# with reduced_decode, images are decoded with at least this many pixels between grid points
+_DECODE_PIXELS_PER_CELL = 64
+
+# rows converted to greyscale at a time when writing into a SignatureWorkspace
+_WORKSPACE_STRIP_ROWS = 128
 
 
 class CorruptImageError(RuntimeError):
     pass
 
 
+class SignatureProfiler(object):
+    """Records the time and memory each step of signature generation takes.
+
+    Attach one to an ImageSignature (ImageSignature(profiler=...)) to see where signing time
+    goes. Each stage of each signature -- preprocess_image, crop_image, compute_grid_points,
+    compute_mean_level, compute_differentials and normalize_and_threshold -- is timed, and
+    passed to callback, if given, and added to the running totals in stages.
+
+    Profiling happens in the calling process only; generate_signatures' worker processes
+    sign without it.
+
+    """
+    def __init__(self, callback=None, trace_memory=False):
+        """Set up the profiler.
+
+        Args:
+            callback (Optional[function]): called after every stage as
+                callback(stage, seconds, peak_bytes, shape), where shape is the shape of the array
+                the stage worked on (the decoded greyscale image for preprocess_image) and
+                peak_bytes is None unless trace_memory is set (default None)
+            trace_memory (Optional[boolean]): also record the peak memory allocated during each
+                stage, above what was allocated when it started. Uses tracemalloc, which slows
+                everything down while it runs; it is started if it isn't running already. Before
+                Python 3.9, tracemalloc's peak can't be reset, so a stage that stays below the
+                peak of an earlier one records only the memory it still holds at its end
+                (default False)
+
+        Examples:
+            >>> profiler = SignatureProfiler(trace_memory=True)
+            >>> gis = ImageSignature(profiler=profiler)
+            >>> sig = gis.generate_signature('https://pixabay.com/static/uploads/photo/2012/11/28/08/56/mona-lisa-67506_960_720.jpg')
+            >>> profiler.stages['preprocess_image']
+            {'calls': 1, 'seconds': 0.052, 'peak_bytes': 16588800}
+
+        """
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def stage(self, name, shape=None):
+        """Context manager that profiles the code it wraps as the named stage.
+
+        Set its shape attribute in the block if the shape isn't known beforehand.
+
+        """
+        return _ProfiledStage(self, name, shape)
+
+    def record(self, name, seconds, peak_bytes, shape):
+        """Adds one run of a stage to the totals and passes it to the callback."""
+        totals = self.stages.setdefault(name, {'calls': 0, 'seconds': 0., 'peak_bytes': None})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        if peak_bytes is not None:
+            totals['peak_bytes'] = max(totals['peak_bytes'] or 0, peak_bytes)
+        if self.callback is not None:
+            self.callback(name, seconds, peak_bytes, shape)
+
+
+class SignatureWorkspace(object):
+    """Scratch buffers that ImageSignature reuses from one signature to the next.
+
+    Attach one to an ImageSignature (ImageSignature(workspace=...)) in a process that signs
+    many images. The greyscale image, the pixel differences used for cropping and the
+    summed-area table are then written into the same memory every time, instead of being
+    allocated afresh for every image. A buffer only grows, with an eighth to spare, when an
+    image needs more room than it has, so for images of similar sizes it settles after the
+    first few.
+
+    A workspace holds about twice the memory of the largest greyscale image signed with it
+    (four times with integral_image), until it is cleared. Don't share one between threads.
+
+    """
+    def __init__(self):
+        """Set up an empty workspace.
+
+        Examples:
+            >>> workspace = SignatureWorkspace()
+            >>> gis = ImageSignature(workspace=workspace)
+            >>> for path in paths_of_4000_x_3000_photos:
+            ...     sig = gis.generate_signature(path)
+            >>> workspace.allocations, workspace.nbytes
+            (3, 215978832)
+
+        """
+        self._buffers = {}
+        self.allocations = 0
+
+    @property
+    def nbytes(self):
+        """Total size of the buffers held."""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def array(self, name, shape, dtype):
+        """Returns an uninitialized array, in memory reused from the last call with this name.
+
+        Args:
+            name (string): name of the buffer
+            shape (Tuple[int]): shape of the array
+            dtype (numpy.dtype): type of the array
+
+        Returns:
+            a C-contiguous numpy.ndarray. Its contents are undefined, and it is overwritten by the
+                next call with the same name
+
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.nbytes < nbytes:
+            # with some room to spare, so that slightly larger images fit next time
+            buffer = np.empty(nbytes + nbytes // 8, dtype=np.uint8)
+            self._buffers[name] = buffer
+            self.allocations += 1
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def clear(self):
+        """Releases all the buffers."""
+        self._buffers = {}
+
+
 class ImageSignature(object):
     """Image signature generator.
 
@@ -24,7 +166,8 @@ class ImageSignature(object):
     """
 
     def __init__(self, n=9, crop_percentiles=(5, 95), P=None, diagonal_neighbors=True,
-                 identical_tolerance=2/255., n_levels=2, fix_ratio=False):
+                 identical_tolerance=2/255., n_levels=2, fix_ratio=False, integral_image=False,
+                 reduced_decode=False, dtype='float64', profiler=None, workspace=None):
         """Initialize the signature generator.
 
         The default parameters match those given in Goldberg's paper.
@@ -44,6 +187,24 @@ class ImageSignature(object):
                 grid points identical (default 2/255)
             n_levels (Optional[int]): number of positive and negative groups to stratify neighbor
                 differences into. n = 2 -> [-2, -1, 0, 1, 2] (default 2)
+            integral_image (Optional[boolean]): compute grid means from a summed-area table. Much
+                faster for large n. With integer grey levels (greyscale files, or dtype='uint8')
+                the means, and so the signatures, are exactly the default's. With float levels
+                the means agree to within floating point rounding, so a signature value can only
+                change if a difference lies within rounding of a level boundary; none did on
+                skimage's sample images (default False)
+            reduced_decode (Optional[boolean]): decode large images at reduced resolution, keeping
+                _DECODE_PIXELS_PER_CELL pixels across each grid cell (or P, if larger). Much faster
+                and lighter on memory for large JPEGs; most signature values are unchanged, see
+                preprocess_image and the docs for the agreement rate (default False)
+            dtype (Optional[string]): type of the greyscale image the signature is computed from:
+                'float64', 'float32' (half the memory) or 'uint8' (an eighth of the memory, using
+                PIL's luminance). Signatures are close to, but not always the same as, those
+                computed with the default (default 'float64')
+            profiler (Optional[SignatureProfiler]): records the time and memory used by each step
+                of generate_signature. Not used when None, at no cost (default None)
+            workspace (Optional[SignatureWorkspace]): scratch buffers to reuse across calls of
+                generate_signature. If None, every call allocates its own (default None)
 
         """
 
@@ -94,6 +255,23 @@ class ImageSignature(object):
         'n_levels should be > 0 (%r given)' % n_levels
         self.n_levels = n_levels
 
+        assert type(integral_image) is bool, 'integral_image should be boolean'
+        self.integral_image = integral_image
+
+        assert type(reduced_decode) is bool, 'reduced_decode should be boolean'
+        self.reduced_decode = reduced_decode
+        if reduced_decode:
+            self.decode_size = (n + 1) * max(_DECODE_PIXELS_PER_CELL, P or 0)
+        else:
+            self.decode_size = None
+
+        assert np.dtype(dtype) in (np.float64, np.float32, np.uint8),\
+            "dtype should be 'float64', 'float32' or 'uint8' (%r given)" % dtype
+        self.dtype = dtype
+
+        self.profiler = profiler
+        self.workspace = workspace
+
         self.handle_mpo = True
 
     def generate_signature(self, path_or_image, bytestream=False):
@@ -157,41 +335,358 @@ class ImageSignature(object):
 
         """
 
+        profiler = self.profiler or _NO_PROFILER
+
         # Step 1:    Load image as array of grey-levels
-        im_array = self.preprocess_image(path_or_image, handle_mpo=self.handle_mpo, bytestream=bytestream)
+        with profiler.stage('preprocess_image') as stage:
+            im_array = self.preprocess_image(path_or_image, handle_mpo=self.handle_mpo, bytestream=bytestream,
+                                             decode_size=self.decode_size, dtype=self.dtype,
+                                             workspace=self.workspace)
+            stage.shape = im_array.shape
+
+        return self._sign_grey(im_array)
+
+    def generate_signatures(self, paths_or_images, bytestream=False, workers=None, chunksize=8):
+        """Generates signatures for many images, in parallel.
+
+        Each image is decoded and signed in a worker process, and only its signature is sent
+        back. Pass paths, URLs or raw bytes rather than decoded arrays, so that the images
+        themselves are not copied between processes.
+
+        Args:
+            paths_or_images (iterable): images in any form accepted by generate_signature
+            bytestream (Optional[boolean]): are the images passed as raw bytes? (default False)
+            workers (Optional[int]): number of worker processes. If None, one per CPU is used.
+                If 1, the images are signed in this process (default None)
+            chunksize (Optional[int]): number of images handed to a worker at a time (default 8)
+
+        Returns:
+            a tuple (signatures, errors). signatures is a contiguous int8 array with one row of
+                length sig_length per image, in input order. errors is a list holding, for each
+                image, None if it was signed or else the exception raised for it, in which case
+                its row of signatures is all zeros. One bad image does not stop the batch
+
+        Examples:
+            >>> gis = ImageSignature()
+            >>> signatures, errors = gis.generate_signatures(['a.jpg', 'missing.jpg', 'b.jpg'])
+            >>> signatures.shape
+            (3, 648)
+            >>> errors
+            [None, FileNotFoundError(2, 'No such file or directory'), None]
+
+        """
+        tasks = ((path_or_image, bytestream) for path_or_image in paths_or_images)
+        results = _sign_all(self, tasks, workers=workers, chunksize=chunksize)
+
+        signatures = np.zeros((len(results), self.sig_length), dtype='int8')
+        errors = []
+        for i, (signature, error) in enumerate(results):
+            if error is None:
+                signatures[i] = signature
+            errors.append(error)
+
+        return signatures, errors
+
+    def generate_frame_signatures(self, path_or_image, bytestream=False, step=1, max_frames=None):
+        """Generates signatures for the frames of an animated or multi-page image.
+
+        Signs every step-th frame of an animated GIF, multi-page TIFF or MPO. The decoder seeks
+        to the chosen frames, and the frames in between are not converted or signed. TIFFs and
+        MPOs jump straight to a frame; GIF frames are stored as changes to the previous one,
+        so PIL still has to read through the frames in between. Single-frame images have one
+        frame. generate_signature signs the first frame only.
+
+        Args:
+            path_or_image (string or bytes): image path or URL, or raw bytes
+            bytestream (Optional[boolean]): will the image be passed as raw bytes?
+                That is, is the 'path_or_image' argument an in-memory image? (default False)
+            step (Optional[int]): sign frames 0, step, 2 * step, ... (default 1, every frame)
+            max_frames (Optional[int]): maximum number of frames to sign. If None, go on to the
+                last frame (default None)
+
+        Returns:
+            a contiguous int8 array with one row of length sig_length per chosen frame, in
+                frame order
+
+        Examples:
+            >>> gis = ImageSignature()
+            >>> signatures = gis.generate_frame_signatures('animation.gif', step=10)
+            >>> signatures.shape
+            (12, 648)
+
+        """
+        assert type(step) is int and step > 0, 'step should be an integer > 0'
+        assert max_frames is None or (type(max_frames) is int and max_frames > 0), \
+            'max_frames should be None or an integer > 0'
+        from PIL import Image
+
+        profiler = self.profiler or _NO_PROFILER
+
+        if bytestream:
+            source = _BufferReader(path_or_image)
+        elif os.path.isfile(path_or_image):
+            source = open(path_or_image, 'rb')
+        else:
+            from six.moves.urllib.request import urlopen
+            source = _BufferReader(urlopen(path_or_image).read())
+
+        try:
+            svg = _looks_like_svg(source.read(256))
+            source.seek(0)
+            if svg:
+                img = Image.open(BytesIO(_rasterize_svg(source.read())))
+            else:
+                try:
+                    img = Image.open(source)
+                except IOError:
+                    raise CorruptImageError()
+
+            frames = range(0, getattr(img, 'n_frames', 1), step)[:max_frames]
+            signatures = np.empty((len(frames), self.sig_length), dtype='int8')
+            for i, frame in enumerate(frames):
+                with profiler.stage('preprocess_image') as stage:
+                    img.seek(frame)
+                    im_array = _grey_from_pil(_reduce_on_decode(img, self.decode_size), self.dtype,
+                                              self.workspace)
+                    stage.shape = im_array.shape
+                signatures[i] = self._sign_grey(im_array)
+        finally:
+            source.close()
+
+        return signatures
+
+    def generate_video_signatures(self, frames, skip_distance=None):
+        """Generates signatures for a stream of video frames.
+
+        A generator: frames are read from the iterable one at a time and their signatures are
+        yielded as they are made, so the whole video is never held in memory. What depends
+        only on the frame shape (the sample region size P) is worked out once per shape, and
+        the greyscale frame and other large arrays are written to the same buffers for every
+        frame -- those of the ImageSignature's workspace, or of a workspace made for the
+        stream. Each signature is the same as generate_signature's for the same frame.
+
+        Args:
+            frames (iterable): image arrays (m x n or m x n x 3), typically the decoded frames
+                of a video. Consecutive frames usually share a shape, but needn't
+            skip_distance (Optional[float]): if not None, frames whose signature is within
+                this normalized distance of the last signature yielded are skipped. Comparing
+                with the last one yielded, rather than the previous frame, means a slow pan
+                still yields a frame every so often (default None)
+
+        Yields:
+            (index, signature) pairs, where index is the position of the frame in frames
+
+        Examples:
+            >>> gis = ImageSignature()
+            >>> for index, signature in gis.generate_video_signatures(frames, skip_distance=0.2):
+            ...     print(index)
+            0
+            87
+            311
+
+        """
+        from copy import copy
+
+        gis = copy(self)
+        if gis.workspace is None:
+            gis.workspace = SignatureWorkspace()
+        profiler = gis.profiler or _NO_PROFILER
+
+        shape = None
+        last = None
+        for index, frame in enumerate(frames):
+            if frame.shape[:2] != shape:
+                shape = frame.shape[:2]
+                if self.P is None:
+                    # as compute_mean_level chooses it
+                    gis.P = max([2.0, int(0.5 + min(shape) / 20.)])
+
+            with profiler.stage('preprocess_image', shape):
+                im_array = _grey_from_array(frame, gis.dtype, gis.workspace)
+            signature = gis._sign_grey(im_array)
+
+            if skip_distance is not None and last is not None and \
+                    self.normalized_distance(last, signature) <= skip_distance:
+                continue
+            last = signature
+            yield index, signature
+
+    def generate_signature_streaming(self, image, strip_height=256):
+        """Generates an image signature without holding the whole image in memory.
+
+        For images too large to decode at once. The image is read in horizontal strips to find
+        the cropping boundaries, then one P x P square at a time to find the grey level means, so
+        only one strip of strip_height rows is converted to greyscale at any time. The signature
+        is the same as generate_signature's for the same array.
+
+        Args:
+            image (numpy.ndarray): m x n or m x n x 3 image array, typically a memory map such
+                as np.load(path, mmap_mode='r') or tifffile.memmap(path). Any object with a shape
+                and numpy-style slicing, such as an h5py dataset, will do
+            strip_height (Optional[int]): number of rows read at a time (default 256)
+
+        Returns:
+            The image signature: A rank 1 numpy int8 array of length n x n x 8
+                (or n x n x 4 if diagonal_neighbors == False)
+
+        Examples:
+            >>> gis = ImageSignature()
+            >>> image = np.load('scanned_map.npy', mmap_mode='r')
+            >>> gis.generate_signature_streaming(image)
+            array([ 0,  0,  0,  0,  0,  0,  2,  2,  0,  0,  0,  0,  0,  2,  2,  2,  0,
+                    ...
+                    0,  0], dtype=int8)
+
+        """
+        assert type(strip_height) is int and strip_height > 0, 'strip_height should be an integer > 0'
+        profiler = self.profiler or _NO_PROFILER
+        im_array = _LazyGrey(image, self.dtype)
+
+        # Step 2a:   Determine cropping boundaries, one strip at a time
+        if self.crop_percentiles is not None:
+            # as in _sign_grey, integer levels are only widened with dtype='uint8'
+            widen = np.dtype(self.dtype) == np.uint8
+            with profiler.stage('crop_image', im_array.shape):
+                row_sums = []
+                column_sums = None
+                previous_row = None
+                for top in range(0, im_array.shape[0], strip_height):
+                    strip = im_array[top:top + strip_height]
+                    row_sums.append(np.sum(_absolute_differences(strip, axis=1, widen=widen), axis=1))
+                    if previous_row is not None:
+                        strip = np.concatenate([previous_row, strip])
+                    previous_row = strip[-1:]
+                    # add one row at a time, in the same order as np.sum(..., axis=0)
+                    for row in _absolute_differences(strip, axis=0, widen=widen):
+                        if column_sums is None:
+                            column_sums = row.copy()
+                        else:
+                            column_sums += row
+                if column_sums is None:
+                    column_sums = np.zeros(im_array.shape[1])
+                image_limits = _crop_limits(np.cumsum(np.concatenate(row_sums)), np.cumsum(column_sums),
+                                            im_array.shape, self.lower_percentile, self.upper_percentile,
+                                            self.fix_ratio)
+        else:
+            image_limits = None
+
+        return self._signature_from_grey(im_array, image_limits, integral_image=False)
+
+    def _sign_grey(self, im_array):
+        """Steps 2 to 5 of generate_signature, from the greyscale image."""
+        profiler = self.profiler or _NO_PROFILER
 
         # Step 2a:   Determine cropping boundaries
         if self.crop_percentiles is not None:
-            image_limits = self.crop_image(im_array,
-                                           lower_percentile=self.lower_percentile,
-                                           upper_percentile=self.upper_percentile,
-                                           fix_ratio=self.fix_ratio)
+            with profiler.stage('crop_image', im_array.shape):
+                image_limits = _crop_window(im_array, self.lower_percentile, self.upper_percentile,
+                                            self.fix_ratio, workspace=self.workspace,
+                                            widen=np.dtype(self.dtype) == np.uint8)
         else:
             image_limits = None
 
+        return self._signature_from_grey(im_array, image_limits, integral_image=self.integral_image)
+
+    def _signature_from_grey(self, im_array, image_limits, integral_image):
+        """Steps 2b to 5 of generate_signature, from the greyscale image and its crop window."""
+        profiler = self.profiler or _NO_PROFILER
+
         # Step 2b:   Generate grid centers
-        x_coords, y_coords = self.compute_grid_points(im_array,
-                                                      n=self.n, window=image_limits)
+        with profiler.stage('compute_grid_points', im_array.shape):
+            x_coords, y_coords = self.compute_grid_points(im_array,
+                                                          n=self.n, window=image_limits)
 
         # Step 3:    Compute grey level mean of each P x P
         #           square centered at each grid point
-        avg_grey = self.compute_mean_level(im_array, x_coords, y_coords, P=self.P)
+        with profiler.stage('compute_mean_level', im_array.shape):
+            avg_grey = self.compute_mean_level(im_array, x_coords, y_coords, P=self.P,
+                                               integral_image=integral_image,
+                                               workspace=self.workspace)
+            if np.dtype(self.dtype) == np.uint8:
+                avg_grey /= 255.
 
         # Step 4a:   Compute array of differences for each
         #           grid point vis-a-vis each neighbor
-        diff_mat = self.compute_differentials(avg_grey,
-                                              diagonal_neighbors=self.diagonal_neighbors)
+        with profiler.stage('compute_differentials', avg_grey.shape):
+            if self.workspace is None:
+                out = None
+            else:
+                out = self.workspace.array('differentials', avg_grey.shape + (4 + 4 * self.diagonal_neighbors,),
+                                           np.float64)
+            diff_mat = self.compute_differentials(avg_grey,
+                                                  diagonal_neighbors=self.diagonal_neighbors,
+                                                  out=out)
 
         # Step 4b: Bin differences to only 2n+1 values
-        self.normalize_and_threshold(diff_mat,
-                                     identical_tolerance=self.identical_tolerance,
-                                     n_levels=self.n_levels)
+        with profiler.stage('normalize_and_threshold', diff_mat.shape):
+            signature = self.normalize_and_threshold(diff_mat,
+                                                     identical_tolerance=self.identical_tolerance,
+                                                     n_levels=self.n_levels,
+                                                     out=np.empty(diff_mat.shape, dtype='int8'))
 
         # Step 5: Flatten array and return signature
-        return np.ravel(diff_mat).astype('int8')
+        return np.ravel(signature)
+
+    def __getstate__(self):
+        # profilers (and their callbacks) stay in the process they were attached in, and
+        # worker processes get workspaces of their own
+        state = self.__dict__.copy()
+        state['profiler'] = None
+        if self.workspace is not None:
+            state['workspace'] = SignatureWorkspace()
+        return state
+
+    def orientation_signatures(self, signature):
+        """Derives the signatures of rotated, mirrored and inverted copies of an image.
+
+        Rotating or mirroring an image moves its grid points and their neighbors around, and
+        inverting it negates every difference, so the signatures of all 16 combinations can be
+        computed from the image's own signature, without transforming the image and signing it
+        again. They match the signatures of the transformed images except where cropping or
+        rounding of the grid is not symmetric, which can happen whatever the image's shape and
+        changes a small fraction of values.
+
+        Args:
+            signature (numpy.ndarray): a signature generated with this ImageSignature's settings
+
+        Returns:
+            an array of unique signatures, one per row, starting with signature itself. Symmetric
+                images have fewer than 16
+
+        Examples:
+            >>> sig = gis.generate_signature('https://pixabay.com/static/uploads/photo/2012/11/28/08/56/mona-lisa-67506_960_720.jpg')
+            >>> gis.orientation_signatures(sig).shape
+            (16, 648)
+
+        """
+        neighbors = _NEIGHBORS if self.diagonal_neighbors else _NON_DIAGONAL_NEIGHBORS
+        planes = np.reshape(signature, (self.n, self.n, len(neighbors)))
+
+        variants = []
+        seen = set()
+        for inversion, rotations, mirror in product([1, -1], range(4), [False, True]):
+            transformed = inversion * planes
+            offsets = neighbors
+            if mirror:
+                transformed = transformed[:, ::-1]
+                offsets = [(row, -column) for row, column in offsets]
+            transformed = np.rot90(transformed, rotations)
+            for _ in range(rotations):
+                offsets = [(-column, row) for row, column in offsets]
+            # put each neighbor's differences where its new offset belongs
+            transformed = transformed[:, :, np.argsort([neighbors.index(offset) for offset in offsets])]
+
+            variant = np.ravel(transformed).astype(signature.dtype)
+            key = variant.tobytes()
+            if key not in seen:
+                seen.add(key)
+                variants.append(variant)
+
+        return np.array(variants)
 
     @staticmethod
-    def preprocess_image(image_or_path, bytestream=False, handle_mpo=False):
+    def preprocess_image(image_or_path, bytestream=False, handle_mpo=False, decode_size=None,
+                         dtype='float64', workspace=None):
         """Loads an image and converts to greyscale.
 
         Corresponds to 'step 1' in Goldberg's paper
@@ -199,10 +694,21 @@ class ImageSignature(object):
         Args:
             image_or_path (string or numpy.ndarray): image path, or image array
             bytestream (Optional[boolean]): will the image be passed as raw bytes?
-                That is, is the 'path_or_image' argument an in-memory image?
-                (default False)
-            handle_mpo (Optional[boolean]): try to compute a signature for steroscopic
-                images by extracting the first image of the set (default False)
+                That is, is the 'path_or_image' argument an in-memory image? Any buffer --
+                bytes, bytearray, memoryview or mmap.mmap -- is read in place, without copying
+                it (default False)
+            handle_mpo (Optional[boolean]): kept for compatibility. The first frame of MPOs
+                and other multi-frame images (animated GIFs, multi-page TIFFs) is always the one
+                decoded; see generate_frame_signatures for the others (default False)
+            decode_size (Optional[int]): if not None, images decoded with PIL are shrunk while
+                decoding by the largest factor that keeps their shorter side at least
+                decode_size pixels. JPEGs are scaled in the DCT, so the full-size image is never
+                held in memory (default None)
+            dtype (Optional[string]): 'float64' or 'float32' for grey levels between 0 and 1, or
+                'uint8' for grey levels between 0 and 255, decoded straight to PIL's 'L' mode
+                where possible (default 'float64')
+            workspace (Optional[SignatureWorkspace]): if not None, the greyscale image is written
+                to its 'grey' buffer, and is overwritten by the next image (default None)
 
         Returns:
             Array of floats corresponding to greyscale level at each pixel
@@ -224,42 +730,65 @@ class ImageSignature(object):
                      0.02739059,  0.01954745]])
 
         """
+        from PIL import Image
+        from skimage.io import imread
+
         if bytestream:
+            # sniff the format first, so SVGs go straight to the rasteriser and other images
+            # are only decoded once
+            if _looks_like_svg(image_or_path):
+                img = Image.open(BytesIO(_rasterize_svg(image_or_path)))
+                img = _reduce_on_decode(img, decode_size)
+                return _grey_from_pil(img, dtype, workspace)
+            reader = _BufferReader(image_or_path)
             try:
-                img = Image.open(BytesIO(image_or_path))
-            except IOError:
-                # could be an svg, attempt to convert
                 try:
-                    img = Image.open(BytesIO(svg2png(image_or_path)))
-                except (NameError, xml.etree.ElementTree.ParseError):
+                    img = Image.open(reader)
+                except IOError:
                     raise CorruptImageError()
-            img = img.convert('RGB')
-            return rgb2gray(np.asarray(img, dtype=np.uint8))
+                img = _reduce_on_decode(img, decode_size)
+                return _grey_from_pil(img, dtype, workspace)
+            finally:
+                reader.close()
         elif type(image_or_path) in string_types or \
              type(image_or_path) is text_type:
-            return imread(image_or_path, as_gray=True)
+            if _is_svg_file(image_or_path):
+                with open(image_or_path, 'rb') as f:
+                    img = Image.open(BytesIO(_rasterize_svg(f.read())))
+                img = _reduce_on_decode(img, decode_size)
+                return _grey_from_pil(img, dtype, workspace)
+            try:
+                img = Image.open(image_or_path)
+            except IOError:
+                # not a local file PIL can read (e.g. a URL)
+                img = None
+            if img is not None:
+                # skimage would read every frame of an animated or multi-page image, while PIL
+                # stops at the first
+                if getattr(img, 'is_animated', False) or decode_size is not None or \
+                        np.dtype(dtype) != np.float64:
+                    with img:
+                        return _grey_from_pil(_reduce_on_decode(img, decode_size), dtype, workspace)
+                img.close()
+            if np.dtype(dtype) == np.float64:
+                return _imread_grey(image_or_path, workspace)
+            return _grey_from_array(imread(image_or_path), dtype, workspace)
         elif type(image_or_path) is bytes:
             try:
                 img = Image.open(image_or_path)
-                arr = np.array(img.convert('RGB'))
             except IOError:
                 # try again due to PIL weirdness
-                return imread(image_or_path, as_gray=True)
-            if handle_mpo:
-                # take the first images from the MPO
-                if arr.shape == (2,) and isinstance(arr[1].tolist(), MpoImageFile):
-                    return rgb2gray(arr[0])
-                else:
-                    return rgb2gray(arr)
-            else:
-                return rgb2gray(arr)
+                return _grey_from_array(imread(image_or_path, as_gray=True), dtype, workspace)
+            # PIL opens multi-frame images (MPO, GIF, TIFF) at their first frame
+            with img:
+                return _grey_from_pil(_reduce_on_decode(img, decode_size), dtype, workspace)
         elif type(image_or_path) is np.ndarray:
-            return rgb2gray(image_or_path)
+            return _grey_from_array(image_or_path, dtype, workspace)
         else:
             raise TypeError('Path or image required.')
 
     @staticmethod
-    def crop_image(image, lower_percentile=5, upper_percentile=95, fix_ratio=False):
+    def crop_image(image, lower_percentile=5, upper_percentile=95, fix_ratio=False, workspace=None):
         """Crops an image, removing featureless border regions.
 
         Corresponds to the first part of 'step 2' in Goldberg's paper
@@ -273,6 +802,8 @@ class ImageSignature(object):
                 for using the fast signature transforms on sparse but very similar images (e.g.
                 renderings from fixed directions). Use with care -- only use if you can guarantee the
                 incoming image is square (default False).
+            workspace (Optional[SignatureWorkspace]): if not None, the pixel differences are
+                written to its 'differences' buffer instead of new arrays (default None)
 
         Returns:
             A pair of tuples describing the 'window' of the image to use in analysis: [(top, bottom), (left, right)]
@@ -283,45 +814,7 @@ class ImageSignature(object):
             [(36, 684), (24, 452)]
 
         """
-        # row-wise differences
-        rw = np.cumsum(np.sum(np.abs(np.diff(image, axis=1)), axis=1))
-        # column-wise differences
-        cw = np.cumsum(np.sum(np.abs(np.diff(image, axis=0)), axis=0))
-
-        # compute percentiles
-        upper_column_limit = np.searchsorted(cw,
-                                             np.percentile(cw, upper_percentile),
-                                             side='left')
-        lower_column_limit = np.searchsorted(cw,
-                                             np.percentile(cw, lower_percentile),
-                                             side='right')
-        upper_row_limit = np.searchsorted(rw,
-                                          np.percentile(rw, upper_percentile),
-                                          side='left')
-        lower_row_limit = np.searchsorted(rw,
-                                          np.percentile(rw, lower_percentile),
-                                          side='right')
-
-        # if image is nearly featureless, use default region
-        if lower_row_limit > upper_row_limit:
-            lower_row_limit = int(lower_percentile/100.*image.shape[0])
-            upper_row_limit = int(upper_percentile/100.*image.shape[0])
-        if lower_column_limit > upper_column_limit:
-            lower_column_limit = int(lower_percentile/100.*image.shape[1])
-            upper_column_limit = int(upper_percentile/100.*image.shape[1])
-
-        # if fix_ratio, return both limits as the larger range
-        if fix_ratio:
-            if (upper_row_limit - lower_row_limit) > (upper_column_limit - lower_column_limit):
-                return [(lower_row_limit, upper_row_limit),
-                        (lower_row_limit, upper_row_limit)]
-            else:
-                return [(lower_column_limit, upper_column_limit),
-                        (lower_column_limit, upper_column_limit)]
-
-        # otherwise, proceed as normal
-        return [(lower_row_limit, upper_row_limit),
-                (lower_column_limit, upper_column_limit)]
+        return _crop_window(image, lower_percentile, upper_percentile, fix_ratio, workspace=workspace)
 
     @staticmethod
     def compute_grid_points(image, n=9, window=None):
@@ -358,7 +851,7 @@ class ImageSignature(object):
         return x_coords, y_coords      # return pairs
 
     @staticmethod
-    def compute_mean_level(image, x_coords, y_coords, P=None):
+    def compute_mean_level(image, x_coords, y_coords, P=None, integral_image=False, workspace=None):
         """Computes array of greyness means.
 
         Corresponds to 'step 3'
@@ -369,6 +862,12 @@ class ImageSignature(object):
             x_coords (numpy.ndarray): array of row numbers
             y_coords (numpy.ndarray): array of column numbers
             P (Optional[int]): size of boxes in pixels (default None)
+            integral_image (Optional[boolean]): compute all the means from a single summed-area
+                table instead of one slice at a time. Much faster for large grids. The means of an
+                integer image are exactly the default's, and those of a float image agree with
+                them to within floating point rounding (default False)
+            workspace (Optional[SignatureWorkspace]): with integral_image, build the summed-area
+                table in its buffers instead of new arrays (default None)
 
         Returns:
             an N x N array of average greyscale around the gridpoint, where N is the
@@ -403,6 +902,9 @@ class ImageSignature(object):
         if P is None:
             P = max([2.0, int(0.5 + min(image.shape)/20.)])     # per the paper
 
+        if integral_image:
+            return _integral_mean_level(image, x_coords, y_coords, P, workspace)
+
         avg_grey = np.zeros((x_coords.shape[0], y_coords.shape[0]))
 
         for i, x in enumerate(x_coords):        # not the fastest implementation
@@ -418,7 +920,7 @@ class ImageSignature(object):
         return avg_grey
 
     @staticmethod
-    def compute_differentials(grey_level_matrix,  diagonal_neighbors=True):
+    def compute_differentials(grey_level_matrix,  diagonal_neighbors=True, out=None):
         """Computes differences in greylevels for neighboring grid points.
 
         First part of 'step 4' in the paper.
@@ -441,6 +943,8 @@ class ImageSignature(object):
             grey_level_matrix (numpy.ndarray): grid of values sampled from image
             diagonal_neighbors (Optional[boolean]): whether or not to use diagonal
                 neighbors (default True)
+            out (Optional[numpy.ndarray]): float array of the right shape to write the
+                differences to, instead of a new array (default None)
 
         Returns:
             a n x n x 8 rank 3 numpy array for an n x n grid (if diagonal_neighbors == True)
@@ -466,61 +970,38 @@ class ImageSignature(object):
                     ...
 
         """
-        right_neighbors = -np.concatenate((np.diff(grey_level_matrix),
-                                           np.zeros(grey_level_matrix.shape[0]).
-                                           reshape((grey_level_matrix.shape[0], 1))),
-                                          axis=1)
-        left_neighbors = -np.concatenate((right_neighbors[:, -1:],
-                                          right_neighbors[:, :-1]),
-                                         axis=1)
-
-        down_neighbors = -np.concatenate((np.diff(grey_level_matrix, axis=0),
-                                          np.zeros(grey_level_matrix.shape[1]).
-                                          reshape((1, grey_level_matrix.shape[1]))))
+        if diagonal_neighbors:
+            neighbors = _NEIGHBORS
+        else:
+            neighbors = _NON_DIAGONAL_NEIGHBORS
 
-        up_neighbors = -np.concatenate((down_neighbors[-1:], down_neighbors[:-1]))
+        # each plane is the grid minus the grid shifted towards one neighbor.
+        # Grid points without that neighbor keep the zero they start with
+        n_rows, n_cols = grey_level_matrix.shape
+        if out is None:
+            differentials = np.zeros((n_rows, n_cols, len(neighbors)))
+        else:
+            differentials = out
+            differentials[...] = 0
+        for i, (row_offset, col_offset) in enumerate(neighbors):
+            rows, neighbor_rows = _shifted_slices(n_rows, row_offset)
+            cols, neighbor_cols = _shifted_slices(n_cols, col_offset)
+            np.subtract(grey_level_matrix[rows, cols],
+                        grey_level_matrix[neighbor_rows, neighbor_cols],
+                        out=differentials[rows, cols, i])
 
-        if diagonal_neighbors:
-            # this implementation will only work for a square (m x m) grid
-            diagonals = np.arange(-grey_level_matrix.shape[0] + 1,
-                                  grey_level_matrix.shape[0])
-
-            upper_left_neighbors = sum(
-                [np.diagflat(np.insert(np.diff(np.diag(grey_level_matrix, i)), 0, 0), i)
-                 for i in diagonals])
-            lower_right_neighbors = -np.pad(upper_left_neighbors[1:, 1:],
-                                            (0, 1), mode='constant')
-
-            # flip for anti-diagonal differences
-            flipped = np.fliplr(grey_level_matrix)
-            upper_right_neighbors = sum([np.diagflat(np.insert(
-                np.diff(np.diag(flipped, i)), 0, 0), i) for i in diagonals])
-            lower_left_neighbors = -np.pad(upper_right_neighbors[1:, 1:],
-                                           (0, 1), mode='constant')
-
-            return np.dstack(np.array([
-                upper_left_neighbors,
-                up_neighbors,
-                np.fliplr(upper_right_neighbors),
-                left_neighbors,
-                right_neighbors,
-                np.fliplr(lower_left_neighbors),
-                down_neighbors,
-                lower_right_neighbors]))
-
-        return np.dstack(np.array([
-            up_neighbors,
-            left_neighbors,
-            right_neighbors,
-            down_neighbors]))
+        return differentials
 
     @staticmethod
     def normalize_and_threshold(difference_array,
-                                identical_tolerance=2/255., n_levels=2):
+                                identical_tolerance=2/255., n_levels=2, out=None):
         """Normalizes difference matrix in place.
 
         'Step 4' of the paper.  The flattened version of this array is the image signature.
 
+        Each difference is binned with a single lookup against the sorted level cutoffs, rather
+        than with a pair of masks per level.
+
         Args:
             difference_array (numpy.ndarray): n x n x l array, where l are the differences between
                 the grid point and its neighbors. Typically the output of compute_differentials
@@ -528,6 +1009,11 @@ class ImageSignature(object):
                 still be considered equivalent (default 2/255)
             n_levels (Optional[int]): bin differences into 2 n + 1 bins (e.g. n_levels=2 -> [-2, -1,
                 0, 1, 2])
+            out (Optional[numpy.ndarray]): array of the same shape, typically int8, to write the
+                levels to instead. difference_array is then left untouched (default None)
+
+        Returns:
+            out, or None if out is not given
 
         Examples:
             >>> img = gis.preprocess_image('https://pixabay.com/static/uploads/photo/2012/11/28/08/56/mona-lisa-67506_960_720.jpg')
@@ -555,31 +1041,33 @@ class ImageSignature(object):
 
         """
 
-        # set very close values as equivalent
-        mask = np.abs(difference_array) < identical_tolerance
-        difference_array[mask] = 0.
+        if out is None:
+            out = difference_array
+            result = None
+        else:
+            result = out
+
+        # values closer to zero than this are set to zero as equivalent
+        lower_limit = max(identical_tolerance, np.nextafter(0., 1.))
+        positive_values = difference_array[difference_array >= lower_limit]
+        negative_values = difference_array[difference_array <= -lower_limit]
 
         # if image is essentially featureless, exit here
-        if np.all(mask):
-            return None
+        if positive_values.size == 0 and negative_values.size == 0:
+            out[...] = 0
+            return result
 
         # bin so that size of bins on each side of zero are equivalent
-        positive_cutoffs = np.percentile(difference_array[difference_array > 0.],
+        positive_cutoffs = np.percentile(positive_values,
                                          np.linspace(0, 100, n_levels+1))
-        negative_cutoffs = np.percentile(difference_array[difference_array < 0.],
+        negative_cutoffs = np.percentile(negative_values,
                                          np.linspace(100, 0, n_levels+1))
 
-        for level, interval in enumerate([positive_cutoffs[i:i+2]
-                                          for i in range(positive_cutoffs.shape[0] - 1)]):
-            difference_array[(difference_array >= interval[0]) &
-                             (difference_array <= interval[1])] = level + 1
-
-        for level, interval in enumerate([negative_cutoffs[i:i+2]
-                                          for i in range(negative_cutoffs.shape[0] - 1)]):
-            difference_array[(difference_array <= interval[0]) &
-                             (difference_array >= interval[1])] = -(level + 1)
+        edges, levels = _level_edges(positive_cutoffs, negative_cutoffs)
+        np.take(np.array(levels, dtype=out.dtype), np.searchsorted(edges, difference_array),
+                out=out)
 
-        return None
+        return result
 
     @staticmethod
     def normalized_distance(_a, _b):
@@ -607,3 +1095,625 @@ class ImageSignature(object):
         norm1 = np.linalg.norm(b)
         norm2 = np.linalg.norm(a)
         return norm_diff / (norm1 + norm2)
+
+
+def _fixed_point(array, out=None):
+    """Converts an array of floats to integers that can be summed exactly.
+
+    Summing floats rounds differently depending on what else is in the sum, so
+    identical patches of an image could otherwise end up with slightly different
+    means. Integer arrays are returned as they are.
+
+    Args:
+        array (numpy.ndarray): array to convert
+        out (Optional[numpy.ndarray]): float array of the same shape to write the result to
+
+    Returns:
+        a tuple of the integer-valued array and the power of two it was scaled by. The
+            scale is as large as possible without the sum of the whole array
+            overflowing an int64
+
+    """
+    if array.dtype.kind in 'biu':
+        return array, 1
+
+    peak = max(-array.min(), array.max()) * array.size if array.size else 0.
+    if not peak > 0.:
+        return array, 1
+
+    scale = 2. ** (62 - int(np.ceil(np.log2(peak))))
+    scaled = np.multiply(array, scale, out=out)
+    return np.rint(scaled, out=scaled), scale
+
+
+def _integral_mean_level(image, x_coords, y_coords, P, workspace=None):
+    """Computes the P x P window means of compute_mean_level from a summed-area table.
+
+    Windows are clamped at the image edges exactly as in compute_mean_level, and a
+    window that starts past the edge is empty, so its mean is nan.
+
+    Args:
+        image (numpy.ndarray): n x m array -- the greyscale image
+        x_coords (numpy.ndarray): array of row numbers
+        y_coords (numpy.ndarray): array of column numbers
+        P (int): size of boxes in pixels
+        workspace (Optional[SignatureWorkspace]): buffers for the table, if not None
+
+    Returns:
+        an N x N array of average greyscale around the gridpoint
+
+    """
+    lower_x_lims = np.maximum(x_coords - P/2, 0).astype(int)
+    upper_x_lims = np.minimum(lower_x_lims + P, image.shape[0]).astype(int)
+    lower_y_lims = np.maximum(y_coords - P/2, 0).astype(int)
+    upper_y_lims = np.minimum(lower_y_lims + P, image.shape[1]).astype(int)
+    lower_x_lims = np.minimum(lower_x_lims, upper_x_lims)
+    lower_y_lims = np.minimum(lower_y_lims, upper_y_lims)
+
+    # only rows and columns inside some window contribute, so drop the rest
+    # before building the table. A window start maps to the number of kept rows
+    # or columns before it
+    x_kept = _covered(lower_x_lims, upper_x_lims, image.shape[0])
+    y_kept = _covered(lower_y_lims, upper_y_lims, image.shape[1])
+    x_index = np.concatenate(([0], np.cumsum(x_kept)))
+    y_index = np.concatenate(([0], np.cumsum(y_kept)))
+
+    # table with a leading row and column of zeros so that each window sum is
+    # four lookups
+    if x_kept.all() and y_kept.all():
+        region = image
+    else:
+        region = image[np.ix_(x_kept, y_kept)]
+    table_shape = (region.shape[0] + 1, region.shape[1] + 1)
+    if workspace is None:
+        region, scale = _fixed_point(region)
+        table = np.zeros(table_shape, dtype=np.int64)
+    else:
+        out = None
+        if region.dtype.kind == 'f':
+            out = workspace.array('fixed_point', region.shape, region.dtype)
+        region, scale = _fixed_point(region, out=out)
+        table = workspace.array('table', table_shape, np.int64)
+        table[0] = 0
+        table[:, 0] = 0
+    np.cumsum(region, axis=1, dtype=np.int64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=0, out=table[1:, 1:])
+
+    lx = x_index[lower_x_lims][:, np.newaxis]
+    ux = x_index[upper_x_lims][:, np.newaxis]
+    ly = y_index[lower_y_lims]
+    uy = y_index[upper_y_lims]
+
+    sums = table[ux, uy] - table[lx, uy] - table[ux, ly] + table[lx, ly]
+    counts = (ux - lx) * (uy - ly)
+
+    with np.errstate(invalid='ignore'):
+        return sums / scale / counts
+
+
+def _covered(lower_lims, upper_lims, size):
+    """Marks the positions along one axis that fall inside at least one window.
+
+    Args:
+        lower_lims (numpy.ndarray): first position of each window
+        upper_lims (numpy.ndarray): one past the last position of each window
+        size (int): length of the axis
+
+    Returns:
+        a boolean array of length size
+
+    """
+    edges = np.zeros(size + 1, dtype=int)
+    np.add.at(edges, lower_lims, 1)
+    np.add.at(edges, upper_lims, -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def _shifted_slices(size, offset):
+    """Slices pairing each position along an axis with the one offset from it.
+
+    Args:
+        size (int): length of the axis
+        offset (int): -1, 0 or 1
+
+    Returns:
+        a tuple of slices (positions, neighbor positions). Positions whose neighbor would fall
+            off the end of the axis are left out
+
+    """
+    return (slice(max(-offset, 0), size - max(offset, 0)),
+            slice(max(offset, 0), size - max(-offset, 0)))
+
+
+def _level_edges(positive_cutoffs, negative_cutoffs):
+    """Builds a lookup table that bins differences in one pass.
+
+    Binning used to assign the levels one at a time with a pair of masks each,
+    overwriting values in place. A value on a boundary between two levels takes the
+    lower one, and a value already replaced by its level number was moved again if
+    that number fell in a later interval (e.g. a level 1 value when the largest
+    difference is exactly 1.0). Both are reproduced here, so signatures do not change.
+
+    Args:
+        positive_cutoffs (numpy.ndarray): ascending boundaries of the positive levels
+        negative_cutoffs (numpy.ndarray): descending boundaries of the negative levels
+
+    Returns:
+        a tuple (edges, levels): differences d binned with searchsorted(edges, d) index
+            into the list levels
+
+    """
+    # searchsorted counts the edges strictly below a value, so edges that a value
+    # may equal and still be counted are moved down by one float. In order: the
+    # lower bounds of the negative levels, the end of the negative side, the start
+    # of the positive side and the upper bounds of the positive levels
+    edges = np.concatenate((np.nextafter(negative_cutoffs[:0:-1], -np.inf),
+                            negative_cutoffs[:1],
+                            np.nextafter(positive_cutoffs[:1], -np.inf),
+                            positive_cutoffs[1:]))
+
+    negative_levels = _chained_levels((-negative_cutoffs).tolist())
+    positive_levels = _chained_levels(positive_cutoffs.tolist())
+
+    # below the lowest edge is impossible, and above the highest only happens for nan
+    levels = [0] + [-level for level in negative_levels[::-1]] + [0] + positive_levels + [0]
+    return edges, levels
+
+
+def _chained_levels(bounds):
+    """Final level of a value first binned in each level, given ascending level boundaries."""
+    n_levels = len(bounds) - 1
+
+    levels = list(range(1, n_levels + 1))
+    for first in range(n_levels):
+        for later in range(first + 1, n_levels):
+            if bounds[later] <= levels[first] <= bounds[later + 1]:
+                levels[first] = later + 1
+
+    return levels
+
+
+def _sign_all(gis, tasks, workers=None, chunksize=8):
+    """Signs (path_or_image, bytestream) tasks, in parallel unless workers is 1.
+
+    Args:
+        gis (ImageSignature): signature generator
+        tasks (iterable): (path_or_image, bytestream) pairs, as for generate_signature
+        workers (Optional[int]): number of worker processes. If None, one per CPU is used.
+            If 1, the images are signed in this process (default None)
+        chunksize (Optional[int]): number of tasks handed to a worker at a time (default 8)
+
+    Returns:
+        a list of (signature, error) tuples as returned by _sign, in task order
+
+    """
+    with _SigningPool(gis, workers=workers) as pool:
+        return pool.sign_async(tasks, chunksize=chunksize).get()
+
+
+class _SigningPool(object):
+    """Worker processes signing with one ImageSignature, kept for many batches of tasks.
+
+    Starting a pool forks the workers and sends each the ImageSignature, so callers signing in
+    batches start one for all of them. Batches are signed asynchronously: the next can be
+    started while the results of the last are being used. With workers=1 there are no worker
+    processes, and each batch is signed in this process when its results are asked for.
+
+    """
+    def __init__(self, gis, workers=None):
+        from multiprocessing import cpu_count, Pool
+
+        if workers is None:
+            workers = cpu_count()
+
+        self.gis = gis
+        self._pool = None
+        if workers != 1:
+            self._pool = Pool(workers, initializer=_start_signature_worker, initargs=(gis,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if self._pool is None:
+            return
+        if exc_type is None:
+            self._pool.close()
+        else:
+            # don't wait for batches nobody will collect
+            self._pool.terminate()
+        self._pool.join()
+
+    def sign_async(self, tasks, chunksize=8):
+        """Starts signing (path_or_image, bytestream) tasks.
+
+        Returns:
+            an object whose get() method returns the list of (signature, error) tuples, as
+                returned by _sign, in task order
+
+        """
+        if self._pool is None:
+            return _Deferred(lambda: [_sign(self.gis, path_or_image, bytestream)
+                                      for path_or_image, bytestream in tasks])
+        return self._pool.map_async(_sign_in_worker, tasks, chunksize)
+
+    def cache_keys(self, paths, chunksize=8):
+        """SignatureCache keys of image files, each read and hashed in a worker process."""
+        from image_match.signature_cache import SignatureCache
+        if self._pool is None:
+            return [SignatureCache.key(self.gis, path) for path in paths]
+        return self._pool.map(_cache_key_in_worker, paths, chunksize)
+
+
+class _Deferred(object):
+    """Result of _SigningPool.sign_async without worker processes: computed by get()."""
+    def __init__(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function()
+
+
+def _start_signature_worker(gis):
+    """Stores the ImageSignature a generate_signatures worker process signs with."""
+    global _worker_signature
+    _worker_signature = gis
+
+
+def _sign_in_worker(task):
+    """Signs one (path_or_image, bytestream) task in a generate_signatures worker process."""
+    return _sign(_worker_signature, *task)
+
+
+def _cache_key_in_worker(path):
+    """Computes the SignatureCache key of an image file in a worker process."""
+    from image_match.signature_cache import SignatureCache
+    return SignatureCache.key(_worker_signature, path)
+
+
+def _sign(gis, path_or_image, bytestream):
+    """Signs one image, catching any error so that a batch can carry on.
+
+    Args:
+        gis (ImageSignature): signature generator
+        path_or_image (string or numpy.ndarray): as for generate_signature
+        bytestream (boolean): as for generate_signature
+
+    Returns:
+        a tuple (signature, error), one of which is None. Errors that can't be sent back from a
+            worker process are replaced by a RuntimeError describing them
+
+    """
+    try:
+        return gis.generate_signature(path_or_image, bytestream=bytestream), None
+    except Exception as e:
+        import pickle
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError(repr(e))
+        return None, e
+
+
+def _reduce_on_decode(img, size):
+    """Shrinks a PIL image by the largest integer factor keeping its shorter side >= size.
+
+    JPEGs are reduced with draft(), which scales by 1/2, 1/4 or 1/8 while decoding. Other
+    formats are decoded in full, then reduced by box averaging.
+
+    Args:
+        img (PIL.Image.Image): an opened, not yet loaded, image
+        size (int or None): minimum length of the shorter side. If None, img is returned as is
+
+    Returns:
+        a PIL image
+
+    """
+    if size is None:
+        return img
+    factor = min(img.size) // size
+    if factor < 2:
+        return img
+    if img.format == 'JPEG':
+        img.draft('RGB', (img.size[0] // factor, img.size[1] // factor))
+        return img
+    if img.mode not in ('1', 'L', 'LA', 'I', 'F', 'RGB', 'RGBA', 'RGBa', 'La'):
+        img = img.convert('RGB')
+    return img.reduce(factor)
+
+
+def _grey_from_pil(img, dtype, workspace=None):
+    """Decodes a PIL image to a greyscale array of the given dtype (see preprocess_image)."""
+    if np.dtype(dtype) == np.uint8:
+        return np.asarray(img.convert('L'))
+    return _grey_from_array(np.asarray(img.convert('RGB'), dtype=np.uint8), dtype, workspace)
+
+
+def _imread_grey(path, workspace=None):
+    """imread(path, as_gray=True), converting colour images into the workspace if there is one."""
+    from skimage.io import imread
+    if workspace is None:
+        return imread(path, as_gray=True)
+    image = imread(path)
+    if image.ndim == 2:
+        return image
+    if image.ndim == 3 and image.shape[2] == 3:
+        return _grey_from_array(image, np.float64, workspace)
+    # alpha channels and other layouts, as skimage handles them
+    return imread(path, as_gray=True)
+
+
+def _looks_like_svg(buffer):
+    """Tells SVGs from raster images by their first bytes: no raster format starts with '<'."""
+    head = np.frombuffer(buffer, dtype=np.uint8)[:256].tobytes()
+    return head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<')
+
+
+def _is_svg_file(path):
+    """Is path a local file holding an SVG?"""
+    try:
+        with open(path, 'rb') as f:
+            return _looks_like_svg(f.read(256))
+    except (IOError, OSError):
+        # not a local file (e.g. a URL)
+        return False
+
+
+def _rasterize_svg(buffer):
+    """Converts an SVG to PNG bytes with cairosvg, raising CorruptImageError if it can't."""
+    from xml.etree.ElementTree import ParseError
+    try:
+        from cairosvg import svg2png
+        return svg2png(bytestring=bytes(buffer))
+    except (ImportError, IOError, ParseError):
+        raise CorruptImageError()
+
+
+class _BufferReader(RawIOBase):
+    """Read-only, seekable file object over any buffer (bytes, bytearray, memoryview, mmap).
+
+    PIL reads the image through it a block at a time, so the buffer is never copied whole.
+    close() releases the buffer, so that e.g. an mmap can be closed afterwards.
+
+    """
+    def __init__(self, buffer):
+        self._data = np.frombuffer(buffer, dtype=np.uint8)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        start = self._position
+        stop = len(self._data) if size is None or size < 0 else min(start + size, len(self._data))
+        self._position = max(start, stop)
+        return self._data[start:stop].tobytes()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._data)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._data = np.zeros(0, dtype=np.uint8)
+        super(_BufferReader, self).close()
+
+
+class _LazyGrey(object):
+    """Greyscale view of an image array, converting only the slices that are read from it.
+
+    Has the shape and slicing that crop_image, compute_grid_points and compute_mean_level use,
+    so those steps can work on images too large to convert in full.
+
+    """
+    def __init__(self, image, dtype):
+        self.image = image
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(image.shape[:2])
+
+    def __getitem__(self, key):
+        return _grey_from_array(np.asarray(self.image[key]), self.dtype)
+
+
+def _grey_from_array(array, dtype, workspace=None):
+    """Converts an image array to a greyscale array of the given dtype (see preprocess_image).
+
+    float64 conversion is done by rgb2gray, and greyscale arrays are kept as they are, levels
+    included, as rgb2gray used to and as greyscale files are read (see _imread_grey), so that
+    a file and its array sign the same. Otherwise the grey levels are accumulated one channel
+    at a time in float32, so that no full-size float64 copy of the image is made. With a
+    workspace, the result is written to its 'grey' buffer; rgb2gray is then applied
+    _WORKSPACE_STRIP_ROWS rows at a time, which gives the same values.
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float64:
+        if array.ndim == 2:
+            return np.ascontiguousarray(array)
+        from skimage.color import rgb2gray
+        if workspace is None:
+            return rgb2gray(array)
+        grey = workspace.array('grey', array.shape[:2], np.float64)
+        for top in range(0, array.shape[0], _WORKSPACE_STRIP_ROWS):
+            grey[top:top + _WORKSPACE_STRIP_ROWS] = rgb2gray(array[top:top + _WORKSPACE_STRIP_ROWS])
+        return grey
+    if dtype == np.uint8 and array.dtype == np.uint8 and array.ndim == 2:
+        return array
+
+    if workspace is None:
+        grey = np.empty(array.shape[:2], dtype=np.float32)
+    else:
+        grey = workspace.array('grey', array.shape[:2], np.float32)
+    if array.ndim == 2:
+        np.copyto(grey, array, casting='unsafe')
+    else:
+        grey[...] = 0
+        weights = _PIL_LUMA_WEIGHTS if dtype == np.uint8 else _RGB2GRAY_WEIGHTS
+        for channel, weight in enumerate(weights):
+            grey += array[..., channel] * np.float32(weight)
+    if array.dtype.kind in 'ui':
+        grey /= np.iinfo(array.dtype).max
+
+    if dtype == np.uint8:
+        grey *= 255
+        # float images may hold levels outside [0, 1] (negated ones, for instance)
+        np.clip(grey, 0, 255, out=grey)
+        return np.rint(grey, out=grey).astype(np.uint8)
+    return grey
+
+
+def _crop_window(image, lower_percentile, upper_percentile, fix_ratio, workspace=None, widen=False):
+    """Crop window of a greyscale image (see crop_image and _absolute_differences for widen)."""
+    # row-wise differences
+    rw = np.cumsum(np.sum(_absolute_differences(image, axis=1, workspace=workspace, widen=widen), axis=1))
+    # column-wise differences
+    cw = np.cumsum(np.sum(_absolute_differences(image, axis=0, workspace=workspace, widen=widen), axis=0))
+
+    return _crop_limits(rw, cw, image.shape, lower_percentile, upper_percentile, fix_ratio)
+
+
+def _absolute_differences(image, axis, workspace=None, widen=False):
+    """Absolute differences between neighboring pixels along an axis, as np.abs(np.diff(...)).
+
+    With widen, integer images are differenced in a wider signed type, so the differences don't
+    wrap around. It is only set for images decoded with dtype='uint8': signatures of greyscale
+    files read with the default dtype have always been computed from the wrapped differences
+    of their uint8 pixels, and changing that would stop them matching the signatures already
+    stored. With a workspace, the differences are written to its 'differences' buffer.
+
+    """
+    head = [slice(None)] * image.ndim
+    tail = [slice(None)] * image.ndim
+    head[axis] = slice(1, None)
+    tail[axis] = slice(None, -1)
+    if widen and image.dtype.kind in 'ui':
+        dtype = np.int16 if image.dtype.itemsize == 1 else np.int64
+    else:
+        dtype = image.dtype
+    shape = list(image.shape)
+    shape[axis] = max(shape[axis] - 1, 0)
+    if workspace is None:
+        differences = np.empty(shape, dtype=dtype)
+    else:
+        differences = workspace.array('differences', shape, dtype)
+    np.subtract(image[tuple(head)], image[tuple(tail)], out=differences, dtype=dtype)
+    return np.abs(differences, out=differences)
+
+
+def _crop_limits(rw, cw, shape, lower_percentile, upper_percentile, fix_ratio):
+    """Crop window from the cumulative row and column differences (see crop_image).
+
+    Args:
+        rw (numpy.ndarray): cumulative sums of the absolute differences along each row
+        cw (numpy.ndarray): cumulative sums of the absolute differences along each column
+        shape (Tuple[int]): shape of the greyscale image
+        lower_percentile (int): as for crop_image
+        upper_percentile (int): as for crop_image
+        fix_ratio (boolean): as for crop_image
+
+    Returns:
+        [(top, bottom), (left, right)], as for crop_image
+
+    """
+    # compute percentiles
+    upper_column_limit = np.searchsorted(cw,
+                                         np.percentile(cw, upper_percentile),
+                                         side='left')
+    lower_column_limit = np.searchsorted(cw,
+                                         np.percentile(cw, lower_percentile),
+                                         side='right')
+    upper_row_limit = np.searchsorted(rw,
+                                      np.percentile(rw, upper_percentile),
+                                      side='left')
+    lower_row_limit = np.searchsorted(rw,
+                                      np.percentile(rw, lower_percentile),
+                                      side='right')
+
+    # if image is nearly featureless, use default region
+    if lower_row_limit > upper_row_limit:
+        lower_row_limit = int(lower_percentile/100.*shape[0])
+        upper_row_limit = int(upper_percentile/100.*shape[0])
+    if lower_column_limit > upper_column_limit:
+        lower_column_limit = int(lower_percentile/100.*shape[1])
+        upper_column_limit = int(upper_percentile/100.*shape[1])
+
+    # if fix_ratio, return both limits as the larger range
+    if fix_ratio:
+        if (upper_row_limit - lower_row_limit) > (upper_column_limit - lower_column_limit):
+            return [(lower_row_limit, upper_row_limit),
+                    (lower_row_limit, upper_row_limit)]
+        else:
+            return [(lower_column_limit, upper_column_limit),
+                    (lower_column_limit, upper_column_limit)]
+
+    # otherwise, proceed as normal
+    return [(lower_row_limit, upper_row_limit),
+            (lower_column_limit, upper_column_limit)]
+
+
+class _ProfiledStage(object):
+    """Times one stage for a SignatureProfiler (see SignatureProfiler.stage)."""
+    def __init__(self, profiler, name, shape):
+        self.profiler = profiler
+        self.name = name
+        self.shape = shape
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            import tracemalloc
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.start_bytes, self.start_peak = tracemalloc.get_traced_memory()
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = default_timer() - self.start
+        peak_bytes = None
+        if self.profiler.trace_memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            if peak <= self.start_peak and not hasattr(tracemalloc, 'reset_peak'):
+                # the peak is an earlier stage's (Python < 3.9): the most that is known about
+                # this one is what it still holds
+                peak = max(current, self.start_bytes)
+            peak_bytes = peak - self.start_bytes
+        self.profiler.record(self.name, seconds, peak_bytes, self.shape)
+
+
+class _NullStage(object):
+    """Stage of _NullProfiler: does nothing."""
+    shape = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _NullProfiler(object):
+    """Stands in for a SignatureProfiler when profiling is off."""
+    _stage = _NullStage()
+
+    def stage(self, name, shape=None):
+        return self._stage
+
+
+_NO_PROFILER = _NullProfiler()
@@ -0,0 +1,368 @@
+from .signature_database_base import SignatureDatabaseBase
+from .signature_database_base import normalized_distance, simple_words
+import json
+import numpy as np
+import os
+
+
+class SignatureMemory(SignatureDatabaseBase):
+    """In-process driver for image-match, with no database server
+
+    Signatures are kept in one contiguous int8 matrix, with one row per image; a row's index
+    is the image's id. The simple words are indexed in compact posting lists (CSR style): a
+    sorted array of keys, each a word code and its position, the offsets of each key's run
+    of ids, and the ids themselves. Paths and metadata are stored as JSON, one record after
+    the other in a byte array.
+
+    Newly added images go to a small pending list, which is searched by brute force and
+    merged into the posting lists in bulk when it grows past pending_limit, on refresh, or on
+    save. With a path, save writes everything to .npy files, and a new SignatureMemory on the
+    same path maps them into memory instead of reading them, so it starts at once and only
+    the pages a search touches are loaded.
+
+    """
+
+    def __init__(self, path=None, size=100, pending_limit=65536, *args, **kwargs):
+        """Extra setup for the in-memory index
+
+        Args:
+            path (Optional[string]): directory to save the database in, and to load it from if
+                it was saved there before. If None, the database is only kept in memory
+                (default None)
+            size (Optional[int]): maximum number of candidates, those sharing the most words,
+                compared with each searched signature (default 100)
+            pending_limit (Optional[int]): number of newly added images searched by brute force
+                before they are merged into the posting lists (default 65536)
+            *args (Optional): Variable length argument list to pass to base constructor
+            **kwargs (Optional): Arbitrary keyword arguments to pass to base constructor
+
+        Examples:
+            >>> from image_match.memory_driver import SignatureMemory
+            >>> ses = SignatureMemory('signatures')
+            >>> ses.add_images(['mona_lisa.jpg', 'caravaggio.jpg'])
+            [None, None]
+            >>> ses.search_image('mona_lisa_copy.jpg')
+            [{'dist': 0.0153, 'id': 0, 'metadata': None, 'path': 'mona_lisa.jpg', 'score': 61}]
+            >>> ses.save()
+
+        """
+        if type(size) is not int:
+            raise TypeError('size should be an integer')
+        if type(pending_limit) is not int:
+            raise TypeError('pending_limit should be an integer')
+
+        super(SignatureMemory, self).__init__(*args, **kwargs)
+
+        self.path = path
+        self.size = size
+        self.pending_limit = pending_limit
+        # keys are position * 3**k + code, with codes below 3**k
+        self._key_base = 3 ** self.k
+
+        # rows of _signatures past _count are spare capacity
+        self._signatures = np.zeros((0, self.gis.sig_length), dtype='int8')
+        self._count = 0
+
+        # posting lists of the first _indexed images, and the words of the others, in batches
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._indexed = 0
+        self._pending_words = []
+
+        # JSON [path, metadata] of the first len(_record_offsets) - 1 images, then the others
+        self._record_data = np.zeros(0, dtype=np.uint8)
+        self._record_offsets = np.zeros(1, dtype=np.int64)
+        self._new_records = []
+
+        if path is not None and os.path.exists(os.path.join(path, 'settings.json')):
+            self._load()
+
+    def __len__(self):
+        return self._count
+
+    def search_single_record(self, rec, pre_filter=None):
+        """Search for the images sharing the most words with a record.
+
+        Args:
+            rec (dict): an image record, in the format returned by make_record. A word may be a
+                list of codes, with probes
+            pre_filter (Optional[callable]): a function of a stored image's metadata, returning
+                whether the image may be matched (default None)
+
+        Returns:
+            a list of matches, as dicts with 'id', 'path', 'metadata', 'score' (the number of
+                words shared) and 'dist' keys
+
+        """
+        self._merge_if_full()
+
+        # one key per distinct (position, code); a stored image has one word per position, so
+        # the keys it matches count the positions it shares
+        codes = []
+        positions = []
+        for i in range(self.N):
+            word = rec['simple_word_%d' % i]
+            if isinstance(word, list):
+                codes.extend(word)
+                positions.extend([i] * len(word))
+            else:
+                codes.append(word)
+                positions.append(i)
+        keys = np.unique(np.array(codes, dtype=np.int64) + np.array(positions, dtype=np.int64) * self._key_base)
+
+        # the ids in the runs of the matching keys, gathered at once
+        runs = self._matching_runs(keys)
+        starts = self._offsets[runs]
+        lengths = self._offsets[runs + 1] - starts
+        first = np.cumsum(lengths) - lengths
+        ids = [self._postings[np.repeat(starts - first, lengths) + np.arange(lengths.sum())]]
+        if self._pending_words:
+            pending = self._pending() + np.arange(self.N) * self._key_base
+            ids.append(self._indexed + np.flatnonzero(np.isin(pending, keys)) // self.N)
+
+        ids, scores = np.unique(np.concatenate(ids), return_counts=True)
+        if ids.size == 0:
+            return []
+
+        # the best candidates, by number of shared words, then by id
+        order = np.argsort(-scores, kind='stable')
+        ids, scores = ids[order], scores[order]
+        records = None
+        if pre_filter is not None:
+            kept_ids, kept_scores, records = [], [], []
+            for i, score in zip(ids, scores):
+                record = self._record(i)
+                if pre_filter(record[1]):
+                    kept_ids.append(i)
+                    kept_scores.append(score)
+                    records.append(record)
+                    if len(kept_ids) == self.size:
+                        break
+            ids, scores = np.array(kept_ids, dtype=np.int64), np.array(kept_scores)
+        else:
+            ids, scores = ids[:self.size], scores[:self.size]
+
+        if ids.size == 0:
+            return []
+        dists = normalized_distance(self._signatures[ids], np.array(rec['signature']))
+
+        matches = []
+        for j, (i, score, dist) in enumerate(zip(ids, scores, dists)):
+            if dist < self.distance_cutoff:
+                path, metadata = records[j] if records is not None else self._record(i)
+                matches.append({'id': int(i), 'score': int(score), 'metadata': metadata, 'path': path,
+                                'dist': dist})
+        return matches
+
+    def insert_single_record(self, rec, refresh_after=False):
+        error = self._append([rec])[0]
+        if error is not None:
+            raise error
+        if refresh_after:
+            self.refresh()
+
+    def insert_many_records(self, recs, refresh_after=False):
+        """Add a batch of image records at once.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            refresh_after (Optional[boolean]): merge them into the posting lists straight away
+                (default False)
+
+        Returns:
+            a list holding, for each record, None if it was added or else the exception raised
+                for it
+
+        """
+        errors = self._append(recs)
+        if refresh_after:
+            self.refresh()
+        return errors
+
+    def refresh(self):
+        """Merges the newly added images into the posting lists."""
+        if not self._pending_words:
+            return
+
+        words = self._pending()
+        ids = np.arange(self._indexed, self._count, dtype=np.int64)
+        # the keys of each position are a range of their own, merged one at a time
+        bounds = np.searchsorted(self._keys, np.arange(self.N + 1) * self._key_base)
+        keys = []
+        counts = []
+        postings = []
+        for i in range(self.N):
+            # the new images sorted by their word here, then by id
+            if self._key_base < 2 ** 31:
+                # a plain sort of word and id packed in one integer is much faster than a
+                # stable argsort
+                packed = np.sort(words[:, i] << 32 | ids)
+                new_keys = (packed >> 32) + i * self._key_base
+                new_postings = (packed & 0xffffffff).astype(np.int32)
+            else:
+                order = np.argsort(words[:, i], kind='stable')
+                new_keys = words[order, i] + i * self._key_base
+                new_postings = ids[order].astype(np.int32)
+
+            old_keys = self._keys[bounds[i]:bounds[i + 1]]
+            old_offsets = self._offsets[bounds[i]:bounds[i + 1] + 1] - self._offsets[bounds[i]]
+            old_postings = self._postings[self._offsets[bounds[i]]:self._offsets[bounds[i + 1]]]
+
+            # each new id goes after the ids already in its key's run, which are all smaller
+            runs = np.searchsorted(old_keys, new_keys, side='right')
+            postings.append(_insert_sorted(old_postings, old_offsets[runs], new_postings))
+
+            # add the keys that are new, and count the ids of every key
+            starts = np.flatnonzero(np.concatenate(([True], new_keys[1:] != new_keys[:-1])))
+            unique_keys = new_keys[starts]
+            at = np.searchsorted(old_keys, unique_keys)
+            missing = np.ones(unique_keys.size, dtype=bool)
+            present = at < old_keys.size
+            missing[present] = old_keys[at[present]] != unique_keys[present]
+            keys.append(_insert_sorted(old_keys, at[missing], unique_keys[missing]))
+            position_counts = _insert_sorted(np.diff(old_offsets), at[missing],
+                                             np.zeros(missing.sum(), dtype=np.int64))
+            # a key lands after the old keys before it and the new keys inserted before it
+            position_counts[at + np.cumsum(missing) - missing] += np.diff(np.append(starts, new_keys.size))
+            counts.append(position_counts)
+
+        self._keys = np.concatenate(keys)
+        self._offsets = np.concatenate(([0], np.cumsum(np.concatenate(counts))))
+        self._postings = np.concatenate(postings)
+        self._indexed = self._count
+        self._pending_words = []
+
+    def save(self, path=None):
+        """Writes the database to .npy files, which later instances map into memory
+
+        Args:
+            path (Optional[string]): directory to save in. If None, the one the database was
+                created with (default None)
+
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('no path to save to')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.refresh()
+        if self._new_records:
+            data = [np.asarray(self._record_data)] + [np.frombuffer(record, dtype=np.uint8)
+                                                      for record in self._new_records]
+            lengths = [len(record) for record in self._new_records]
+            self._record_data = np.concatenate(data)
+            self._record_offsets = np.concatenate((self._record_offsets,
+                                                   self._record_offsets[-1] + np.cumsum(lengths)))
+            self._new_records = []
+
+        arrays = {'signatures': self._signatures[:self._count], 'keys': self._keys, 'offsets': self._offsets,
+                  'postings': self._postings, 'records': self._record_data,
+                  'record_offsets': self._record_offsets}
+        for name, array in arrays.items():
+            # write beside the old file and swap it in, so that processes mapping it aren't disturbed
+            with open(os.path.join(path, name + '.npy.tmp'), 'wb') as f:
+                np.save(f, array)
+            os.replace(os.path.join(path, name + '.npy.tmp'), os.path.join(path, name + '.npy'))
+
+        # written last: a database is only loaded once its settings are there
+        with open(os.path.join(path, 'settings.json.tmp'), 'w') as f:
+            json.dump({'k': self.k, 'N': self.N, 'sig_length': self.gis.sig_length, 'count': self._count}, f)
+        os.replace(os.path.join(path, 'settings.json.tmp'), os.path.join(path, 'settings.json'))
+
+    def _load(self):
+        """Maps a saved database into memory."""
+        with open(os.path.join(self.path, 'settings.json')) as f:
+            settings = json.load(f)
+        for name, value in [('k', self.k), ('N', self.N), ('sig_length', self.gis.sig_length)]:
+            if settings[name] != value:
+                raise ValueError('database at %s was saved with %s=%r, not %r'
+                                 % (self.path, name, settings[name], value))
+
+        def load(name):
+            # a plain read-only view of the mapped file, which is faster to index than a memmap
+            return np.asarray(np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r'))
+
+        self._signatures = load('signatures')
+        self._count = self._indexed = settings['count']
+        self._keys = load('keys')
+        self._offsets = load('offsets')
+        self._postings = load('postings')
+        self._record_data = load('records')
+        self._record_offsets = load('record_offsets')
+
+    def _append(self, recs):
+        """Adds records, returning None or the exception raised for each (see
+        insert_many_records)."""
+        errors = []
+        signatures = []
+        for rec in recs:
+            try:
+                record = json.dumps([rec['path'], rec.get('metadata')]).encode('utf8')
+                signature = np.asarray(rec['signature'], dtype='int8')
+                if signature.shape != (self.gis.sig_length,):
+                    raise ValueError('signature should have length %d (got %r)'
+                                     % (self.gis.sig_length, signature.shape))
+            except Exception as e:
+                errors.append(e)
+                continue
+            self._new_records.append(record)
+            signatures.append(signature)
+            errors.append(None)
+
+        if signatures:
+            signatures = np.array(signatures)
+            self._reserve(len(signatures))
+            self._signatures[self._count:self._count + len(signatures)] = signatures
+            self._count += len(signatures)
+            # the words are recomputed rather than read from the records, which may hold probes
+            self._pending_words.append(simple_words(signatures, self.k, self.N))
+
+        return errors
+
+    def _reserve(self, n):
+        """Makes room for n more signatures, copying a mapped matrix into memory."""
+        needed = self._count + n
+        if needed <= self._signatures.shape[0] and self._signatures.flags.writeable:
+            return
+        capacity = max(needed, 2 * self._signatures.shape[0], 1024)
+        signatures = np.zeros((capacity, self.gis.sig_length), dtype='int8')
+        signatures[:self._count] = self._signatures[:self._count]
+        self._signatures = signatures
+
+    def _pending(self):
+        """The words of the images not in the posting lists yet, one row per image."""
+        if len(self._pending_words) > 1:
+            self._pending_words = [np.concatenate(self._pending_words)]
+        return self._pending_words[0]
+
+    def _merge_if_full(self):
+        """Merges the pending images into the posting lists once there are too many of them."""
+        if self._count - self._indexed > self.pending_limit:
+            self.refresh()
+
+    def _matching_runs(self, keys):
+        """Indices of the runs of the posting lists whose keys are in keys."""
+        runs = np.searchsorted(self._keys, keys)
+        runs = runs[runs < self._keys.size]
+        return runs[np.isin(self._keys[runs], keys)]
+
+    def _record(self, i):
+        """The [path, metadata] of image i."""
+        stored = self._record_offsets.size - 1
+        if i < stored:
+            data = bytes(self._record_data[self._record_offsets[i]:self._record_offsets[i + 1]])
+        else:
+            data = self._new_records[i - stored]
+        return json.loads(data.decode('utf8'))
+
+
+def _insert_sorted(array, indices, values):
+    """np.insert(array, indices, values) for sorted indices, without sorting them again."""
+    out = np.empty(array.size + values.size, dtype=array.dtype)
+    inserted = np.zeros(out.size, dtype=bool)
+    inserted[indices + np.arange(values.size)] = True
+    out[inserted] = values
+    out[~inserted] = array
+    return out
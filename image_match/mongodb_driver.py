@@ -51,7 +51,7 @@ class SignatureMongo(SignatureDatabaseBase):
 
         initial_q = managerQueue.Queue()
 
-        [initial_q.put({field_name: rec[field_name]}) for field_name in self.index_names[:word_limit]]
+        [initial_q.put({field_name: _word_query(rec[field_name])}) for field_name in self.index_names[:word_limit]]
 
         # enqueue a sentinel value so we know we have reached the end of the queue
         initial_q.put('STOP')
@@ -114,6 +114,65 @@ class SignatureMongo(SignatureDatabaseBase):
         return l
 
 
+    def search_many_records(self, recs, pre_filter=None, word_limit=None, maximum_matches=1000):
+        """Search for the matches of a batch of image records.
+
+        Sends one aggregation per record, in turn, without search_single_record's worker
+        processes. Each finds the documents sharing a word with the record, ranks them by the
+        number of words they share and keeps the maximum_matches best, so a batch fetches at
+        most len(recs) * maximum_matches documents however large the collection is.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            pre_filter (Optional[dict]): a MongoDB query the matches must also satisfy
+                (default None)
+            word_limit (Optional[int]): number of words to search on. If None, all N are used
+                (default None)
+            maximum_matches (Optional[int]): number of candidates compared with each record
+                (default 1000)
+
+        Returns:
+            a list holding, for each record, its matches as dicts with 'dist', 'path', 'id' and
+                'metadata' keys, or the error raised searching for it
+
+        """
+        if word_limit is None:
+            word_limit = self.N
+
+        names = self.index_names[:word_limit]
+        results = []
+        for rec in recs:
+            try:
+                results.append(self._search_words(rec, names, pre_filter, maximum_matches))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _search_words(self, rec, names, pre_filter, maximum_matches):
+        """The matches of one record among the documents sharing the most words with it (see
+        search_many_records)."""
+        # with probes, each word is a list of codes
+        words = [(name, np.atleast_1d(rec[name]).tolist()) for name in names]
+        query = {'$or': [{name: {'$in': codes}} for name, codes in words]}
+        if pre_filter is not None:
+            query = {'$and': [query, pre_filter]}
+        shared_words = {'$add': [{'$cond': [{'$in': ['$' + name, codes]}, 1, 0]} for name, codes in words]}
+        projection = dict((field, 1) for field in ['signature', 'path', 'metadata'] + names)
+
+        docs = list(self.collection.aggregate([{'$match': query},
+                                               {'$addFields': {'_shared_words': shared_words}},
+                                               {'$sort': {'_shared_words': -1}},
+                                               {'$limit': maximum_matches},
+                                               {'$project': projection}]))
+        # documents without all the words, indexed with other settings, can't be compared
+        docs = [doc for doc in docs if all(doc.get(name) is not None for name in names)]
+        if not docs:
+            return []
+
+        dists = normalized_distance(np.array([doc['signature'] for doc in docs]), np.array(rec['signature']))
+        return [{'dist': dist, 'path': doc['path'], 'id': doc['_id'], 'metadata': doc.get('metadata')}
+                for doc, dist in zip(docs, dists) if dist < self.distance_cutoff]
+
     def insert_single_record(self, rec):
         self.collection.insert(rec)
 
@@ -121,6 +180,36 @@ class SignatureMongo(SignatureDatabaseBase):
         if len(self.collection.index_information()) <= 1:
             self.index_collection()
 
+    def insert_many_records(self, recs, refresh_after=False):
+        """Insert a batch of image records with one unordered bulk insert.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            refresh_after (Optional[boolean]): ignored, inserted records can be found straight
+                away (default False)
+
+        Returns:
+            a list holding, for each record, None if it was inserted or else the error. If the
+                insert fails as a whole, every record gets its error
+
+        """
+        from pymongo.errors import BulkWriteError
+
+        errors = [None] * len(recs)
+        try:
+            self.collection.insert_many(recs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details['writeErrors']:
+                errors[write_error['index']] = RuntimeError(write_error['errmsg'])
+        except Exception as e:
+            return [e] * len(recs)
+
+        # if the collection has no indexes (except possibly '_id'), build them
+        if len(self.collection.index_information()) <= 1:
+            self.index_collection()
+
+        return errors
+
     def index_collection(self):
         """Index a collection on words.
 
@@ -132,6 +221,13 @@ class SignatureMongo(SignatureDatabaseBase):
             self.collection.create_index(name)
 
 
+def _word_query(word):
+    """The query for a simple word: its code, or any of its codes if it has probes."""
+    if isinstance(word, list):
+        return {'$in': word}
+    return word
+
+
 def get_next_match(result_q, word, collection, signature, cutoff=0.5, max_in_cursor=100):
     """Given a cursor, iterate through matches
 
@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from six import string_types, text_type
+import hashlib
+import numpy as np
+import os
+import sqlite3
+import time
+
+
+class SignatureCache(object):
+    """Content-addressed cache of image signatures
+
+    Signatures are keyed by a hash of the image's bytes, of how it was passed (bytes, array or
+    file) and of the settings of the ImageSignature that made them, so the same image arriving
+    again the same way, under any name, is not decoded or signed a second time. Recently used
+    signatures are kept in memory, and optionally in an SQLite file that survives restarts.
+
+    """
+
+    def __init__(self, max_items=10000, path=None, max_disk_bytes=2 ** 30):
+        """Set up the cache
+
+        Args:
+            max_items (Optional[int]): number of signatures kept in memory. The least recently
+                used are dropped first (default 10000)
+            path (Optional[string]): path of an SQLite file for the on-disk tier. If None, the
+                cache is in memory only (default None)
+            max_disk_bytes (Optional[int]): approximate limit on the size of the signatures
+                stored on disk. The least recently used are deleted first (default 2**30)
+
+        Examples:
+            >>> from image_match.goldberg import ImageSignature
+            >>> from image_match.signature_cache import SignatureCache
+            >>> gis = ImageSignature()
+            >>> cache = SignatureCache(path='signatures.sqlite')
+            >>> sig = cache.generate_signature(gis, 'mona_lisa.jpg')
+            >>> sig = cache.generate_signature(gis, 'copy_of_mona_lisa.jpg')  # the same file
+            >>> cache.hits, cache.disk_hits, cache.misses
+            (1, 0, 1)
+
+        """
+        if type(max_items) is not int:
+            raise TypeError('max_items should be an integer')
+        if max_items < 0:
+            raise ValueError('max_items should be >= 0 (got %r)' % max_items)
+
+        self.max_items = max_items
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute('CREATE TABLE IF NOT EXISTS signatures '
+                             '(key TEXT PRIMARY KEY, signature BLOB, last_used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS signatures_last_used ON signatures (last_used)')
+            self._db.commit()
+            self._count_disk_bytes()
+
+    def generate_signature(self, gis, path_or_image, bytestream=False):
+        """Returns an image signature, from the cache if possible
+
+        Takes the same arguments as ImageSignature.generate_signature. Images given by URL
+        can't be hashed without downloading them, so they are always signed.
+
+        Args:
+            gis (ImageSignature): signature generator
+            path_or_image (string or numpy.ndarray): image path, or image array
+            bytestream (Optional[boolean]): will the image be passed as raw bytes?
+                That is, is the 'path_or_image' argument an in-memory image?
+                (default False)
+
+        Returns:
+            The image signature, as returned by gis.generate_signature
+
+        """
+        key = self.key(gis, path_or_image, bytestream=bytestream)
+        if key is None:
+            return gis.generate_signature(path_or_image, bytestream=bytestream)
+
+        signature = self.get(key)
+        if signature is None:
+            signature = gis.generate_signature(path_or_image, bytestream=bytestream)
+            self.put(key, signature)
+
+        return signature
+
+    @staticmethod
+    def key(gis, path_or_image, bytestream=False):
+        """Computes the cache key of an image
+
+        Args:
+            gis (ImageSignature): signature generator
+            path_or_image (string or numpy.ndarray): as for ImageSignature.generate_signature
+            bytestream (Optional[boolean]): as for ImageSignature.generate_signature (default False)
+
+        Returns:
+            a hex digest of the image content, the kind of input and the signature settings, or
+                None if the image is not bytes, an array or a local file
+
+        """
+        # files and bytes are decoded differently (skimage composites alpha channels onto
+        # white, PIL drops them), so the same content can have two signatures
+        digest = hashlib.sha1()
+        if bytestream:
+            digest.update(b'bytes\0')
+            digest.update(path_or_image)
+        elif type(path_or_image) is np.ndarray:
+            digest.update(b'array\0')
+            digest.update(repr((path_or_image.shape, path_or_image.dtype.str)).encode('utf8'))
+            digest.update(np.ascontiguousarray(path_or_image).data)
+        elif (type(path_or_image) in string_types or type(path_or_image) is text_type) \
+                and os.path.isfile(path_or_image):
+            digest.update(b'file\0')
+            with open(path_or_image, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    digest.update(block)
+        else:
+            return None
+
+        # every ImageSignature setting is a plain attribute; the profiler and workspace don't
+        # affect signatures
+        settings = sorted((name, value) for name, value in vars(gis).items()
+                          if name not in ('profiler', 'workspace'))
+        digest.update(repr(settings).encode('utf8'))
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Looks a signature up
+
+        Args:
+            key (string): cache key, as computed by key
+
+        Returns:
+            the signature (numpy.ndarray), or None if it isn't cached
+
+        """
+        if key in self._memory:
+            self.hits += 1
+            signature = self._memory.pop(key)
+            self._memory[key] = signature
+            return signature.copy()
+
+        if self._db is not None:
+            row = self._db.execute('SELECT signature FROM signatures WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                self._db.execute('UPDATE signatures SET last_used = ? WHERE key = ?', (time.time(), key))
+                self._db.commit()
+                signature = np.frombuffer(row[0], dtype='int8')
+                self._remember(key, signature)
+                return signature.copy()
+
+        self.misses += 1
+        return None
+
+    def put(self, key, signature):
+        """Stores a signature
+
+        Args:
+            key (string): cache key, as computed by key
+            signature (numpy.ndarray): the signature
+
+        """
+        signature = np.array(signature, dtype='int8')
+        self._remember(key, signature)
+
+        if self._db is not None:
+            inserted = self._db.execute('INSERT OR IGNORE INTO signatures VALUES (?, ?, ?)',
+                                        (key, sqlite3.Binary(signature.tobytes()), time.time())).rowcount
+            if inserted:
+                self._disk_bytes += signature.nbytes
+                self._disk_count += 1
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_from_disk()
+            self._db.commit()
+
+    def _remember(self, key, signature):
+        """Adds a signature to the in-memory tier, dropping the least recently used if full."""
+        self._memory.pop(key, None)
+        self._memory[key] = signature
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _count_disk_bytes(self):
+        """Reads the size of the disk tier, which other processes may share."""
+        size, count = self._db.execute('SELECT SUM(LENGTH(signature)), COUNT(*) FROM signatures').fetchone()
+        self._disk_bytes = size or 0
+        self._disk_count = count
+
+    def _evict_from_disk(self):
+        """Deletes the least recently used signatures until the disk tier is small enough."""
+        self._count_disk_bytes()
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        mean_size = self._disk_bytes / float(self._disk_count)
+        excess = int((self._disk_bytes - self.max_disk_bytes) / mean_size) + 1
+        self._db.execute('DELETE FROM signatures WHERE key IN '
+                         '(SELECT key FROM signatures ORDER BY last_used LIMIT ?)', (excess,))
+        self._count_disk_bytes()
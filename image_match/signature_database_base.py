@@ -1,6 +1,6 @@
-from image_match.goldberg import ImageSignature
-from itertools import product
+from image_match.goldberg import ImageSignature, _SigningPool
 from operator import itemgetter
+from six import string_types, text_type
 import numpy as np
 
 
@@ -78,6 +78,31 @@ class SignatureDatabaseBase(object):
         """
         raise NotImplementedError
 
+    def search_many_records(self, recs, pre_filter=None):
+        """Search for the matches of a batch of image records.
+
+        Used by search_images. Derived classes should override it with their database's
+        multi-search, so that a batch takes one round trip rather than one per record. By
+        default, the records are searched one at a time with search_single_record.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            pre_filter (Optional[dict]): a filter to be applied to every search, as for
+                search_single_record (default None)
+
+        Returns:
+            a list holding, for each record, its matches as returned by search_single_record, or
+                else the exception raised searching for it
+
+        """
+        results = []
+        for rec in recs:
+            try:
+                results.append(list(self.search_single_record(rec, pre_filter=pre_filter)))
+            except Exception as e:
+                results.append(e)
+        return results
+
     def insert_single_record(self, rec):
         """Insert an image record.
 
@@ -116,8 +141,38 @@ class SignatureDatabaseBase(object):
         """
         raise NotImplementedError
 
+    def insert_many_records(self, recs, refresh_after=False):
+        """Insert a batch of image records.
+
+        Used by add_images. Derived classes should override it with their database's bulk write,
+        so that a batch takes one round trip rather than one per record. By default, the records
+        are inserted one at a time with insert_single_record.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            refresh_after (Optional[boolean]): make the records searchable straight away, where
+                the database supports it (default False)
+
+        Returns:
+            a list holding, for each record, None if it was inserted or else the exception raised
+                for it
+
+        """
+        errors = []
+        for i, rec in enumerate(recs):
+            try:
+                if refresh_after and i == len(recs) - 1:
+                    self.insert_single_record(rec, refresh_after=True)
+                else:
+                    self.insert_single_record(rec)
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
     def __init__(self, k=16, N=63, n_grid=9,
-                 crop_percentile=(5, 95), distance_cutoff=0.45,
+                 crop_percentile=(5, 95), distance_cutoff=0.45, signature_cache=None, n_probes=0,
                  *signature_args, **signature_kwargs):
         """Set up storage scheme for images
 
@@ -159,6 +214,12 @@ class SignatureDatabaseBase(object):
                 considering how much variance to keep in the image (default (5, 95))
             distance_cutoff (Optional [float]): maximum image signature distance to
                 be considered a match (default 0.45)
+            signature_cache (Optional[SignatureCache]): cache for the signatures of added and
+                searched images, so that images seen before aren't decoded again (default None)
+            n_probes (Optional[int]): number of neighbouring codes searched for along with each
+                simple word of a searched image (see probe_words). Probes find images whose words
+                differ in one uncertain trit, so a smaller N or a larger k keeps the same recall
+                (default 0)
             *signature_args: Variable length argument list to pass to ImageSignature
             **signature_kwargs: Arbitrary keyword arguments to pass to ImageSignature
 
@@ -185,6 +246,15 @@ class SignatureDatabaseBase(object):
 
         self.crop_percentile = crop_percentile
 
+        self.signature_cache = signature_cache
+
+        if type(n_probes) is not int:
+            raise TypeError('n_probes should be an integer')
+        if n_probes < 0:
+            raise ValueError('n_probes should be >= 0 (got %r)' % n_probes)
+
+        self.n_probes = n_probes
+
         self.gis = ImageSignature(n=n_grid, crop_percentiles=crop_percentile, *signature_args, **signature_kwargs)
 
     def add_image(self, path, img=None, bytestream=False, metadata=None, refresh_after=False):
@@ -205,22 +275,146 @@ class SignatureDatabaseBase(object):
             metadata (Optional): any other information you want to include, can be nested (default None)
 
         """
-        rec = make_record(path, self.gis, self.k, self.N, img=img, bytestream=bytestream, metadata=metadata)
+        rec = make_record(path, self.gis, self.k, self.N, img=img, bytestream=bytestream, metadata=metadata,
+                          signature_cache=self.signature_cache)
         self.insert_single_record(rec, refresh_after=refresh_after)
 
-    def search_image(self, path, all_orientations=False, bytestream=False, pre_filter=None):
+    def add_images(self, images, bytestream=False, batch_size=1000, workers=None, refresh_after=False):
+        """Add many images to the database
+
+        The images are taken batch_size at a time. Each batch is signed in parallel, and its
+        records are stored with a single call to insert_many_records, which drivers implement
+        with their database's bulk write. One pool of worker processes signs every batch, and
+        signs the next batch while the last is being inserted.
+
+        Args:
+            images (iterable): the images. Each is either a path, as for add_image, or a dict of
+                add_image arguments: 'path', and optionally 'img' and 'metadata'
+            bytestream (Optional[boolean]): are the 'img' values raw bytes? (default False)
+            batch_size (Optional[int]): number of images signed and inserted at a time
+                (default 1000)
+            workers (Optional[int]): number of worker processes signing images. If None, one per
+                CPU is used. If 1, the images are signed in this process (default None)
+            refresh_after (Optional[boolean]): make each batch searchable as soon as it is
+                inserted, where the database supports it (default False)
+
+        Returns:
+            a list holding, for each image, None if it was added or else the exception raised for
+                it while signing it or inserting its record. One bad image does not stop the others
+
+        Examples:
+            >>> ses = SignatureES(es)
+            >>> errors = ses.add_images(['a.jpg', {'path': 'b.jpg', 'metadata': {'tag': 'b'}}])
+            >>> errors
+            [None, None]
+
+        """
+        if type(batch_size) is not int:
+            raise TypeError('batch_size should be an integer')
+        if batch_size < 1:
+            raise ValueError('batch_size should be > 0 (got %r)' % batch_size)
+
+        items = ((image['path'], image.get('img'), image.get('metadata')) if isinstance(image, dict)
+                 else (image, None, None) for image in images)
+
+        errors = []
+        with _SigningPool(self.gis, workers=workers) as pool:
+            signing = None
+            for batch in _batches(items, batch_size):
+                # as in make_record, the image is signed from img if there is one, else from path
+                tasks = [(path, False) if img is None else (img, bytestream) for path, img, _ in batch]
+                # start on this batch before inserting the last one
+                started = (batch, self._start_signing(pool, tasks))
+                if signing is not None:
+                    errors.extend(self._add_batch(signing, refresh_after))
+                signing = started
+            if signing is not None:
+                errors.extend(self._add_batch(signing, refresh_after))
+
+        return errors
+
+    def _add_batch(self, signing, refresh_after):
+        """Inserts a batch of (path, img, metadata) tuples once signed, returning their errors
+        (see add_images). signing is the batch and the function returning its signatures."""
+        batch, signatures = signing
+        errors = [None] * len(batch)
+        records = []
+        inserted = []
+        for i, (signature, error) in enumerate(signatures()):
+            if error is not None:
+                errors[i] = error
+                continue
+            path, _, metadata = batch[i]
+            records.append(_record_from_signature(path, signature, self.k, self.N, metadata=metadata))
+            inserted.append(i)
+
+        if records:
+            for i, error in zip(inserted, self.insert_many_records(records, refresh_after=refresh_after)):
+                errors[i] = error
+
+        return errors
+
+    def _start_signing(self, pool, tasks):
+        """Starts signing (path_or_image, bytestream) tasks on a _SigningPool, through the
+        signature cache if there is one.
+
+        Returns:
+            a function that waits for the signatures and returns them as (signature, error)
+                tuples, in task order
+
+        """
+        if self.signature_cache is None:
+            return pool.sign_async(tasks).get
+
+        # image files are read and hashed by the workers; bytes and arrays are already here
+        is_file = [not bytestream and isinstance(path_or_image, (string_types, text_type))
+                   for path_or_image, bytestream in tasks]
+        keys = [None if file else self.signature_cache.key(self.gis, path_or_image, bytestream=bytestream)
+                for (path_or_image, bytestream), file in zip(tasks, is_file)]
+        files = [i for i, file in enumerate(is_file) if file]
+        for i, key in zip(files, pool.cache_keys([tasks[i][0] for i in files])):
+            keys[i] = key
+
+        # look the images up here, and only send the misses to the workers
+        results = [None] * len(tasks)
+        misses = []
+        for i, key in enumerate(keys):
+            signature = None if key is None else self.signature_cache.get(key)
+            if signature is None:
+                misses.append(i)
+            else:
+                results[i] = (signature, None)
+        signing = pool.sign_async([tasks[i] for i in misses]) if misses else None
+
+        def signatures():
+            for i, (signature, error) in zip(misses, signing.get() if signing is not None else []):
+                results[i] = (signature, error)
+                if error is None and keys[i] is not None:
+                    self.signature_cache.put(keys[i], signature)
+            return results
+
+        return signatures
+
+    def search_image(self, path, all_orientations=False, bytestream=False, pre_filter=None,
+                     fast_orientations=False):
         """Search for matches
 
         Args:
             path (string): path or image data. If bytestream=False, then path is assumed to be
                 a URL or filesystem path. Otherwise, it's assumed to be raw image data
-            all_orientations (Optional[boolean]): if True, search for all combinations of mirror
-                images, rotations, and color inversions (default False)
+            all_orientations (Optional[boolean]): if True, also search for the image's three
+                rotations, its mirror image and its color inversion (default False)
             bytestream (Optional[boolean]): will the image be passed as raw bytes?
                 That is, is the 'path_or_image' argument an in-memory image?
                 (default False)
             pre_filter (Optional[dict]): filters list before applying the matching algorithm
                 (default None)
+            fast_orientations (Optional[boolean]): with all_orientations, sign the image once and
+                derive the other orientations from its signature (see
+                ImageSignature.orientation_signatures) instead of signing 6 transformed images.
+                Much faster, and covers all 16 combinations of rotation, mirroring and
+                inversion, but the derived signatures can differ slightly from those of the
+                transformed images, whatever the image's shape (default False)
         Returns:
             a formatted list of dicts representing unique matches, sorted by dist
 
@@ -239,54 +433,162 @@ class SignatureDatabaseBase(object):
             ]
 
         """
-        img = self.gis.preprocess_image(path, bytestream)
-
-        if all_orientations:
-            # initialize an iterator of composed transformations
-            inversions = [lambda x: x, lambda x: -x]
-
-            mirrors = [lambda x: x, np.fliplr]
-
-            # an ugly solution for function composition
-            rotations = [lambda x: x,
-                         np.rot90,
-                         lambda x: np.rot90(x, 2),
-                         lambda x: np.rot90(x, 3)]
-
-            # cartesian product of all possible orientations
-            orientations = product(inversions, rotations, mirrors)
+        if not all_orientations or fast_orientations:
+            signature = _generate_signature(self.gis, path, bytestream, self.signature_cache)
+            if all_orientations:
+                # derive the other orientations from the signature
+                signatures = self.gis.orientation_signatures(signature)
+            else:
+                signatures = [signature]
 
         else:
-            # otherwise just use the identity transformation
-            orientations = [lambda x: x]
-
-        # try for every possible combination of transformations; if all_orientations=False,
+            img = self.gis.preprocess_image(path, bytestream, handle_mpo=self.gis.handle_mpo,
+                                            decode_size=self.gis.decode_size, dtype=self.gis.dtype)
+
+            # each inversion, rotation and mirroring on its own, rather than all 16 of their
+            # combinations, which would take twice as many signatures
+            transforms = [lambda x: x, _inverted, np.rot90, lambda x: np.rot90(x, 2),
+                          lambda x: np.rot90(x, 3), np.fliplr]
+
+            signatures = []
+            seen = set()
+            for transform in transforms:
+                transformed_img = transform(img)
+
+                # generate the signature, skipping orientations that give one we already have
+                signature = self.gis.generate_signature(transformed_img)
+                if signature.tobytes() not in seen:
+                    seen.add(signature.tobytes())
+                    signatures.append(signature)
+
+        # try for every distinct signature; if all_orientations=False,
         # this will only take one iteration
         result = []
-
-        orientations = set(np.ravel(list(orientations)))
-        for transform in orientations:
-            # compose all functions and apply on signature
-            transformed_img = transform(img)
-
-            # generate the signature
-            transformed_record = make_record(transformed_img, self.gis, self.k, self.N)
+        for signature in signatures:
+            transformed_record = _record_from_signature(path, signature, self.k, self.N, n_probes=self.n_probes)
 
             l = self.search_single_record(transformed_record, pre_filter=pre_filter)
             result.extend(l)
 
-        ids = set()
-        unique = []
-        for item in result:
-            if item['id'] not in ids:
-                unique.append(item)
-                ids.add(item['id'])
+        return _unique_matches(result)
+
+    def search_images(self, images, all_orientations=False, bytestream=False, pre_filter=None,
+                      batch_size=1000, workers=None):
+        """Search for the matches of many images
+
+        The images are taken batch_size at a time. Each batch is signed in parallel, and its
+        records are searched with a single call to search_many_records, which drivers implement
+        with their database's multi-search. One pool of worker processes signs every batch, and
+        signs the next batch while the last is being searched for.
+
+        Args:
+            images (iterable): paths or image data, as for search_image
+            all_orientations (Optional[boolean]): if True, also search for the mirror images,
+                rotations and color inversions of each image. They are derived from its signature,
+                as with search_image's fast_orientations (default False)
+            bytestream (Optional[boolean]): are the images passed as raw bytes? (default False)
+            pre_filter (Optional[dict]): filters list before applying the matching algorithm
+                (default None)
+            batch_size (Optional[int]): number of images signed and searched at a time
+                (default 1000)
+            workers (Optional[int]): number of worker processes signing images. If None, one per
+                CPU is used. If 1, the images are signed in this process (default None)
 
-        r = sorted(unique, key=itemgetter('dist'))
-        return r
+        Returns:
+            a tuple (results, errors), in input order. results holds, for each image, its unique
+                matches sorted by dist, as returned by search_image. errors holds, for each image,
+                None or else the exception raised signing or searching for it, in which case its
+                results are empty. One bad image does not stop the others
 
+        Examples:
+            >>> results, errors = ses.search_images(['a.jpg', 'b.jpg'], workers=4)
+            >>> results[0]
+            [{'dist': 0.0, 'id': u'AVM37oZq0osmmAxpPvx7', 'path': u'a.jpg', 'score': 7.937254}]
 
-def make_record(path, gis, k, N, img=None, bytestream=False, metadata=None):
+        """
+        if type(batch_size) is not int:
+            raise TypeError('batch_size should be an integer')
+        if batch_size < 1:
+            raise ValueError('batch_size should be > 0 (got %r)' % batch_size)
+
+        results = []
+        errors = []
+        with _SigningPool(self.gis, workers=workers) as pool:
+            signing = None
+            for batch in _batches(images, batch_size):
+                # start on this batch before searching for the last one
+                started = (batch, self._start_signing(pool, [(image, bytestream) for image in batch]))
+                if signing is not None:
+                    self._search_batch(signing, all_orientations, pre_filter, results, errors)
+                signing = started
+            if signing is not None:
+                self._search_batch(signing, all_orientations, pre_filter, results, errors)
+
+        return results, errors
+
+    def _search_batch(self, signing, all_orientations, pre_filter, results, errors):
+        """Searches for a batch of images once signed, appending to results and errors (see
+        search_images). signing is the batch and the function returning its signatures."""
+        batch, signatures = signing
+        records = []
+        owners = []
+        batch_results = [[] for _ in batch]
+        batch_errors = [None] * len(batch)
+        for i, (signature, error) in enumerate(signatures()):
+            if error is not None:
+                batch_errors[i] = error
+                continue
+            signatures = self.gis.orientation_signatures(signature) if all_orientations else [signature]
+            for signature in signatures:
+                records.append(_record_from_signature(batch[i], signature, self.k, self.N,
+                                                      n_probes=self.n_probes))
+                owners.append(i)
+
+        if records:
+            for i, matches in zip(owners, self.search_many_records(records, pre_filter=pre_filter)):
+                if isinstance(matches, Exception):
+                    batch_errors[i] = matches
+                else:
+                    batch_results[i].extend(matches)
+
+        for matches, error in zip(batch_results, batch_errors):
+            results.append([] if error is not None else _unique_matches(matches))
+            errors.append(error)
+
+
+def _batches(iterable, batch_size):
+    """Yields lists of batch_size items of iterable, and then of the ones left over."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _inverted(img):
+    """Colour inversion of a greyscale image: negated floats, or 255 - levels for uint8 images,
+    which have no negative levels."""
+    if img.dtype.kind == 'u':
+        return np.iinfo(img.dtype).max - img
+    return -img
+
+
+def _unique_matches(matches):
+    """Drops repeated ids from a list of matches, and sorts it by dist."""
+    ids = set()
+    unique = []
+    for item in matches:
+        if item['id'] not in ids:
+            unique.append(item)
+            ids.add(item['id'])
+
+    return sorted(unique, key=itemgetter('dist'))
+
+
+def make_record(path, gis, k, N, img=None, bytestream=False, metadata=None, signature_cache=None, n_probes=0):
     """Makes a record suitable for database insertion.
 
     Note:
@@ -311,6 +613,11 @@ def make_record(path, gis, k, N, img=None, bytestream=False, metadata=None):
             is as described in the explanation for the img argument
             (default False)
         metadata (Optional): any other information you want to include, can be nested (default None)
+        signature_cache (Optional[SignatureCache]): cache to look the signature up in, and
+            store it in (default None)
+        n_probes (Optional[int]): if not 0, each simple word is a list of codes: the word's own
+            code followed by up to n_probes neighbouring codes, as returned by probe_words.
+            Used for searching; records stored this way have every code indexed (default 0)
 
     Returns:
         An image record.
@@ -340,22 +647,47 @@ def make_record(path, gis, k, N, img=None, bytestream=False, metadata=None):
          }
 
     """
-    record = dict()
-    record['path'] = path
     if img is not None:
-        signature = gis.generate_signature(img, bytestream=bytestream)
+        signature = _generate_signature(gis, img, bytestream, signature_cache)
     else:
-        signature = gis.generate_signature(path)
+        signature = _generate_signature(gis, path, False, signature_cache)
+
+    return _record_from_signature(path, signature, k, N, metadata=metadata, n_probes=n_probes)
+
+
+def _generate_signature(gis, path_or_image, bytestream, signature_cache):
+    """Generates a signature with gis, through signature_cache if it isn't None."""
+    if signature_cache is None:
+        return gis.generate_signature(path_or_image, bytestream=bytestream)
+    return signature_cache.generate_signature(gis, path_or_image, bytestream=bytestream)
+
+
+def _record_from_signature(path, signature, k, N, metadata=None, n_probes=0):
+    """Makes a record from an image's signature (see make_record).
+
+    Args:
+        path (string): path or identifier for the image
+        signature (numpy.ndarray): the image's signature
+        k (int): width of words for encoding
+        N (int): number of words for encoding
+        metadata (Optional): any other information you want to include, can be nested (default None)
+        n_probes (Optional[int]): number of neighbouring codes to add to each word (default 0)
+
+    Returns:
+        An image record, as for make_record
 
+    """
+    record = dict()
+    record['path'] = path
     record['signature'] = signature.tolist()
 
     if metadata:
         record['metadata'] = metadata
 
-    words = get_words(signature, k, N)
-    max_contrast(words)
-
-    words = words_to_int(words)
+    if n_probes:
+        words = probe_words(np.asarray(signature), k, N, n_probes)
+    else:
+        words = simple_words(np.asarray(signature)[np.newaxis], k, N)[0]
 
     for i in range(N):
         record[''.join(['simple_word_', str(i)])] = words[i].tolist()
@@ -386,27 +718,131 @@ def get_words(array, k, N):
         an array with N rows of length k
 
     """
-    # generate starting positions of each word
-    word_positions = np.linspace(0, array.shape[0],
-                                 N, endpoint=False).astype('int')
+    return get_words_matrix(array[np.newaxis], k, N)[0]
 
-    # check that inputs make sense
-    if k > array.shape[0]:
-        raise ValueError('Word length cannot be longer than array length')
-    if word_positions.shape[0] > array.shape[0]:
-        raise ValueError('Number of words cannot be more than array length')
 
-    # create empty words array
-    words = np.zeros((N, k)).astype('int8')
+def get_words_matrix(signatures, k, N):
+    """Gets N words of length k from each of many signatures.
 
-    for i, pos in enumerate(word_positions):
-        if pos + k <= array.shape[0]:
-            words[i] = array[pos:pos+k]
-        else:
-            temp = array[pos:].copy()
-            temp.resize(k)
-            words[i] = temp
+    The same words as get_words gives for each row, taken all at once: the rows are padded
+    with zeros so that every word fits, and the words are gathered from a strided view.
+
+    Args:
+        signatures (numpy.ndarray): M x m array of signatures
+        k (int): word length
+        N (int): number of words
+
+    Returns:
+        an M x N x k array of words (int8)
+
+    """
+    signatures = np.asarray(signatures)
+    positions = _word_positions(signatures.shape[1], k, N)
+    return _padded_windows(signatures, positions, k).astype('int8')
+
+
+def simple_words(signatures, k, N, chunk_size=4096):
+    """Gets the integer simple words of many signatures.
+
+    The same words as get_words, max_contrast and words_to_int give one signature at a time,
+    for a whole matrix: the words of chunk_size rows are cut from a strided view, squeezed
+    to -1..1 and encoded with one matrix product.
+
+    Args:
+        signatures (numpy.ndarray): M x m array of signatures
+        k (int): word length
+        N (int): number of words
+        chunk_size (Optional[int]): number of signatures handled at a time (default 4096)
+
+    Returns:
+        an M x N array of integer words (int64)
+
+    Examples:
+        >>> simple_words(signatures, 16, 63).shape
+        (1000, 63)
 
+    """
+    signatures = np.asarray(signatures)
+    return _encode_words(signatures, _word_positions(signatures.shape[1], k, N), k, chunk_size=chunk_size)
+
+
+def probe_words(signature, k, N, n_probes):
+    """Gets the integer simple words of a signature, each with neighbouring codes to probe for.
+
+    A simple word only keeps the sign of each signature value, so a near-duplicate image misses
+    a word whenever one of its differences crosses identical_tolerance. The signature doesn't
+    keep the differences, so trits are ranked by their signature value alone, not by how close
+    each difference came to the tolerance: trits of +-1 values are taken as the least certain,
+    then those of 0 values, and those of +-2 values are never changed. The probes for a word
+    are its code with one trit changed, the +-1 trits first, to 0, in word order, then the 0
+    trits, each to +1 and then to -1. Positions past the end of the signature are padding and
+    never changed.
+
+    Args:
+        signature (numpy.ndarray): a signature
+        k (int): word length
+        N (int): number of words
+        n_probes (int): maximum number of probes per word
+
+    Returns:
+        an N x (1 + n_probes) array of integer words (int64). The first column holds the words
+            themselves, as from simple_words. Words with fewer candidate trits than n_probes
+            repeat their own code in the remaining columns
+
+    Examples:
+        >>> probe_words(signature, 16, 63, 4).shape
+        (63, 5)
+
+    """
+    signature = np.asarray(signature)
+    positions = _word_positions(signature.shape[0], k, N)
+    words = get_words(signature, k, N).astype(np.int64)
+    trits = np.sign(words)
+    coding_vector = 3 ** np.arange(k, dtype=np.int64)
+    codes = np.dot(trits + 1, coding_vector)
+
+    probes = np.repeat(codes[:, np.newaxis], 1 + n_probes, axis=1)
+    in_signature = positions[:, np.newaxis] + np.arange(k) < signature.shape[0]
+    for i in range(N):
+        light = np.flatnonzero((np.abs(words[i]) == 1) & in_signature[i])
+        zero = np.flatnonzero((words[i] == 0) & in_signature[i])
+        # code change of each candidate, most likely first
+        changes = np.concatenate([-trits[i, light] * coding_vector[light],
+                                  np.ravel(np.column_stack([coding_vector[zero], -coding_vector[zero]]))])
+        changes = changes[:n_probes]
+        probes[i, 1:1 + changes.size] += changes
+
+    return probes
+
+
+def _word_positions(length, k, N):
+    """Where each of the N words of length k starts in a signature of the given length."""
+    if k > length:
+        raise ValueError('Word length cannot be longer than array length')
+    if N > length:
+        raise ValueError('Number of words cannot be more than array length')
+    return np.linspace(0, length, N, endpoint=False).astype('int')
+
+
+def _padded_windows(signatures, positions, k):
+    """The words of length k starting at positions in each row, zero-padded past the end."""
+    overhang = max(positions[-1] + k - signatures.shape[1], 0) if len(positions) else 0
+    if overhang:
+        signatures = np.pad(signatures, ((0, 0), (0, overhang)), mode='constant')
+    windows = np.lib.stride_tricks.as_strided(
+        signatures, shape=(signatures.shape[0], signatures.shape[1] - k + 1, k),
+        strides=(signatures.strides[0], signatures.strides[1], signatures.strides[1]), writeable=False)
+    return windows[:, positions]
+
+
+def _encode_words(signatures, positions, k, chunk_size=4096):
+    """The integer simple words of length k starting at positions, for each signature (see
+    simple_words)."""
+    coding_vector = 3 ** np.arange(k, dtype=np.int64)
+    words = np.empty((signatures.shape[0], len(positions)), dtype=np.int64)
+    for start in range(0, signatures.shape[0], chunk_size):
+        chunk = _padded_windows(signatures[start:start + chunk_size], positions, k)
+        words[start:start + chunk_size] = np.dot(np.sign(chunk).astype(np.int64) + 1, coding_vector)
     return words
 
 
@@ -424,13 +860,13 @@ def words_to_int(word_array):
     [ 0,   1,  0] -> 16
 
     Args:
-        word_array (numpy.ndarray): N x k array
+        word_array (numpy.ndarray): N x k array, or M x N x k for the words of M signatures
 
     Returns:
-        an array of integers of length N (the integer word encodings)
+        an array of integers of length N (the integer word encodings), or M x N
 
     """
-    width = word_array.shape[1]
+    width = word_array.shape[-1]
 
     # Three states (-1, 0, 1)
     coding_vector = 3**np.arange(width)
@@ -443,7 +879,8 @@ def words_to_int(word_array):
 def max_contrast(array):
     """Sets all positive values to one and all negative values to -1.
 
-    Needed for first pass lookup on word table.
+    Needed for first pass lookup on word table. Works in place on arrays of any shape, such as
+    the words of many signatures from get_words_matrix.
 
     Args:
         array (numpy.ndarray): target array
@@ -477,3 +914,214 @@ def normalized_distance(_target_array, _vec, nan_value=1.0):
     finvec[np.isnan(finvec)] = nan_value
 
     return finvec
+
+
+def signature_norms(signatures):
+    """Computes the norm of each signature, for normalized_distance_matrix.
+
+    Norms can be computed once, when signatures are stored, and reused for every query.
+
+    Args:
+        signatures (numpy.ndarray): N x m array of signatures
+
+    Returns:
+        an array of N norms (floats)
+
+    """
+    return np.sqrt(np.einsum('ij,ij->i', signatures, signatures, dtype='int64'))
+
+
+def normalized_distance_matrix(queries, candidates, candidate_norms=None, query_norms=None,
+                               chunk_size=4096, nan_value=1.0):
+    """Compute normalized distances between every query and every candidate.
+
+    The M x N matrix of normalized_distance(candidates, query) for each query. Uses
+    || a - b ||^2 = ||a||^2 + ||b||^2 - 2 a.b, so the work is one matrix product, done in float32
+    on chunk_size candidates at a time. Signature values are small integers, so the products are
+    exact and the distances are the same as normalized_distance's.
+
+    Args:
+        queries (numpy.ndarray): M x m array of signatures
+        candidates (numpy.ndarray): N x m array of signatures
+        candidate_norms (Optional[numpy.ndarray]): norms of the candidates, as computed by
+            signature_norms. If None, they are computed here (default None)
+        query_norms (Optional[numpy.ndarray]): as candidate_norms, for the queries (default None)
+        chunk_size (Optional[int]): number of candidates to convert to float32 at a time (default 4096)
+        nan_value (Optional[float]): value to replace 0.0/0.0 = nan with
+            (default 1.0, to take those featureless images out of contention)
+
+    Returns:
+        an M x N array of normalized distances (floats)
+
+    Examples:
+        >>> normalized_distance_matrix(np.array([a, b]), np.array([a, b, c]))
+        array([[ 0.        ,  0.22095170,  0.68446275],
+               [ 0.22095170,  0.        ,  0.69531287]])
+
+    """
+    if queries.ndim != 2 or candidates.ndim != 2 or queries.shape[1] != candidates.shape[1]:
+        raise ValueError('queries and candidates should be 2-D arrays of signatures of the same length')
+    if chunk_size < 1:
+        raise ValueError('chunk_size should be at least 1 (%r given)' % chunk_size)
+
+    if query_norms is None:
+        query_norms = signature_norms(queries)
+    if candidate_norms is None:
+        candidate_norms = signature_norms(candidates)
+    query_norms = np.asarray(query_norms, dtype='float64')
+    candidate_norms = np.asarray(candidate_norms, dtype='float64')
+    # the squared norms are integers; round away the error of squaring a square root
+    query_squares = np.rint(query_norms ** 2)
+    candidate_squares = np.rint(candidate_norms ** 2)
+
+    # a.b is exact in float32 as long as it stays below 2**24
+    largest_value = max(np.max(np.abs(queries), initial=0), np.max(np.abs(candidates), initial=0))
+    dtype = 'float32' if int(largest_value) ** 2 * queries.shape[1] < 2 ** 24 else 'float64'
+    query_block = queries.astype(dtype)
+
+    distances = np.empty((queries.shape[0], candidates.shape[0]))
+    for start in range(0, candidates.shape[0], chunk_size):
+        stop = min(start + chunk_size, candidates.shape[0])
+        block = distances[:, start:stop]
+        block[...] = np.dot(query_block, candidates[start:stop].astype(dtype).T)
+        block *= -2
+        block += query_squares[:, np.newaxis]
+        block += candidate_squares[start:stop]
+        np.sqrt(block, out=block)
+        with np.errstate(invalid='ignore'):
+            block /= query_norms[:, np.newaxis] + candidate_norms[start:stop]
+    distances[np.isnan(distances)] = nan_value
+
+    return distances
+
+
+def pack_signatures(signatures, n_levels=2):
+    """Packs signatures into bytes, several values to a byte.
+
+    A signature value has only 2 * n_levels + 1 states, so it is written as a digit in that
+    base, and as many digits as fit are put in each byte, first digit least significant (as in
+    words_to_int). With the default n_levels=2 that is 3 values per byte, so a 648 value
+    signature takes 216 bytes. The end of a signature is padded with zeros, which don't change
+    its distance to anything.
+
+    Args:
+        signatures (numpy.ndarray): a signature, or an array of signatures, one per row
+        n_levels (Optional[int]): n_levels the signatures were generated with (default 2)
+
+    Returns:
+        a uint8 array of the same rank: one packed signature per row
+
+    Examples:
+        >>> sig = gis.generate_signature('https://pixabay.com/static/uploads/photo/2012/11/28/08/56/mona-lisa-67506_960_720.jpg')
+        >>> packed = pack_signatures(sig)
+        >>> packed.shape
+        (216,)
+        >>> np.array_equal(unpack_signatures(packed, sig.shape[0]), sig)
+        True
+
+    """
+    states, per_byte = _packing(n_levels)
+    signatures = np.asarray(signatures)
+    length = signatures.shape[-1]
+    padded_length = -(-length // per_byte) * per_byte
+
+    digits = np.full(signatures.shape[:-1] + (padded_length,), n_levels, dtype='uint8')
+    np.add(signatures, n_levels, out=digits[..., :length], casting='unsafe')
+    digits = digits.reshape(signatures.shape[:-1] + (padded_length // per_byte, per_byte))
+
+    return np.dot(digits, states ** np.arange(per_byte)).astype('uint8')
+
+
+def unpack_signatures(packed, length, n_levels=2):
+    """Unpacks signatures packed with pack_signatures.
+
+    Args:
+        packed (numpy.ndarray): a packed signature, or an array of them, one per row. Bytes
+            straight from storage are fine too
+        length (int): length of the original signatures
+        n_levels (Optional[int]): n_levels the signatures were generated with (default 2)
+
+    Returns:
+        an int8 array of signatures, of the same rank as packed
+
+    """
+    packed = np.frombuffer(packed, dtype='uint8') if isinstance(packed, (bytes, bytearray)) \
+        else np.asarray(packed, dtype='uint8')
+    values = _packing_tables(n_levels)[0][packed]
+
+    return values.reshape(packed.shape[:-1] + (-1,))[..., :length]
+
+
+def packed_normalized_distance(_target_array, _vec, n_levels=2, nan_value=1.0):
+    """Compute normalized distance to many points, for packed signatures.
+
+    Same as normalized_distance, but looks the squared differences and norms up byte by byte
+    in tables instead of unpacking the signatures.
+
+    Args:
+        _target_array (numpy.ndarray): N x m array of packed signatures
+        _vec (numpy.ndarray): packed signature of size m
+        n_levels (Optional[int]): n_levels the signatures were generated with (default 2)
+        nan_value (Optional[float]): value to replace 0.0/0.0 = nan with
+            (default 1.0, to take those featureless images out of contention)
+
+    Returns:
+        the normalized distance (float)
+
+    """
+    values, squares, squared_differences = _packing_tables(n_levels)
+    target_array = np.asarray(_target_array, dtype='uint8')
+    vec = np.asarray(_vec, dtype='uint8')
+
+    topvec = np.sqrt(np.sum(squared_differences[vec, target_array], axis=1, dtype='int64'))
+    norm1 = np.sqrt(np.sum(squares[vec], dtype='int64'))
+    norm2 = np.sqrt(np.sum(squares[target_array], axis=1, dtype='int64'))
+    with np.errstate(invalid='ignore'):
+        finvec = topvec / (norm1 + norm2)
+    finvec[np.isnan(finvec)] = nan_value
+
+    return finvec
+
+
+# lookup tables for packed signatures, by n_levels
+_PACKING_TABLES = {}
+
+
+def _packing(n_levels):
+    """Number of states of a signature value and the number of values packed in a byte."""
+    if type(n_levels) is not int or not 0 < n_levels < 128:
+        raise ValueError('n_levels should be an integer between 1 and 127 (%r given)' % n_levels)
+    states = 2 * n_levels + 1
+    per_byte = 1
+    while states ** (per_byte + 1) <= 256:
+        per_byte += 1
+
+    return states, per_byte
+
+
+def _packing_tables(n_levels):
+    """Lookup tables for packed signatures.
+
+    Args:
+        n_levels (int): n_levels of the signatures
+
+    Returns:
+        a tuple of three tables, indexed by packed bytes: the signature values in each byte
+            (256 x values per byte), the sum of their squares (256), and the sum of the squares of
+            their differences with those in another byte (256 x 256)
+
+    """
+    if n_levels not in _PACKING_TABLES:
+        states, per_byte = _packing(n_levels)
+        byte = np.arange(256)
+        digits = byte[:, np.newaxis] // states ** np.arange(per_byte) % states
+        # bytes pack_signatures never makes decode to zeros
+        digits[byte >= states ** per_byte] = n_levels
+        values = (digits - n_levels).astype('int8')
+
+        squares = np.sum(values.astype(int) ** 2, axis=1).astype('uint16')
+        squared_differences = np.sum((values[:, np.newaxis, :].astype(int) - values[np.newaxis, :, :]) ** 2,
+                                     axis=2).astype('uint16')
+        _PACKING_TABLES[n_levels] = values, squares, squared_differences
+
+    return _PACKING_TABLES[n_levels]
@@ -0,0 +1,195 @@
+from .signature_database_base import SignatureDatabaseBase
+from .signature_database_base import pack_signatures, packed_normalized_distance, simple_words
+from six import string_types, text_type
+import json
+import numpy as np
+import sqlite3
+
+
+class SignatureSQLite(SignatureDatabaseBase):
+    """SQLite driver for image-match
+
+    An embedded database in a single file, with nothing to run or administer. Each image is a
+    row of the images table, with its signature packed into a BLOB (see pack_signatures) and
+    its metadata as JSON. Its simple words are rows of the words table, keyed by
+    (position, code, image_id), so that the images sharing a word are found from the key.
+
+    """
+
+    def __init__(self, path=':memory:', size=100, cache_mb=64, *args, **kwargs):
+        """Extra setup for SQLite
+
+        Args:
+            path (Optional[string]): path of the database file, created if it doesn't exist
+                (default ':memory:', a database that lives as long as this object)
+            size (Optional[int]): maximum number of candidates, those sharing the most words,
+                compared with each searched signature (default 100)
+            cache_mb (Optional[int]): size of SQLite's page cache, in megabytes (default 64)
+            *args (Optional): Variable length argument list to pass to base constructor
+            **kwargs (Optional): Arbitrary keyword arguments to pass to base constructor
+
+        Examples:
+            >>> from image_match.sqlite_driver import SignatureSQLite
+            >>> ses = SignatureSQLite('signatures.sqlite')
+            >>> ses.add_images(['mona_lisa.jpg', 'caravaggio.jpg'])
+            [None, None]
+            >>> ses.search_image('mona_lisa_copy.jpg')
+            [{'dist': 0.0153, 'id': 1, 'metadata': None, 'path': 'mona_lisa.jpg', 'score': 61}]
+
+        """
+        if type(size) is not int:
+            raise TypeError('size should be an integer')
+
+        super(SignatureSQLite, self).__init__(*args, **kwargs)
+
+        self.path = path
+        self.size = size
+
+        self._db = sqlite3.connect(path)
+        # readers don't block the writer, and a commit doesn't wait for the disk twice
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA cache_size=%d' % (-1024 * int(cache_mb)))
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS images '
+                             '(id INTEGER PRIMARY KEY, path TEXT, signature BLOB, metadata TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS words '
+                             '(position INTEGER, code INTEGER, image_id INTEGER, '
+                             'PRIMARY KEY (position, code, image_id)) WITHOUT ROWID')
+            self._check_settings()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def search_single_record(self, rec, pre_filter=None):
+        """Search for the images sharing the most words with a record.
+
+        Args:
+            rec (dict): an image record, in the format returned by make_record. A word may be a
+                list of codes, with probes
+            pre_filter (Optional[string or tuple]): an SQL condition on the images table the
+                matches must satisfy, or a (condition, parameters) tuple, for example
+                ("json_extract(metadata, '$.category') = ?", ('art',)) (default None)
+
+        Returns:
+            a list of matches, as dicts with 'id', 'path', 'metadata', 'score' (the number of
+                words shared) and 'dist' keys
+
+        """
+        probes = set()
+        for i in range(self.N):
+            for code in np.atleast_1d(rec['simple_word_%d' % i]).tolist():
+                probes.add((i, int(code)))
+
+        # the words are integers made here, so they are written into the query rather than
+        # bound, which could run past SQLite's limit on the number of parameters
+        query = ('WITH probes (position, code) AS (VALUES %s) '
+                 'SELECT words.image_id, COUNT(*) AS score FROM probes '
+                 'JOIN words ON words.position = probes.position AND words.code = probes.code '
+                 % ', '.join('(%d, %d)' % probe for probe in sorted(probes)))
+        parameters = ()
+        if pre_filter is not None:
+            if isinstance(pre_filter, (string_types, text_type)):
+                condition, parameters = pre_filter, ()
+            else:
+                condition, parameters = pre_filter
+            query += 'JOIN images ON images.id = words.image_id WHERE %s ' % condition
+        query += 'GROUP BY words.image_id ORDER BY score DESC, words.image_id LIMIT %d' % self.size
+        candidates = self._db.execute(query, tuple(parameters)).fetchall()
+        if not candidates:
+            return []
+
+        scores = dict(candidates)
+        rows = self._db.execute('SELECT id, path, signature, metadata FROM images WHERE id IN (%s)'
+                                % ', '.join(str(image_id) for image_id, _ in candidates)).fetchall()
+        packed = np.array([np.frombuffer(row[2], dtype=np.uint8) for row in rows])
+        signature = pack_signatures(np.array(rec['signature']), n_levels=self.gis.n_levels)
+        dists = packed_normalized_distance(packed, signature, n_levels=self.gis.n_levels)
+
+        return [{'id': image_id, 'score': scores[image_id], 'path': path,
+                 'metadata': json.loads(metadata) if metadata is not None else None, 'dist': dist}
+                for (image_id, path, _, metadata), dist in zip(rows, dists) if dist < self.distance_cutoff]
+
+    def insert_single_record(self, rec, refresh_after=False):
+        error = self.insert_many_records([rec])[0]
+        if error is not None:
+            raise error
+
+    def insert_many_records(self, recs, refresh_after=False):
+        """Add a batch of image records in one transaction.
+
+        Args:
+            recs (list): image records, in the format returned by make_record
+            refresh_after (Optional[boolean]): ignored, records can be found as soon as they
+                are committed (default False)
+
+        Returns:
+            a list holding, for each record, None if it was added or else the exception raised
+                for it. If the transaction fails, every record in it gets the error
+
+        """
+        errors = []
+        rows = []
+        signatures = []
+        for rec in recs:
+            try:
+                metadata = json.dumps(rec['metadata']) if rec.get('metadata') is not None else None
+                signature = np.asarray(rec['signature'], dtype='int8')
+                if signature.shape != (self.gis.sig_length,):
+                    raise ValueError('signature should have length %d (got %r)'
+                                     % (self.gis.sig_length, signature.shape))
+            except Exception as e:
+                errors.append(e)
+                continue
+            rows.append((rec['path'], metadata))
+            signatures.append(signature)
+            errors.append(None)
+
+        if not rows:
+            return errors
+
+        signatures = np.array(signatures)
+        packed = pack_signatures(signatures, n_levels=self.gis.n_levels)
+        # the words are recomputed rather than read from the records, which may hold probes
+        words = simple_words(signatures, self.k, self.N)
+
+        try:
+            with self._db:
+                # take the write lock before reading the last id, so that another process
+                # adding images can't take the same ids in between
+                self._db.execute('BEGIN IMMEDIATE')
+                first = self._db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM images').fetchone()[0]
+                ids = np.arange(first, first + len(rows))
+                self._db.executemany('INSERT INTO images VALUES (?, ?, ?, ?)',
+                                     ((image_id, path, sqlite3.Binary(blob.tobytes()), metadata)
+                                      for image_id, (path, metadata), blob in zip(ids.tolist(), rows, packed)))
+                # rows in key order fill the index's pages one after another, rather than
+                # touching a different page for almost every row
+                positions = np.broadcast_to(np.arange(self.N), words.shape).ravel()
+                image_ids = np.broadcast_to(ids[:, np.newaxis], words.shape).ravel()
+                order = np.lexsort((image_ids, words.ravel(), positions))
+                self._db.executemany('INSERT INTO words VALUES (?, ?, ?)',
+                                     zip(positions[order].tolist(), words.ravel()[order].tolist(),
+                                         image_ids[order].tolist()))
+        except Exception as e:
+            return [e if error is None else error for error in errors]
+
+        return errors
+
+    def close(self):
+        """Closes the database file."""
+        self._db.close()
+
+    def _check_settings(self):
+        """Stores the word and signature settings of a new database, or checks them against
+        those of an existing one."""
+        settings = {'k': self.k, 'N': self.N, 'sig_length': self.gis.sig_length, 'n_levels': self.gis.n_levels}
+        stored = dict(self._db.execute('SELECT name, value FROM settings').fetchall())
+        if not stored:
+            self._db.executemany('INSERT INTO settings VALUES (?, ?)', settings.items())
+            return
+        for name, value in settings.items():
+            if stored.get(name) != value:
+                raise ValueError('database at %s was created with %s=%r, not %r'
+                                 % (self.path, name, stored.get(name), value))
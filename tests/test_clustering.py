@@ -0,0 +1,58 @@
+import pytest
+import numpy as np
+
+from image_match.clustering import cluster_signatures, cluster_images
+from image_match.goldberg import ImageSignature
+from image_match.signature_database_base import normalized_distance
+
+
+def noisy_copies(signature, count, rng, fraction=0.05):
+    copies = np.repeat(signature[np.newaxis], count, axis=0)
+    changed = rng.rand(*copies.shape) < fraction
+    copies[changed] = rng.randint(-2, 3, changed.sum())
+    return copies
+
+
+def test_cluster_signatures():
+    rng = np.random.RandomState(0)
+    originals = rng.randint(-2, 3, (200, 648)).astype('int8')
+    signatures = np.concatenate([originals, noisy_copies(originals[3], 3, rng),
+                                 noisy_copies(originals[50], 1, rng), np.zeros((2, 648), dtype='int8')])
+    order = rng.permutation(len(signatures))
+    signatures = signatures[order]
+    position = np.argsort(order)
+
+    clusters = cluster_signatures(signatures)
+    assert clusters == sorted([sorted(position[[3, 200, 201, 202]]), sorted(position[[50, 203]])])
+
+    # every pair in a cluster of two is within the cutoff
+    a, b = clusters[-1] if len(clusters[-1]) == 2 else clusters[0]
+    assert normalized_distance(signatures[[a]], signatures[b])[0] < 0.45
+
+    assert cluster_signatures(signatures, distance_cutoff=0.) == []
+
+
+def test_cluster_signatures_common_words():
+    # more copies than the window still end up in one cluster
+    rng = np.random.RandomState(1)
+    original = rng.randint(-2, 3, 648).astype('int8')
+    signatures = np.concatenate([noisy_copies(original, 100, rng), rng.randint(-2, 3, (50, 648)).astype('int8')])
+    assert cluster_signatures(signatures, window=4) == [list(range(100))]
+
+
+def test_cluster_signatures_bad_arguments():
+    signatures = np.zeros((3, 648), dtype='int8')
+    with pytest.raises(TypeError):
+        cluster_signatures(signatures, distance_cutoff=1)
+    with pytest.raises(ValueError):
+        cluster_signatures(signatures, window=0)
+
+
+def test_cluster_images():
+    rng = np.random.RandomState(2)
+    # blocky images, and a half-size copy of one
+    images = [np.kron(rng.randint(0, 256, (10, 12, 3)), np.ones((20, 20, 1))).astype('uint8') for _ in range(4)]
+    images.append(images[1][::2, ::2])
+    clusters, errors = cluster_images(images, gis=ImageSignature(), workers=1)
+    assert clusters == [[1, 4]]
+    assert errors == [None] * 5
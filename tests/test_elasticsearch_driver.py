@@ -123,6 +123,36 @@ def test_add_image_with_different_name(ses):
     assert True
 
 
+def test_add_images(ses):
+    errors = ses.add_images(['test1.jpg', 'test2.jpg', 'missing.jpg'], batch_size=2, workers=1,
+                            refresh_after=True)
+    assert errors[:2] == [None, None]
+    assert errors[2] is not None
+    r = ses.search_image('test1.jpg')
+    assert r[0]['path'] == 'test1.jpg'
+    assert r[0]['dist'] == 0.0
+
+
+def test_search_images(ses):
+    ses.add_images(['test1.jpg', 'test2.jpg'], workers=1, refresh_after=True)
+    results, errors = ses.search_images(['test2.jpg', 'missing.jpg', 'test1.jpg'], workers=1)
+    assert errors[0] is None and errors[2] is None
+    assert errors[1] is not None
+    assert results[1] == []
+    assert results[0][0]['path'] == 'test2.jpg'
+    assert results[2][0]['path'] == 'test1.jpg'
+    assert results[2] == ses.search_image('test1.jpg')
+
+
+def test_lookup_with_probes(ses, es, index_name):
+    ses.add_image('test1.jpg', refresh_after=True)
+    probing = SignatureES(es=es, index=index_name, doc_type=DOC_TYPE, n_probes=4)
+    r = probing.search_image('test1.jpg')
+    assert len(r) == 1
+    assert r[0]['path'] == 'test1.jpg'
+    assert r[0]['dist'] == 0.0
+
+
 def test_lookup_from_url(ses):
     ses.add_image('test1.jpg', refresh_after=True)
     r = ses.search_image(test_img_url1)
@@ -1,11 +1,15 @@
 import pytest
+import mmap
+from itertools import product
+import numpy as np
 from numpy import ndarray, array_equal
 try:
     from urllib.request import urlretrieve
 except:
     from urllib import urlretrieve
 
-from image_match.goldberg import ImageSignature, CorruptImageError
+from image_match.goldberg import ImageSignature, CorruptImageError, SignatureProfiler, SignatureWorkspace
+from image_match.goldberg import _crop_limits, _crop_window
 
 test_img_url = 'https://camo.githubusercontent.com/810bdde0a88bc3f8ce70c5d85d8537c37f707abe/68747470733a2f2f75706c6f61642e77696b696d656469612e6f72672f77696b6970656469612f636f6d6d6f6e732f7468756d622f652f65632f4d6f6e615f4c6973612c5f62795f4c656f6e6172646f5f64615f56696e63692c5f66726f6d5f4332524d465f7265746f75636865642e6a70672f36383770782d4d6f6e615f4c6973612c5f62795f4c656f6e6172646f5f64615f56696e63692c5f66726f6d5f4332524d465f7265746f75636865642e6a7067'
 test_diff_img_url = 'https://camo.githubusercontent.com/826e23bc3eca041110a5af467671b012606aa406/68747470733a2f2f63322e737461746963666c69636b722e636f6d2f382f373135382f363831343434343939315f303864383264653537655f7a2e6a7067'
@@ -51,6 +55,47 @@ def test_load_from_corrupt_stream():
         gis.generate_signature(b'corrupt', bytestream=True)
 
 
+def test_load_from_buffers():
+    gis = ImageSignature()
+    with open('test.jpg', 'rb') as f:
+        data = f.read()
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    sig = gis.generate_signature(data, bytestream=True)
+    for buffer in [bytearray(data), memoryview(data), mapped]:
+        assert array_equal(gis.generate_signature(buffer, bytestream=True), sig)
+    # the buffer is released once the image is decoded
+    mapped.close()
+
+
+def test_load_from_corrupt_svg_stream():
+    gis = ImageSignature()
+    with pytest.raises(CorruptImageError):
+        gis.generate_signature(b'<?xml version="1.0"?><svg', bytestream=True)
+
+
+def test_multi_frame_images(tmpdir):
+    from PIL import Image
+    rng = np.random.RandomState(0)
+    frames = [Image.fromarray(rng.randint(0, 256, (120, 160, 3)).astype('uint8')) for _ in range(7)]
+    gis = ImageSignature()
+    for name in ['animation.gif', 'pages.tif']:
+        path = str(tmpdir.join(name))
+        frames[0].save(path, save_all=True, append_images=frames[1:])
+        opened = Image.open(path)
+        expected = []
+        for frame in [0, 3, 6]:
+            opened.seek(frame)
+            expected.append(gis.generate_signature(np.asarray(opened.convert('RGB'))))
+
+        # generate_signature signs the first frame only
+        assert array_equal(gis.generate_signature(path), expected[0])
+        signatures = gis.generate_frame_signatures(path, step=3)
+        assert array_equal(signatures, np.array(expected))
+        with open(path, 'rb') as f:
+            signatures = gis.generate_frame_signatures(f.read(), bytestream=True, step=3, max_frames=2)
+        assert array_equal(signatures, np.array(expected[:2]))
+
+
 def test_all_inputs_same_sig():
     gis = ImageSignature()
     sig1 = gis.generate_signature(test_img_url)
@@ -75,3 +120,246 @@ def test_difference():
     sig2 = gis.generate_signature(test_diff_img_url)
     dist = gis.normalized_distance(sig1, sig2)
     assert dist == 0.424549547059671
+
+
+def test_integral_mean_level():
+    image = np.random.RandomState(0).rand(120, 90)
+    x_coords, y_coords = ImageSignature.compute_grid_points(image, n=9)
+    # P=200 is larger than the image, so every window is clamped at the edges
+    for P in [None, 1, 5, 40, 200]:
+        expected = ImageSignature.compute_mean_level(image, x_coords, y_coords, P=P)
+        actual = ImageSignature.compute_mean_level(image, x_coords, y_coords, P=P,
+                                                   integral_image=True)
+        assert np.allclose(actual, expected, rtol=0, atol=1e-12)
+
+
+def test_integral_mean_level_exact_for_integers():
+    image = np.random.RandomState(0).randint(0, 256, (120, 90)).astype('uint8')
+    x_coords, y_coords = ImageSignature.compute_grid_points(image, n=16)
+    expected = ImageSignature.compute_mean_level(image, x_coords, y_coords)
+    actual = ImageSignature.compute_mean_level(image, x_coords, y_coords, integral_image=True)
+    assert array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('name', ['astronaut', 'camera', 'chelsea', 'coffee', 'moon'])
+@pytest.mark.parametrize('kwargs', [{}, {'dtype': 'uint8'}, {'n': 50}])
+def test_integral_image_signatures(name, kwargs):
+    from skimage import data
+    image = getattr(data, name)()
+    assert array_equal(ImageSignature(integral_image=True, **kwargs).generate_signature(image),
+                       ImageSignature(**kwargs).generate_signature(image))
+
+
+def test_differentials_neighbor_order():
+    grey_levels = np.arange(9.).reshape((3, 3))
+    diffs = ImageSignature.compute_differentials(grey_levels)
+    assert diffs.shape == (3, 3, 8)
+    # the center differs from its neighbors by 4, 3, 2, 1, -1, -2, -3, -4
+    assert array_equal(diffs[1, 1], [4, 3, 2, 1, -1, -2, -3, -4])
+    # the upper left corner only has right, lower and lower right neighbors
+    assert array_equal(diffs[0, 0], [0, 0, 0, 0, -1, 0, -3, -4])
+
+    diffs = ImageSignature.compute_differentials(grey_levels, diagonal_neighbors=False)
+    assert diffs.shape == (3, 3, 4)
+    assert array_equal(diffs[1, 1], [3, 1, -1, -3])
+    assert array_equal(diffs[0, 0], [0, 0, -1, -3])
+
+
+def test_normalize_and_threshold_out():
+    diffs = ImageSignature.compute_differentials(np.random.RandomState(0).rand(9, 9))
+    expected = diffs.copy()
+    ImageSignature.normalize_and_threshold(expected)
+    out = np.empty(diffs.shape, dtype='int8')
+    assert ImageSignature.normalize_and_threshold(diffs, out=out) is out
+    assert array_equal(out, expected)
+
+
+def test_normalize_and_threshold_boundaries():
+    # every difference is +/- 0.5, so they all sit on a level boundary and take the lower level
+    grey_levels = np.array([[0., .5, 1.], [.5, .5, 1.], [1., 1., 1.]])
+    diffs = ImageSignature.compute_differentials(grey_levels)
+    ImageSignature.normalize_and_threshold(diffs)
+    assert set(np.unique(diffs)) == {-1, 0, 1}
+
+    # a difference of exactly 1.0 is the top level
+    grey_levels = np.array([[0., 1.], [1., 1.]])
+    diffs = ImageSignature.compute_differentials(grey_levels)
+    ImageSignature.normalize_and_threshold(diffs)
+    assert set(np.unique(diffs)) == {-2, 0, 2}
+
+
+def test_generate_signatures():
+    gis = ImageSignature()
+    with open('test.jpg', 'rb') as f:
+        data = f.read()
+    signatures, errors = gis.generate_signatures([data, b'corrupt', data], bytestream=True, workers=2)
+    assert signatures.shape == (3, 648)
+    assert signatures.dtype == np.int8
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], CorruptImageError)
+    assert array_equal(signatures[0], gis.generate_signature(data, bytestream=True))
+    assert array_equal(signatures[0], signatures[2])
+    assert not signatures[1].any()
+
+
+def test_reduced_decode():
+    gis = ImageSignature()
+    full = gis.preprocess_image('test.jpg')
+    reduced = gis.preprocess_image('test.jpg', decode_size=100)
+    assert 100 <= min(reduced.shape) <= min(full.shape) // 2
+    with open('test.jpg', 'rb') as f:
+        assert array_equal(reduced, gis.preprocess_image(f.read(), bytestream=True, decode_size=100))
+
+    # the test image is too small to be reduced with the default decode size
+    assert array_equal(ImageSignature(reduced_decode=True).generate_signature('test.jpg'),
+                       gis.generate_signature('test.jpg'))
+
+
+def test_dtype():
+    assert ImageSignature.preprocess_image('test.jpg').dtype == np.float64
+    assert ImageSignature.preprocess_image('test.jpg', dtype='float32').dtype == np.float32
+    grey = ImageSignature.preprocess_image('test.jpg', dtype='uint8')
+    assert grey.dtype == np.uint8
+    assert grey.max() > 1
+
+    sig = ImageSignature().generate_signature('test.jpg')
+    for dtype in ['float32', 'uint8']:
+        other = ImageSignature(dtype=dtype).generate_signature('test.jpg')
+        assert other.dtype == np.int8
+        assert ImageSignature.normalized_distance(sig, other) < 0.2
+
+
+def test_crop_image_uint8():
+    grey = (np.random.RandomState(0).rand(100, 100) * 255).astype(np.uint8)
+    # with dtype='uint8', differences between pixels mustn't wrap around
+    assert _crop_window(grey, 5, 95, False, widen=True) == ImageSignature.crop_image(grey.astype(float))
+    # crop_image differences them as np.diff does, as it always has
+    rw = np.cumsum(np.sum(np.abs(np.diff(grey, axis=1)), axis=1))
+    cw = np.cumsum(np.sum(np.abs(np.diff(grey, axis=0)), axis=0))
+    assert ImageSignature.crop_image(grey) == _crop_limits(rw, cw, grey.shape, 5, 95, False)
+
+
+@pytest.mark.parametrize('name', ['camera', 'moon'])
+def test_greyscale_file_signature(tmpdir, name):
+    # greyscale files are read as uint8 by skimage, and their default signatures must stay
+    # those computed from the uint8 levels as they are, so they still match stored ones
+    from PIL import Image
+    from skimage import data
+    from skimage.io import imread
+    path = str(tmpdir.join(name + '.jpg'))
+    Image.fromarray(getattr(data, name)()).save(path)
+    grey = imread(path, as_gray=True)
+    assert grey.dtype == np.uint8
+
+    gis = ImageSignature()
+    x_coords, y_coords = gis.compute_grid_points(grey, window=gis.crop_image(grey))
+    differentials = gis.compute_differentials(gis.compute_mean_level(grey, x_coords, y_coords))
+    gis.normalize_and_threshold(differentials)
+    expected = np.ravel(differentials).astype('int8')
+    assert array_equal(gis.generate_signature(path), expected)
+    assert array_equal(ImageSignature(workspace=SignatureWorkspace()).generate_signature(path), expected)
+    # the file's array signs the same, as it does for image-space orientations
+    assert array_equal(gis.generate_signature(gis.preprocess_image(path)), expected)
+    assert array_equal(gis.generate_signature(grey), expected)
+    assert array_equal(gis.generate_signature_streaming(grey, strip_height=100), expected)
+
+
+def test_generate_signature_streaming():
+    image = np.asarray(ImageSignature.preprocess_image('test.jpg') * 255, dtype=np.uint8)
+    for gis in [ImageSignature(), ImageSignature(dtype='uint8'), ImageSignature(crop_percentiles=None)]:
+        sig = gis.generate_signature(image)
+        for strip_height in [1, 100, 100000]:
+            assert array_equal(gis.generate_signature_streaming(image, strip_height=strip_height), sig)
+
+
+@pytest.mark.parametrize('square', [False, True])
+def test_orientation_signatures(square):
+    gis = ImageSignature()
+    grey = gis.preprocess_image('test.jpg')
+    if square:
+        # not exact for square images either: the grid is still rounded asymmetrically
+        grey = grey[:min(grey.shape), :min(grey.shape)]
+    variants = gis.orientation_signatures(gis.generate_signature(grey))
+    assert variants.shape == (16, 648)
+    assert array_equal(variants[0], gis.generate_signature(grey))
+
+    # compare with signing transformed images, in the same order
+    distances = []
+    for variant, (inversion, rotations, mirror) in zip(variants, product([1, -1], range(4), [False, True])):
+        transformed = np.rot90(np.fliplr(inversion * grey) if mirror else inversion * grey, rotations)
+        distances.append(gis.normalized_distance(variant, gis.generate_signature(transformed)))
+    # on skimage's sample images, at most 0.105 on average and 0.16 for a single orientation
+    assert np.mean(distances) < 0.15
+    assert np.max(distances) < 0.2
+
+    # a featureless image looks the same in every orientation
+    assert gis.orientation_signatures(np.zeros(648, dtype='int8')).shape == (1, 648)
+
+
+def test_profiler():
+    calls = []
+    profiler = SignatureProfiler(callback=lambda *args: calls.append(args), trace_memory=True)
+    gis = ImageSignature(profiler=profiler)
+    assert array_equal(gis.generate_signature('test.jpg'), ImageSignature().generate_signature('test.jpg'))
+
+    stages = ['preprocess_image', 'crop_image', 'compute_grid_points', 'compute_mean_level',
+              'compute_differentials', 'normalize_and_threshold']
+    assert [call[0] for call in calls] == stages
+    assert calls[0][3] == gis.preprocess_image('test.jpg').shape
+    assert calls[-1][3] == (9, 9, 8)
+    assert all(call[1] >= 0 and call[2] >= 0 for call in calls)
+    assert profiler.stages['preprocess_image']['peak_bytes'] > 0
+
+    gis.generate_signature('test.jpg')
+    assert all(profiler.stages[stage]['calls'] == 2 for stage in stages)
+
+
+def test_profiler_without_reset_peak(monkeypatch):
+    # tracemalloc.reset_peak is new in Python 3.9
+    import tracemalloc
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    calls = []
+    gis = ImageSignature(profiler=SignatureProfiler(callback=lambda *args: calls.append(args), trace_memory=True))
+    gis.generate_signature('test.jpg')
+    assert len(calls) == 6
+    assert all(call[2] >= 0 for call in calls)
+    assert calls[0][2] > 0
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'integral_image': True}, {'dtype': 'float32'}])
+def test_workspace(kwargs):
+    workspace = SignatureWorkspace()
+    gis = ImageSignature(workspace=workspace, **kwargs)
+    expected = ImageSignature(**kwargs)
+    with open('test.jpg', 'rb') as f:
+        data = f.read()
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, (300, 400, 3)).astype('uint8'), 'test.jpg', data,
+              rng.randint(0, 256, (280, 390, 3)).astype('uint8')]
+    for image in images:
+        bytestream = image is data
+        sig = gis.generate_signature(image, bytestream=bytestream)
+        assert array_equal(sig, expected.generate_signature(image, bytestream=bytestream))
+    allocations = workspace.allocations
+
+    # buffers are reused for images no larger than before, and signatures aren't overwritten
+    sigs = [gis.generate_signature(image, bytestream=image is data) for image in images]
+    assert workspace.allocations == allocations
+    assert array_equal(sigs[0], expected.generate_signature(images[0]))
+
+
+def test_generate_video_signatures():
+    rng = np.random.RandomState(0)
+    scenes = [rng.randint(0, 256, (120, 160, 3)).astype('uint8') for _ in range(3)]
+    frames = [scenes[0], scenes[0], scenes[1], scenes[2][:100], scenes[2][:100]]
+    gis = ImageSignature()
+
+    signatures = list(gis.generate_video_signatures(iter(frames)))
+    assert [index for index, _ in signatures] == [0, 1, 2, 3, 4]
+    for frame, (_, sig) in zip(frames, signatures):
+        assert array_equal(sig, gis.generate_signature(frame))
+
+    # repeated frames are skipped
+    indices = [index for index, _ in gis.generate_video_signatures(frames, skip_distance=0.1)]
+    assert indices == [0, 2, 3]
+    assert gis.workspace is None
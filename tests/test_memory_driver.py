@@ -0,0 +1,112 @@
+import pytest
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+from image_match.memory_driver import SignatureMemory
+from image_match.signature_database_base import _record_from_signature
+
+
+def blocky_jpeg(seed, size=256):
+    rng = np.random.RandomState(seed)
+    image = np.kron(rng.randint(0, 256, (8, 8)), np.ones((size // 8, size // 8))).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def noisy_copy(signature, rng, fraction=0.05):
+    copy = signature.copy()
+    changed = rng.rand(copy.size) < fraction
+    copy[changed] = rng.randint(-2, 3, changed.sum())
+    return copy
+
+
+def records(db, signatures, first=0):
+    return [_record_from_signature('image_%d' % (first + i), signature, db.k, db.N, metadata={'n': first + i})
+            for i, signature in enumerate(signatures)]
+
+
+@pytest.mark.parametrize('refresh', [False, True])
+def test_search(refresh):
+    rng = np.random.RandomState(0)
+    signatures = rng.randint(-2, 3, (500, 648)).astype('int8')
+    db = SignatureMemory()
+    assert db.insert_many_records(records(db, signatures), refresh_after=refresh) == [None] * 500
+    assert len(db) == 500
+
+    query = noisy_copy(signatures[123], rng)
+    matches = db.search_single_record(_record_from_signature('query', query, db.k, db.N))
+    assert [match['path'] for match in matches] == ['image_123']
+    assert matches[0]['id'] == 123
+    assert matches[0]['metadata'] == {'n': 123}
+    assert matches[0]['score'] > 10
+
+    # pending images and the posting lists give the same results
+    db.refresh()
+    assert db.search_single_record(_record_from_signature('query', query, db.k, db.N)) == matches
+
+    assert db.search_single_record(_record_from_signature('query', query, db.k, db.N),
+                                   pre_filter=lambda metadata: metadata['n'] != 123) == []
+
+
+def test_incremental_merges():
+    rng = np.random.RandomState(1)
+    signatures = rng.randint(-2, 3, (300, 648)).astype('int8')
+    db = SignatureMemory(pending_limit=16)
+    for start in range(0, 300, 7):
+        db.insert_many_records(records(db, signatures[start:start + 7], first=start))
+        # searching merges the pending images once there are more than pending_limit
+        db.search_single_record(_record_from_signature('query', signatures[start], db.k, db.N))
+    assert db._indexed > 250
+
+    fresh = SignatureMemory()
+    fresh.insert_many_records(records(fresh, signatures), refresh_after=True)
+    db.refresh()
+    assert np.array_equal(db._keys, fresh._keys)
+    assert np.array_equal(db._offsets, fresh._offsets)
+    assert np.array_equal(db._postings, fresh._postings)
+    for i in [0, 150, 299]:
+        query = _record_from_signature('query', signatures[i], db.k, db.N)
+        assert db.search_single_record(query)[0]['path'] == 'image_%d' % i
+
+
+def test_save_and_map(tmpdir):
+    rng = np.random.RandomState(2)
+    signatures = rng.randint(-2, 3, (200, 648)).astype('int8')
+    path = str(tmpdir.join('db'))
+    db = SignatureMemory(path)
+    db.insert_many_records(records(db, signatures[:150]))
+    db.save()
+
+    loaded = SignatureMemory(path)
+    assert len(loaded) == 150
+    # the arrays are mapped, not read
+    assert not loaded._signatures.flags.owndata and not loaded._signatures.flags.writeable
+    query = _record_from_signature('query', signatures[42], db.k, db.N)
+    assert loaded.search_single_record(query) == db.search_single_record(query)
+
+    # adding to a mapped database, and saving it again
+    loaded.insert_many_records(records(loaded, signatures[150:], first=150))
+    query = _record_from_signature('query', signatures[180], db.k, db.N)
+    assert loaded.search_single_record(query)[0]['metadata'] == {'n': 180}
+    loaded.save()
+    assert SignatureMemory(path).search_single_record(query)[0]['path'] == 'image_180'
+
+    with pytest.raises(ValueError):
+        SignatureMemory(path, N=32)
+
+
+def test_add_and_search_images():
+    db = SignatureMemory()
+    data = [blocky_jpeg(seed) for seed in range(4)]
+    assert db.add_images([{'path': str(i), 'img': image} for i, image in enumerate(data)],
+                         bytestream=True, workers=1) == [None] * 4
+    db.add_image('small', img=blocky_jpeg(2, size=128), bytestream=True)
+
+    matches = db.search_image(data[2], bytestream=True)
+    assert [match['path'] for match in matches] == ['2', 'small']
+    assert matches[0]['dist'] == 0.
+
+    with pytest.raises(ValueError):
+        db.insert_single_record({'path': 'bad', 'signature': [0] * 10})
@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+from numpy import array_equal
+
+from image_match.goldberg import ImageSignature
+from image_match.signature_cache import SignatureCache
+
+
+@pytest.fixture
+def image_bytes():
+    from io import BytesIO
+    from PIL import Image
+    from skimage import data
+    buffer = BytesIO()
+    Image.fromarray(data.astronaut()).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_memory_tier(image_bytes):
+    gis = ImageSignature()
+    cache = SignatureCache(max_items=1)
+    sig = cache.generate_signature(gis, image_bytes, bytestream=True)
+    assert array_equal(sig, gis.generate_signature(image_bytes, bytestream=True))
+    assert array_equal(cache.generate_signature(gis, image_bytes, bytestream=True), sig)
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 0, 1)
+
+    # different settings, different signature
+    cache.generate_signature(ImageSignature(n=5), image_bytes, bytestream=True)
+    assert cache.misses == 2
+    # the least recently used entry was dropped
+    cache.generate_signature(gis, image_bytes, bytestream=True)
+    assert cache.misses == 3
+
+
+def test_input_kinds(tmpdir):
+    # a file and its bytes are decoded differently when there is an alpha channel, so they
+    # are cached apart, and the first to arrive doesn't decide the other's signature
+    from PIL import Image
+    rng = np.random.RandomState(0)
+    rgba = np.kron(rng.randint(0, 256, (8, 8, 4)), np.ones((32, 32, 1))).astype(np.uint8)
+    path = str(tmpdir.join('rgba.png'))
+    Image.fromarray(rgba, 'RGBA').save(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    gis = ImageSignature()
+    from_file = gis.generate_signature(path)
+    from_bytes = gis.generate_signature(data, bytestream=True)
+    assert not array_equal(from_file, from_bytes)
+    for first, second in [((path,), (data, True)), ((data, True), (path,))]:
+        cache = SignatureCache()
+        cache.generate_signature(gis, *first)
+        assert array_equal(cache.generate_signature(gis, *second), from_bytes if second[0] is data else from_file)
+        assert cache.misses == 2
+
+    # files with the same content share an entry
+    copy = str(tmpdir.join('copy.png'))
+    with open(copy, 'wb') as f:
+        f.write(data)
+    assert SignatureCache.key(gis, copy) == SignatureCache.key(gis, path)
+
+
+def test_disk_tier(tmpdir, image_bytes):
+    gis = ImageSignature()
+    path = str(tmpdir.join('signatures.sqlite'))
+    sig = SignatureCache(path=path).generate_signature(gis, image_bytes, bytestream=True)
+
+    cache = SignatureCache(path=path)
+    assert array_equal(cache.generate_signature(gis, image_bytes, bytestream=True), sig)
+    assert (cache.hits, cache.disk_hits, cache.misses) == (0, 1, 0)
+
+
+def test_disk_eviction(tmpdir):
+    cache = SignatureCache(max_items=0, path=str(tmpdir.join('signatures.sqlite')), max_disk_bytes=3 * 648)
+    for i in range(5):
+        cache.put(str(i), np.full(648, i % 3 - 1, dtype='int8'))
+    assert cache.get('0') is None
+    assert cache.get('1') is None
+    assert array_equal(cache.get('4'), np.full(648, 0, dtype='int8'))
+
+
+def test_uncacheable():
+    assert SignatureCache.key(ImageSignature(), 'https://example.com/image.jpg') is None
@@ -0,0 +1,304 @@
+import pytest
+import subprocess
+import sys
+import numpy as np
+from numpy import array_equal
+
+from io import BytesIO
+from PIL import Image
+
+from image_match.signature_database_base import SignatureDatabaseBase, _record_from_signature, make_record, normalized_distance,\
+    pack_signatures, unpack_signatures, packed_normalized_distance, normalized_distance_matrix, signature_norms,\
+    get_words, get_words_matrix, max_contrast, words_to_int, simple_words, probe_words
+from image_match.signature_cache import SignatureCache
+from image_match import signature_database_base
+
+
+class MemoryDatabase(SignatureDatabaseBase):
+    """Keeps records in a list, and counts the calls to its insert hooks."""
+
+    def __init__(self, *args, **kwargs):
+        self.records = []
+        self.batches = []
+        super(MemoryDatabase, self).__init__(*args, **kwargs)
+
+    def insert_single_record(self, rec, refresh_after=False):
+        if rec['path'] == 'reject':
+            raise ValueError('rejected')
+        self.records.append(rec)
+
+    def search_single_record(self, rec, pre_filter=None):
+        # candidates share a word, or with probes one of its codes, in the same position
+        words = [set(np.atleast_1d(rec['simple_word_%d' % i]).tolist()) for i in range(self.N)]
+        candidates = [i for i, record in enumerate(self.records)
+                      if any(record['simple_word_%d' % j] in words[j] for j in range(self.N))]
+        if not candidates:
+            return []
+        signatures = np.array([self.records[i]['signature'] for i in candidates])
+        dists = normalized_distance(signatures, np.array(rec['signature']))
+        return [{'id': i, 'path': self.records[i]['path'], 'dist': dist}
+                for i, dist in zip(candidates, dists) if dist < self.distance_cutoff]
+
+
+class BulkMemoryDatabase(MemoryDatabase):
+
+    def insert_many_records(self, recs, refresh_after=False):
+        self.batches.append(len(recs))
+        return super(BulkMemoryDatabase, self).insert_many_records(recs, refresh_after=refresh_after)
+
+    def search_many_records(self, recs, pre_filter=None):
+        self.batches.append(len(recs))
+        self.searched = recs
+        if pre_filter == 'fail':
+            return [RuntimeError('search failed')] * len(recs)
+        return super(BulkMemoryDatabase, self).search_many_records(recs, pre_filter=pre_filter)
+
+
+def blocky_jpeg(seed):
+    rng = np.random.RandomState(seed)
+    image = np.kron(rng.randint(0, 256, (8, 8)), np.ones((32, 32))).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('n_levels', [1, 2, 3])
+def test_pack_signatures(n_levels):
+    signatures = np.random.RandomState(0).randint(-n_levels, n_levels + 1, (20, 648)).astype('int8')
+    packed = pack_signatures(signatures, n_levels=n_levels)
+    assert packed.dtype == np.uint8
+    assert packed.shape[1] <= 648 / 2
+    assert array_equal(unpack_signatures(packed, 648, n_levels=n_levels), signatures)
+    assert array_equal(unpack_signatures(packed[3].tobytes(), 648, n_levels=n_levels), signatures[3])
+
+
+def test_packed_normalized_distance():
+    signatures = np.random.RandomState(0).randint(-2, 3, (20, 648)).astype('int8')
+    signatures[1] = 0
+    packed = pack_signatures(signatures)
+    for i in [0, 1]:
+        assert array_equal(packed_normalized_distance(packed, packed[i]),
+                           normalized_distance(signatures, signatures[i]))
+
+
+def test_normalized_distance_matrix():
+    rng = np.random.RandomState(0)
+    queries = rng.randint(-2, 3, (5, 648)).astype('int8')
+    candidates = rng.randint(-2, 3, (30, 648)).astype('int8')
+    queries[1] = 0
+    candidates[2] = queries[0]
+    expected = np.array([normalized_distance(candidates, query) for query in queries])
+
+    assert array_equal(normalized_distance_matrix(queries, candidates, chunk_size=7), expected)
+    assert array_equal(normalized_distance_matrix(queries, candidates,
+                                                  candidate_norms=signature_norms(candidates)), expected)
+    with pytest.raises(ValueError):
+        normalized_distance_matrix(queries, candidates[:, :100])
+
+
+@pytest.mark.parametrize('k,N', [(16, 63), (10, 40), (7, 648)])
+def test_simple_words(k, N):
+    rng = np.random.RandomState(0)
+    signatures = rng.randint(-2, 3, (50, 648)).astype('int8')
+
+    words = get_words_matrix(signatures, k, N)
+    assert words.shape == (50, N, k)
+    expected = []
+    for i, signature in enumerate(signatures):
+        assert array_equal(words[i], get_words(signature, k, N))
+        single = get_words(signature, k, N)
+        max_contrast(single)
+        expected.append(words_to_int(single))
+
+    assert array_equal(simple_words(signatures, k, N, chunk_size=16), expected)
+    max_contrast(words)
+    assert array_equal(words_to_int(words), expected)
+
+
+def test_get_words_padding():
+    words = get_words(np.array([0, 1, 2, 0, -1, -2, 0, 1]), 3, 4)
+    assert array_equal(words, [[0, 1, 2], [2, 0, -1], [-1, -2, 0], [0, 1, 0]])
+    with pytest.raises(ValueError):
+        simple_words(np.zeros((2, 8)), 9, 4)
+
+
+def test_probe_words():
+    signature = np.array([2, 1, 0, -1, -2, 0, 1, 2])
+    probes = probe_words(signature, 3, 3, 3)
+    assert array_equal(probes[:, 0], simple_words(signature[np.newaxis], 3, 3)[0])
+    # the +-1 trits are changed to 0 first, then the 0 trits to +1 and -1
+    assert probes[0].tolist() == words_to_int(np.array([[1, 1, 0], [1, 0, 0], [1, 1, 1], [1, 1, -1]])).tolist()
+    # the last word runs past the end of the signature, and the padding is left alone
+    assert get_words(signature, 3, 4)[3].tolist() == [1, 2, 0]
+    assert probe_words(signature, 3, 4, 3)[3].tolist() == \
+        words_to_int(np.array([[1, 1, 0], [0, 1, 0], [1, 1, 0], [1, 1, 0]])).tolist()
+    # words of certain trits have nothing to probe
+    assert probe_words(np.array([2, -2, 2]), 3, 1, 2).tolist() == [[words_to_int(np.array([[1, -1, 1]]))[0]] * 3]
+
+
+def test_search_with_probes():
+    rng = np.random.RandomState(0)
+    query = rng.randint(-2, 3, 648).astype('int8')
+    # a near-duplicate where a light difference of every word fell under the tolerance, so no
+    # word matches exactly
+    stored = query.copy()
+    for position in np.linspace(0, 648, 63, endpoint=False).astype('int'):
+        light = position + np.flatnonzero(np.abs(query[position:position + 16]) == 1)
+        stored[light[0]] = 0
+
+    db = MemoryDatabase()
+    db.insert_single_record(_record_from_signature('stored', stored, db.k, db.N))
+    assert db.search_single_record(_record_from_signature('query', query, db.k, db.N)) == []
+
+    rec = _record_from_signature('query', query, db.k, db.N, n_probes=1)
+    assert all(len(rec['simple_word_%d' % i]) == 2 for i in range(db.N))
+    assert [match['path'] for match in db.search_single_record(rec)] == ['stored']
+
+    # the database's n_probes is used for searches, but not for the records it stores
+    probing = BulkMemoryDatabase(n_probes=2)
+    data = blocky_jpeg(0)
+    probing.add_images([{'path': 'a', 'img': data}], bytestream=True, workers=1)
+    assert type(probing.records[0]['simple_word_0']) is int
+    results, errors = probing.search_images([data], bytestream=True, workers=1)
+    assert results[0][0]['path'] == 'a'
+    assert all(len(rec['simple_word_%d' % i]) == 3 for rec in probing.searched for i in range(probing.N))
+    with pytest.raises(ValueError):
+        MemoryDatabase(n_probes=-1)
+
+
+def test_import_is_lazy():
+    # comparing stored signatures shouldn't need the image decoding dependencies
+    loaded = subprocess.check_output([sys.executable, '-c',
+                                      'import sys; import image_match.elasticsearch_driver; '
+                                      'print([m for m in ("skimage", "PIL") if m in sys.modules])'])
+    assert loaded.strip() == b'[]'
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_add_images(tmpdir, workers):
+    paths = []
+    for seed in range(2):
+        path = str(tmpdir.join('%d.jpg' % seed))
+        with open(path, 'wb') as f:
+            f.write(blocky_jpeg(seed))
+        paths.append(path)
+    data = blocky_jpeg(3)
+
+    db = BulkMemoryDatabase()
+    images = paths[:2] + [str(tmpdir.join('missing.jpg')),
+                          {'path': 'stored.jpg', 'img': data, 'metadata': {'tag': 'x'}},
+                          {'path': 'reject', 'img': blocky_jpeg(2)}]
+    errors = db.add_images(images, bytestream=True, batch_size=2, workers=workers)
+
+    assert [error is None for error in errors] == [True, True, False, True, False]
+    assert isinstance(errors[4], ValueError)
+    # the image that couldn't be read never reaches the database
+    assert db.batches == [2, 1, 1]
+
+    # the records are those add_image makes
+    expected = [make_record(paths[0], db.gis, db.k, db.N), make_record(paths[1], db.gis, db.k, db.N),
+                make_record('stored.jpg', db.gis, db.k, db.N, img=data, bytestream=True, metadata={'tag': 'x'})]
+    assert db.records == expected
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_add_images_with_cache(tmpdir, workers):
+    cache = SignatureCache()
+    db = MemoryDatabase(signature_cache=cache)
+    data = [blocky_jpeg(0), blocky_jpeg(1), blocky_jpeg(0)]
+    images = [{'path': str(i), 'img': image} for i, image in enumerate(data)]
+    assert db.add_images(images, bytestream=True, workers=workers) == [None] * 3
+    assert db.add_images(images, bytestream=True, workers=workers) == [None] * 3
+    # signed once each, however many times they were added
+    assert len(cache._memory) == 2
+    assert db.records[0]['signature'] == db.records[2]['signature'] == db.records[5]['signature']
+
+    # files are hashed by the workers, under the keys SignatureCache gives them
+    path = str(tmpdir.join('0.jpg'))
+    with open(path, 'wb') as f:
+        f.write(data[0])
+    assert db.add_images([path, path, str(tmpdir.join('missing.jpg'))], batch_size=2, workers=workers)[:2] == [None] * 2
+    assert SignatureCache.key(db.gis, path) in cache._memory
+    # copies in one batch are both looked up before either is signed
+    assert (cache.hits, cache.misses) == (3, 5)
+
+    with pytest.raises(ValueError):
+        db.add_images(images, batch_size=0)
+
+
+def test_one_pool_per_call(monkeypatch):
+    # the worker processes are started once for all the batches
+    pools = []
+
+    class CountedPool(signature_database_base._SigningPool):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super(CountedPool, self).__init__(*args, **kwargs)
+
+    monkeypatch.setattr(signature_database_base, '_SigningPool', CountedPool)
+    db = BulkMemoryDatabase()
+    data = [blocky_jpeg(seed) for seed in range(5)]
+    assert db.add_images([{'path': str(i), 'img': image} for i, image in enumerate(data)],
+                         bytestream=True, batch_size=2, workers=2) == [None] * 5
+    assert db.batches == [2, 2, 1]
+    assert len(pools) == 1
+
+    results, errors = db.search_images(data, bytestream=True, batch_size=2, workers=2)
+    assert [result[0]['path'] for result in results] == ['0', '1', '2', '3', '4']
+    assert len(pools) == 2
+
+
+def test_search_images():
+    db = BulkMemoryDatabase()
+    data = [blocky_jpeg(seed) for seed in range(3)]
+    db.add_images([{'path': str(i), 'img': image} for i, image in enumerate(data)], bytestream=True, workers=1)
+    db.batches = []
+
+    queries = [data[2], b'not an image', data[0]]
+    results, errors = db.search_images(queries, bytestream=True, batch_size=2, workers=1)
+    assert [error is None for error in errors] == [True, False, True]
+    assert results[1] == []
+    # the same results as searching one image at a time
+    assert results[0] == db.search_image(data[2], bytestream=True)
+    assert results[2] == db.search_image(data[0], bytestream=True)
+    assert results[0][0]['path'] == '2' and results[0][0]['dist'] == 0.
+    assert db.batches == [1, 1]
+
+    # every orientation of every image in one call
+    results, errors = db.search_images(queries, bytestream=True, all_orientations=True, workers=1)
+    assert results[0] == db.search_image(data[2], bytestream=True, all_orientations=True, fast_orientations=True)
+    assert db.batches[-1] > 2
+
+    results, errors = db.search_images(data[:2], bytestream=True, pre_filter='fail', workers=1)
+    assert results == [[], []]
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'uint8'])
+def test_search_inverted_image(dtype):
+    # an inverted copy is found by the image-space orientations, whatever the grey levels' type
+    # negated black pixels stay black when wrapped into uint8, unlike the rest
+    grey = np.kron(np.random.RandomState(0).randint(0, 256, (8, 8)), np.ones((32, 32))).astype(np.uint8)
+    grey[grey < 96] = 0
+    buffers = []
+    for image in [grey, 255 - grey]:
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer, 'PNG')
+        buffers.append(buffer.getvalue())
+    db = MemoryDatabase(dtype=dtype)
+    db.add_image('inverted', img=buffers[1], bytestream=True)
+
+    matches = db.search_image(buffers[0], bytestream=True, all_orientations=True)
+    assert [match['path'] for match in matches] == ['inverted']
+    assert matches[0]['dist'] < 0.05
+
+
+def test_search_greyscale_file_all_orientations(tmpdir):
+    # the image-space orientations sign the file's array, which must sign as the file does
+    path = str(tmpdir.join('grey.jpg'))
+    with open(path, 'wb') as f:
+        f.write(blocky_jpeg(0))
+    db = MemoryDatabase()
+    db.add_image(path)
+    matches = db.search_image(path, all_orientations=True)
+    assert matches[0]['path'] == path and matches[0]['dist'] == 0.
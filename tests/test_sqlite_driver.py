@@ -0,0 +1,148 @@
+import pytest
+import sqlite3
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+from image_match.sqlite_driver import SignatureSQLite
+from image_match.signature_database_base import _record_from_signature
+
+
+def blocky_jpeg(seed, size=256):
+    rng = np.random.RandomState(seed)
+    image = np.kron(rng.randint(0, 256, (8, 8)), np.ones((size // 8, size // 8))).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def noisy_copy(signature, rng, fraction=0.05):
+    copy = signature.copy()
+    changed = rng.rand(copy.size) < fraction
+    copy[changed] = rng.randint(-2, 3, changed.sum())
+    return copy
+
+
+def records(db, signatures, first=0):
+    return [_record_from_signature('image_%d' % (first + i), signature, db.k, db.N,
+                                   metadata={'n': first + i, 'even': (first + i) % 2 == 0})
+            for i, signature in enumerate(signatures)]
+
+
+def test_search():
+    rng = np.random.RandomState(0)
+    signatures = rng.randint(-2, 3, (500, 648)).astype('int8')
+    db = SignatureSQLite()
+    assert db.insert_many_records(records(db, signatures)) == [None] * 500
+    assert len(db) == 500
+    assert db._db.execute('SELECT COUNT(*) FROM words').fetchone()[0] == 500 * db.N
+
+    query = noisy_copy(signatures[123], rng)
+    matches = db.search_single_record(_record_from_signature('query', query, db.k, db.N))
+    assert [match['path'] for match in matches] == ['image_123']
+    assert matches[0]['id'] == 124
+    assert matches[0]['metadata'] == {'n': 123, 'even': False}
+    assert matches[0]['score'] > 10
+    assert matches[0]['dist'] < 0.2
+
+    # the same match with probes, and none when the filter rules it out
+    probed = _record_from_signature('query', query, db.k, db.N, n_probes=2)
+    assert [match['path'] for match in db.search_single_record(probed)] == ['image_123']
+    assert db.search_single_record(_record_from_signature('query', query, db.k, db.N),
+                                   pre_filter="json_extract(metadata, '$.even')") == []
+    assert db.search_single_record(_record_from_signature('query', query, db.k, db.N),
+                                   pre_filter=("json_extract(metadata, '$.n') = ?", (123,))) == matches
+
+
+def test_batches_and_errors():
+    rng = np.random.RandomState(1)
+    signatures = rng.randint(-2, 3, (60, 648)).astype('int8')
+    db = SignatureSQLite(size=5)
+    recs = records(db, signatures)
+    recs[3] = {'path': 'bad', 'signature': [0] * 10}
+    errors = db.insert_many_records(recs)
+    assert isinstance(errors[3], ValueError)
+    assert errors[:3] == [None] * 3 and errors[4:] == [None] * 56
+    assert len(db) == 59
+
+    # ids carry on from the last batch
+    db.insert_single_record(records(db, signatures[:1], first=60)[0])
+    assert db._db.execute('SELECT MAX(id) FROM images').fetchone()[0] == 60
+    matches = db.search_single_record(_record_from_signature('query', signatures[0], db.k, db.N))
+    assert sorted(match['path'] for match in matches) == ['image_0', 'image_60']
+    assert all(match['dist'] == 0. for match in matches)
+
+    with pytest.raises(ValueError):
+        db.insert_single_record(recs[3])
+
+    # a failed transaction adds nothing, and every record in it gets the error
+    db._db.execute('CREATE TRIGGER fail BEFORE INSERT ON words BEGIN SELECT RAISE(ABORT, "full"); END')
+    errors = db.insert_many_records(records(db, signatures[:2], first=61))
+    assert all(isinstance(error, sqlite3.Error) for error in errors)
+    assert len(db) == 60
+
+
+def test_reopen(tmpdir):
+    rng = np.random.RandomState(2)
+    signatures = rng.randint(-2, 3, (100, 648)).astype('int8')
+    path = str(tmpdir.join('signatures.sqlite'))
+    db = SignatureSQLite(path)
+    db.insert_many_records(records(db, signatures))
+    query = _record_from_signature('query', signatures[42], db.k, db.N)
+    matches = db.search_single_record(query)
+    db.close()
+
+    reopened = SignatureSQLite(path)
+    assert len(reopened) == 100
+    assert reopened._db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert reopened.search_single_record(query) == matches
+    reopened.close()
+
+    with pytest.raises(ValueError):
+        SignatureSQLite(path, N=32)
+
+
+def test_add_and_search_images():
+    db = SignatureSQLite()
+    data = [blocky_jpeg(seed) for seed in range(4)]
+    assert db.add_images([{'path': str(i), 'img': image} for i, image in enumerate(data)],
+                         bytestream=True, workers=1) == [None] * 4
+    db.add_image('small', img=blocky_jpeg(2, size=128), bytestream=True)
+
+    matches = db.search_image(data[2], bytestream=True)
+    assert [match['path'] for match in matches] == ['2', 'small']
+    assert matches[0]['dist'] == 0.
+
+    results, errors = db.search_images([data[1], data[3]], bytestream=True, workers=1)
+    assert errors == [None, None]
+    assert [[match['path'] for match in result][0] for result in results] == ['1', '3']
+
+
+def test_concurrent_writers(tmpdir):
+    # a batch added while another connection is writing waits for it, rather than reading the
+    # same last id and failing on the ids it then takes
+    import threading
+    rng = np.random.RandomState(3)
+    signatures = rng.randint(-2, 3, (4, 648)).astype('int8')
+    path = str(tmpdir.join('signatures.sqlite'))
+    other = SignatureSQLite(path)
+
+    # another process in the middle of adding an image
+    other._db.execute('BEGIN IMMEDIATE')
+    other._db.execute("INSERT INTO images VALUES (1, 'other', NULL, NULL)")
+    errors = []
+
+    def add():
+        db = SignatureSQLite(path)
+        errors.extend(db.insert_many_records(records(db, signatures)))
+        db.close()
+
+    writer = threading.Thread(target=add)
+    writer.start()
+    writer.join(0.5)
+    other._db.commit()
+    writer.join()
+
+    assert errors == [None] * 4
+    assert [row[0] for row in other._db.execute('SELECT path FROM images ORDER BY id')] == \
+        ['other', 'image_0', 'image_1', 'image_2', 'image_3']